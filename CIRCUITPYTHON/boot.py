@@ -0,0 +1,13 @@
+"""
+Makes the CIRCUITPY drive writable for CircuitPython (e.g. for the flash journal of the measurements), then it's
+read-only over USB. Hold the left button during a reset to keep the drive writable over USB for development.
+"""
+import board
+import digitalio
+import storage
+
+with digitalio.DigitalInOut(board.D11) as left_button:
+    left_button.switch_to_input(digitalio.Pull.UP)
+    usb_write_access = not left_button.value
+
+storage.remount('/', readonly=usb_write_access)
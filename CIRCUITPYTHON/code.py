@@ -5,25 +5,50 @@ t_start = time.monotonic()  # To accurately measure the startup time
 import digitalio
 import board
 
+import alarm
+
 i2c_power = digitalio.DigitalInOut(board.I2C_POWER)
-i2c_power.switch_to_input()
+# If the TMF8821 was kept in standby over the deep sleep (TOF_POWER), the last byte of the sleep memory holds the level
+# that powers the I2C rail plus one. Drive it right away, the sensor keeps its firmware only while it's powered.
+i2c_power_on = alarm.sleep_memory[-1] - 1 if alarm.wake_alarm is not None else None
+if i2c_power_on in (0, 1):
+    i2c_power.switch_to_output(bool(i2c_power_on))
+else:
+    i2c_power_on = None
+    i2c_power.switch_to_input()
 
 # ===================== CONSTANTS =======================
 BOOT_TIME = 1.3  # second
 GRAPH_WIDTH = 256  # pixel
+HISTORY_BYTES = 2 * GRAPH_WIDTH + 8  # sleep memory per history incl. archive and time deltas, as 256 16 bit values
+ARCHIVE_TIERS = [(12, 16)]  # (buckets, samples per bucket) tiers of the samples aged out of the full resolution history
+ARCHIVE_ZOOM = 2  # the archive view shows this many times the time of the normal view, see imgs/background_archive.bmp
+RECORD_CAPACITY = 384  # measurement records of 8 bytes each, same memory as 256 records of 16 bit channels
+JOURNAL_DIR = '/journal'  # flash journal of the records, survives a loss of the sleep memory
+JOURNAL_FILES = 4
+JOURNAL_PAGES_PER_FILE = 16  # 64 pages of 30 records, ~5 days at a 4 minute interval
+JOURNAL_LOW_BATTERY = 10  # %, below this every record is journaled at once, the sleep memory dies with the battery
 DEBUG = False
 DEBUG_DELAY = 0.0
 FRIDGE_SLEEP_TIME_FACTOR = 3
 FRIDGE_MAX_TEMP = 10
 INVERTED = False
 INTERVAL_MINUTES = 4
+I2C_FREQUENCY = 125000  # Hz
+TOF_POWER = 'off'  # TMF8821 in deep sleep: 'off' cuts the I2C rail, 'standby' keeps it powered in standby, 'auto'
+# chooses the cheaper for the sleep time, see experiments/tmf8821/standby_energy_model.py. Standby needs CircuitPython 8
+TOF_STANDBY_UA = 60  # µA drawn from the I2C rail with the TMF8821 in standby and the other sensors idle (estimate)
+TOF_COLD_START_MAS = 12  # mAs of the awake board for the firmware download, configuration and calibration (estimate)
+TOF_I2C_FREQUENCY = 400000  # Hz, while only the TMF8821 is used: its firmware download is most of the bus traffic
+CYCLE_DROP = 10.0  # percentage points below the maximum that confirm the peak of a rise cycle
+CYCLE_RISE = 30.0  # percentage points above the minimum of a collapse that start a new cycle (a feeding)
 TELEMETRY = True
 INFLUXDB_MEASUREMENT = "rise"
 DEVICE_NAME = "ESP32-S2"
+SLEEP_MEMORY_VERSION = 2  # Increase when the meaning of stored bytes changes without a change of the layout
 # =======================================================
 
-from math import sqrt, floor, ceil
-import alarm
+from math import floor, ceil
 import busio
 import neopixel
 import adafruit_bme280.advanced as adafruit_bme280
@@ -61,14 +86,19 @@ rgb_led = neopixel.NeoPixel(board.NEOPIXEL, 1)
 rgb_led.fill((0, 0, 255))
 
 # Power up i2c devices
-default_state = i2c_power.value
-i2c_power.switch_to_output(not default_state)
+if i2c_power_on is None:
+    i2c_power_on = not i2c_power.value
+    i2c_power.switch_to_output(i2c_power_on)
 
 from utils.eink_constants import PaletteColor
 from utils.graph_plot import GraphPlot
-from utils.sleep_memory import CyclicBuffer, Cyclic16BitTempBuffer, Cyclic16BitPercentageBuffer, SingleIntMemory
+from utils.sleep_memory import CyclicDeltaTempBuffer, CyclicDeltaPercentageBuffer, SingleIntMemory, \
+    SleepMemoryLayout, SleepMemorySession, TieredHistory, CyclicRecordBuffer, CyclicMeasurementRecordBuffer, \
+    PeakDetectorMemory, GrowthForecastMemory, HampelFilterMemory
 from utils.battery_widget import BatteryWidget, BLACK, DARK, WHITE
-from utils.algorithm import peak_detect
+from utils.flash_journal import FlashJournal
+from utils.algorithm import spad_statistics, apply_taps, CycleSegmenter, segment_cycles
+from utils.savgol_taps import SAVGOL_WINDOW, SMOOTH_TAPS, SMOOTH_DENOMINATOR, SLOPE_TAPS, SLOPE_DENOMINATOR
 
 rgb_led.deinit()
 
@@ -78,6 +108,7 @@ rgb_led.deinit()
 class Zoom:
     on = 1
     off = 2
+    archive = 3  # ARCHIVE_ZOOM times the normal view, from the consolidated tiers of the history
 
 
 class PlotType:
@@ -101,12 +132,17 @@ def read_latest_data_file() -> list:
         data_files = [f for f in files if f.startswith('data_') and f.endswith('.csv')]
         if data_files:
             latest_number = int(sorted(data_files, reverse=True)[0][5:8])
-            # Read growth values into arrays
+            # Read growth values into arrays. The growth column is found by the header of the records (see
+            # log_data_to_sd_card), files without a header hold the growth in the first column.
+            growth_column = 0
             with open(f'/sd/data_{latest_number:03d}.csv', 'r') as file:
                 for line in file.readlines():
-                    growth, temp = line.split(',')
+                    columns = line.strip().split(',')
+                    if 'growth' in columns:
+                        growth_column = columns.index('growth')
+                        continue
                     try:
-                        array.append(float(growth))
+                        array.append(float(columns[growth_column]))
                     except Exception:
                         pass
         # Close SD card connection
@@ -148,48 +184,49 @@ def read_external_environment(i2c_device: busio.I2C, retry_temp=3, temp_invalid=
     return temperature, humidity
 
 
-def read_distance(i2c_device: busio.I2C, oversampling: int = 5) -> tuple[float, float, float]:
+def read_distance(i2c_device: busio.I2C, oversampling: int = 5, standby: bool = False) -> tuple[float, float, float]:
+    # With standby, the sensor is left in standby afterwards, it keeps its firmware and configuration if the I2C rail
+    # stays powered
     try:
         tof = TMF8821(i2c_device)
         tof.config.iterations = 3.5e6
         tof.config.period_ms = 1  # as small as possible for repeated measurements
         tof.config.spad_map = '3x3_normal_mode'
         tof.config.spread_spectrum_factor = 3
-        tof.active_range = 'short'
-        tof.write_configuration()
-        tof.load_factory_calibration(calib_folder='calibration')
-
-        all_distances = [[] for _ in range(3 * 3)]  # 9x5 nested list
-        spad_means = [0] * (3 * 3)
+        tof.config.keep_pll_running = False  # would multiply the standby current
+        tof.result_header = False  # only the distances are used, read just the registers of the 9 zones
+        if tof.firmware_downloaded:
+            tof.active_range = 'short'
+            tof.write_configuration()
+            tof.load_factory_calibration(calib_folder='calibration')
+        elif DEBUG:
+            print('TMF8821 woke up from standby, firmware and configuration reused')
+
+        # Integer sums of the distances (mm) and of their squares per spad, floats are only created for the results
+        spad_sums = [0] * (3 * 3)
+        spad_square_sums = [0] * (3 * 3)
 
         tof.start_measurements()
         for measurement_repetition in range(oversampling):
             measurement = tof.wait_for_measurement(timeout_ms=500)
             for i_spad, distance in enumerate(measurement.distances):
-                all_distances[i_spad].append(distance)
-                spad_means[i_spad] += distance
+                spad_sums[i_spad] += distance
+                spad_square_sums[i_spad] += distance * distance
         tof.stop_measurements()
 
-        # Calculate per-spad cell mean
-        spad_means = [spad_sum / oversampling for spad_sum in spad_means]
-        global_distance = sum(spad_means) / len(spad_means)
-        global_roughness = max(spad_means) - min(spad_means)
-
-        # Calculate per-spad standard deviation
-        spad_stddevs = []
-        for i_spad, (spad_distances, spad_mean) in enumerate(zip(all_distances, spad_means)):
-            spad_stddevs.append(sqrt(sum([(d - spad_mean) ** 2 for d in spad_distances]) / len(spad_distances)))
-
-        global_stddev = sum(spad_stddevs) / len(spad_stddevs)
+        global_distance, global_stddev, global_roughness = spad_statistics(spad_sums, spad_square_sums, oversampling)
         if DEBUG:
             print(f'Distance: {global_distance:.2f} with std = {global_stddev} and roughness = {global_roughness}')
+        if standby:
+            tof.standby()
         return global_distance, global_stddev, global_roughness
     except Exception:
         return None, None, None
 
 
 def draw_texts(group, font_normal, font_bold, ext_temp, ext_humidity, board_temp, board_humidity, growth_percentage,
-               peak_percentage, peak_hours, text_line1_y=7, text_line2_y=20):
+               peak_percentage, peak_hours, forecast_percentage=None, forecast_hours=None, growth_rate=None,
+               text_line1_y=7, text_line2_y=20):
     # Label for in: text
     group.append(bitmap_label.Label(font_normal, color=DARK, text='in:', x=2, y=text_line2_y))
     # Label for in temperature
@@ -210,6 +247,11 @@ def draw_texts(group, font_normal, font_bold, ext_temp, ext_humidity, board_temp
         # Label for growth percentage
         group.append(bitmap_label.Label(font_bold, color=BLACK, text=f'{growth_percentage:.0f}%', x=187,
                                         y=text_line1_y))
+        if growth_rate is not None:
+            # Label for the smoothed growth rate in percentage points per hour, in the free slot left of 'Growth:'.
+            # The fonts only contain the characters of fonts/characters.txt, hence 'ph' instead of '/h'.
+            group.append(bitmap_label.Label(font_normal, color=DARK, text=f'{growth_rate:+.0f}%ph', x=84,
+                                            y=text_line1_y))
     if peak_percentage is not None:
         # Label for ago hour
         group.append(bitmap_label.Label(font_normal, color=BLACK, text=f'{peak_hours:.1f}h', x=140, y=text_line2_y))
@@ -219,9 +261,19 @@ def draw_texts(group, font_normal, font_bold, ext_temp, ext_humidity, board_temp
         # Label for growth during peak
         group.append(bitmap_label.Label(font_bold, color=BLACK, text=f'{peak_percentage:.0f}%', x=194 + x_off,
                                         y=text_line2_y))
+    elif forecast_percentage is not None:
+        # Label for the hours until the expected peak
+        group.append(bitmap_label.Label(font_normal, color=BLACK, text=f'{forecast_hours:.1f}h', x=140,
+                                        y=text_line2_y))
+        x_off = 0 if len(f'{forecast_hours:.1f}h') <= 4 else 6
+        # Label for to: text
+        group.append(bitmap_label.Label(font_normal, color=DARK, text='to:', x=167 + x_off, y=text_line2_y))
+        # Label for the expected peak growth, normal font and 'ca' as it's only a forecast (the fonts have no '~')
+        group.append(bitmap_label.Label(font_normal, color=BLACK, text=f'ca{forecast_percentage:.0f}%', x=187 + x_off,
+                                        y=text_line2_y))
 
 
-def log_data_to_sd_card(floor_calib: int, start_calib: int, temp_buffer: CyclicBuffer, growth_buffer: CyclicBuffer):
+def log_data_to_sd_card(floor_calib: int, start_calib: int, record_buffer: CyclicRecordBuffer):
     import os
     import sdcardio
     import storage
@@ -239,24 +291,24 @@ def log_data_to_sd_card(floor_calib: int, start_calib: int, temp_buffer: CyclicB
             else:
                 next_number = 0
 
-            # Read both buffers into arrays
-            growth_array = growth_buffer.read_array()
-            temp_array = temp_buffer.read_array()
-
             with open(f'/sd/data_{next_number:03d}.csv', 'w') as file:
                 file.write(f'# Floor distance: {floor_calib}mm, start height: {start_calib}mm\n')
-                file.write('growth,temp\n')
-                max_rows = max(len(growth_array), len(temp_array))
-                for i in range(max_rows):
-                    i_growth = i - (max_rows - len(growth_array))
-                    i_temp = i - (max_rows - len(temp_array))
-                    if i_growth >= 0:
-                        file.write(f'{growth_array[i_growth]:.2f},')
-                    else:
-                        file.write(',')
-                    if i_temp >= 0:
-                        file.write(f'{temp_array[i_temp]:.2f}')
+                file.write(','.join(record_buffer.channel_names) + '\n')
+                # Segment the growth into rise cycles in the same pass
+                growth_channel = record_buffer.channel_names.index('growth')
+                segmenter = CycleSegmenter(CYCLE_DROP, CYCLE_RISE)
+                # Stream the records row by row instead of decoding all columns up front
+                for row in record_buffer.iter_rows():
+                    # Missing values (NaN) are written as empty fields
+                    file.write(','.join('' if val != val else f'{val:.2f}' for val in row))
                     file.write('\n')
+                    growth = row[growth_channel]
+                    segmenter.add(None if growth != growth else growth)
+            with open(f'/sd/cycles_{next_number:03d}.csv', 'w') as file:
+                # Rows of data_*.csv
+                file.write('start,peak,peak_growth\n')
+                for start_ind, peak_ind, peak_val in segmenter.cycles:
+                    file.write(f'{start_ind},{peak_ind},{peak_val:.2f}\n')
             # Close SD card connection and safely unmount
             sd.sync()
             storage.umount(vfs)
@@ -265,6 +317,30 @@ def log_data_to_sd_card(floor_calib: int, start_calib: int, temp_buffer: CyclicB
             print(f'Couldn\'t write to SD card: {e}')
 
 
+def restore_from_journal(journal: FlashJournal, record_buffer: CyclicRecordBuffer, histories: dict,
+                         filters: dict = None) -> int:
+    # After a loss of the sleep memory: refill the records and the given histories (by record channel name) from the
+    # flash journal, record by record. Histories which survived must not be passed, they already hold the samples.
+    # The records hold the measured values, so a channel with a filter (by name, e.g. the Hampel filter of the growth)
+    # passes it before its history, as on every wake.
+    if filters is None:
+        filters = {}
+    n_records = 0
+    for chunk in journal.read_records(max_records=record_buffer.value_capacity):
+        record = record_buffer.decode(chunk)
+        record_buffer.add_value(record)
+        minutes = INTERVAL_MINUTES if record['minutes'] is None else int(record['minutes'])
+        for name, history in histories.items():
+            if record[name] is None:
+                history.add_gap(minutes)
+            elif name in filters:
+                history.add_value(filters[name].filter(record[name]), minutes=minutes)
+            else:
+                history.add_value(record[name], minutes=minutes)
+        n_records += 1
+    return n_records
+
+
 def log_exception_to_sd_card(exc):
     import traceback
     import sdcardio
@@ -319,6 +395,8 @@ def connect_to_wifi() -> str:
 
 # ===================== MAIN CODE =======================
 
+# Collects the changes of persistent settings and buffer headers, they are written once before the deep sleep
+memory_session = SleepMemorySession()
 
 try:
     displayio.release_displays()
@@ -345,14 +423,76 @@ try:
             wake_reason = 'middle'
 
     # Set up persistent memory
-    plot_type_mem = SingleIntMemory(addr=0, default_value=PlotType.growth)
-    zoom_mem = SingleIntMemory(addr=plot_type_mem.get_last_address(), default_value=Zoom.on)
-    floor_distance_mem = SingleIntMemory(addr=zoom_mem.get_last_address(), default_value=0)
-    start_height_mem = SingleIntMemory(addr=floor_distance_mem.get_last_address(), default_value=0)
-    temp_mem = Cyclic16BitTempBuffer(addr=start_height_mem.get_last_address(), max_value_capacity=GRAPH_WIDTH)
-    growth_mem = Cyclic16BitPercentageBuffer(addr=temp_mem.get_last_address(), max_value_capacity=GRAPH_WIDTH)
-    wifi_idx_mem = SingleIntMemory(addr=growth_mem.get_last_address(), default_value=0, invalid_value=-1, size=1)
-    wifi_chan_mem = SingleIntMemory(addr=wifi_idx_mem.get_last_address(), default_value=0, invalid_value=-1, size=1)
+    memory_layout = SleepMemoryLayout(version=SLEEP_MEMORY_VERSION, session=memory_session, regions=[
+        ('plot_type', SingleIntMemory, {'default_value': PlotType.growth}),
+        ('zoom', SingleIntMemory, {'default_value': Zoom.on}),
+        ('floor_distance', SingleIntMemory, {'default_value': 0}),
+        ('start_height', SingleIntMemory, {'default_value': 0}),
+        ('temp', TieredHistory, {'base_class': CyclicDeltaTempBuffer, 'base_kwargs': {'aggregates': True},
+                                 'tiers': ARCHIVE_TIERS, 'minutes_per_sample': INTERVAL_MINUTES,
+                                 'max_bytes': HISTORY_BYTES}),
+        ('growth', TieredHistory, {'base_class': CyclicDeltaPercentageBuffer, 'base_kwargs': {'aggregates': True},
+                                   'tiers': ARCHIVE_TIERS, 'minutes_per_sample': INTERVAL_MINUTES,
+                                   'max_bytes': HISTORY_BYTES}),
+        ('records', CyclicMeasurementRecordBuffer, {'max_value_capacity': RECORD_CAPACITY}),
+        ('wifi_idx', SingleIntMemory, {'default_value': 0, 'invalid_value': -1, 'size': 1}),
+        ('wifi_chan', SingleIntMemory, {'default_value': 0, 'invalid_value': -1, 'size': 1}),
+        ('sleep_minutes', SingleIntMemory, {'default_value': INTERVAL_MINUTES, 'size': 1}),
+        ('journal_pending', SingleIntMemory, {'default_value': 0, 'invalid_value': -1}),
+        ('journal_seq', SingleIntMemory, {'default_value': 0, 'invalid_value': -1, 'size': 4}),
+        ('growth_peak', PeakDetectorMemory, {'threshold': 1.0, 'window_size': 7,
+                                             'value_scale': CyclicDeltaPercentageBuffer.value_scale}),
+        ('growth_forecast', GrowthForecastMemory, {}),
+        ('growth_filter', HampelFilterMemory, {'value_scale': CyclicDeltaPercentageBuffer.value_scale}),
+    ])
+    memory = memory_layout.load()
+    plot_type_mem = memory['plot_type']
+    zoom_mem = memory['zoom']
+    floor_distance_mem = memory['floor_distance']
+    start_height_mem = memory['start_height']
+    temp_mem = memory['temp']
+    growth_mem = memory['growth']
+    records_mem = memory['records']
+    wifi_idx_mem = memory['wifi_idx']
+    wifi_chan_mem = memory['wifi_chan']
+    sleep_minutes_mem = memory['sleep_minutes']
+    journal_pending_mem = memory['journal_pending']
+    journal_seq_mem = memory['journal_seq']
+    growth_peak_mem = memory['growth_peak']
+    growth_forecast_mem = memory['growth_forecast']
+    growth_filter_mem = memory['growth_filter']
+    assert memory_layout.free_bytes() >= 1, 'The last byte of the sleep memory is reserved for the I2C rail level'
+    if DEBUG:
+        print(f'Sleep memory: initialized {memory_layout.initialized_regions}, {memory_layout.free_bytes()}B free')
+
+    # The position in the flash journal is unknown after a loss of the sleep memory, the journal finds it by a scan
+    journal = FlashJournal(JOURNAL_DIR, records_mem.bytes_per_value, n_files=JOURNAL_FILES,
+                           pages_per_file=JOURNAL_PAGES_PER_FILE,
+                           next_sequence=None if 'journal_seq' in memory_layout.initialized_regions else
+                           journal_seq_mem.value)
+    if 'records' in memory_layout.initialized_regions:
+        t_restore = time.monotonic()
+        # Only the histories which were lost along with the records, e.g. not after a changed record layout
+        lost_histories = {name: history for name, history in (('growth', growth_mem), ('temp', temp_mem))
+                          if name in memory_layout.initialized_regions}
+        if 'growth' in lost_histories:
+            growth_filter_mem.reset()
+        n_restored = restore_from_journal(journal, records_mem, lost_histories, filters={'growth': growth_filter_mem})
+        if 'growth' in lost_histories:
+            growth_peak_mem.reset()
+            growth_forecast_mem.reset()
+        journal_seq_mem.value = journal.next_sequence
+        if DEBUG:
+            print(f'Restored {n_restored} records from the flash journal in {time.monotonic() - t_restore:.2f}s')
+
+    # Minutes since the previous sample: the planned sleep time after a timeout. A button press interrupts the sleep in
+    # average after 1/2 of the sleep time.
+    if wake_reason == 'timeout':
+        sample_minutes = sleep_minutes_mem.value
+    elif wake_reason in ['left', 'middle']:
+        sample_minutes = max(1, sleep_minutes_mem.value // 2)
+    else:
+        sample_minutes = INTERVAL_MINUTES
 
     plot_type = plot_type_mem.value
     plot_zoomed = zoom_mem.value
@@ -378,8 +518,10 @@ try:
         if growth_array:
             # Try to find the latest file on the SD card and replay it
             growth_mem.make_empty()
-            for val in growth_array:
-                growth_mem.add_value(val)
+            growth_mem.add_values(growth_array)
+            growth_peak_mem.reset()
+            growth_forecast_mem.reset()
+            growth_filter_mem.reset()
             if DEBUG:
                 print(f'Filled growth buffer with {len(growth_array)} values from SD card')
             message_lines['tmf8821'] = (f'{len(growth_array)} growth values loaded from SD card', False)
@@ -387,6 +529,9 @@ try:
             # Otherwise, fill randomly
             temp_mem.fill_randomly(19.0, 29.0)
             growth_mem.fill_randomly(100.0, 150.0)
+            growth_peak_mem.reset()
+            growth_forecast_mem.reset()
+            growth_filter_mem.reset()
             if DEBUG:
                 print('Filled both buffers with mock values')
             message_lines['tmf8821'] = (f'Growth and temp randomized', False)
@@ -400,7 +545,7 @@ try:
     # Initialize I2C
     if DEBUG:
         print(f'Wake time until i2c init: {BOOT_TIME + time.monotonic() - t_start:.2}s')
-    i2c = busio.I2C(board.SCL, board.SDA, frequency=125000)
+    i2c = busio.I2C(board.SCL, board.SDA, frequency=I2C_FREQUENCY)
 
     # Read outside temperature and humidity from BME280 sensor
     board_temp, board_humidity = read_board_environment(i2c)
@@ -412,16 +557,34 @@ try:
     # Read inside temperature and humidity from AM2320 sensor
     ext_temp, ext_humidity = read_external_environment(i2c)
     if ext_temp is not None:
-        temp_mem.add_value(ext_temp)
+        temp_mem.add_value(ext_temp, minutes=sample_minutes)
     else:
+        temp_mem.add_gap(sample_minutes)
         message_lines['am2320'] = (' Cannot read from AM2320 ', True)
 
     if DEBUG:
         print("AM2320 read.")
         time.sleep(DEBUG_DELAY)
 
-    # Read time-of-flight distance from TMF8821 sensor
-    current_distance, distance_std, roughness = read_distance(i2c)
+    sleep_time = INTERVAL_MINUTES * 60
+    # If in refrigerator, update everything slower. Every sample stores the minutes since the previous one, so neither
+    # this nor an early button wake need any compensation on the x-axis.
+    if ext_temp is not None and ext_temp < FRIDGE_MAX_TEMP:
+        sleep_time *= FRIDGE_SLEEP_TIME_FACTOR
+    # Keep the TMF8821 powered in standby over the deep sleep if that costs less than its cold start on the next wake
+    tof_standby = TOF_POWER == 'standby' or \
+        TOF_POWER == 'auto' and TOF_STANDBY_UA / 1000 * sleep_time < TOF_COLD_START_MAS
+
+    # Read time-of-flight distance from TMF8821 sensor, on a faster bus clock
+    if TOF_I2C_FREQUENCY != I2C_FREQUENCY:
+        i2c.deinit()
+        i2c = busio.I2C(board.SCL, board.SDA, frequency=TOF_I2C_FREQUENCY)
+    current_distance, distance_std, roughness = read_distance(i2c, standby=tof_standby)
+    # A sensor that couldn't be read starts cold on the next wake
+    tof_standby = tof_standby and current_distance is not None
+    if TOF_I2C_FREQUENCY != I2C_FREQUENCY:
+        i2c.deinit()
+        i2c = busio.I2C(board.SCL, board.SDA, frequency=I2C_FREQUENCY)
 
     # Handle distance and calibrations
     growth_percentage = None
@@ -467,14 +630,18 @@ try:
     battery_percentage = LC709203F(i2c).cell_percent
     if DEBUG:
         print(f'Battery percentage: {battery_percentage}')
+    # Journal this wake's record even if the page isn't full yet: with a low battery, and before the growth is cleared
+    # by a calibration (a new dough)
+    journal_now = battery_percentage < JOURNAL_LOW_BATTERY
 
-    # Disable power to I2C bus
-    i2c_power.switch_to_input()
+    # Disable power to I2C bus, unless the TMF8821 stays in standby
+    if not tof_standby:
+        i2c_power.switch_to_input()
 
     # Button press logic
     if left_button_pressed and middle_button_pressed:
         # Both buttons pressed --> Store log
-        log_data_to_sd_card(floor_distance, start_height, temp_mem, growth_mem)
+        log_data_to_sd_card(floor_distance, start_height, records_mem)
         if DEBUG:
             print(f'Logged data to SD card')
         if message_lines['height_calibration'][0] == '':
@@ -494,6 +661,10 @@ try:
                 growth_perc_std = None
                 # Also reset history of growths
                 growth_mem.make_empty()
+                journal_now = True
+                growth_peak_mem.reset()
+                growth_forecast_mem.reset()
+                growth_filter_mem.reset()
         else:
             # Left button clicked --> toggle plot type
             new_plot_type = 3 - plot_type
@@ -519,33 +690,94 @@ try:
                         growth_perc_std = distance_std / start_height * 100
                         # Also clear growth mem
                         growth_mem.make_empty()
+                        journal_now = True
+                        growth_peak_mem.reset()
+                        growth_forecast_mem.reset()
+                        growth_filter_mem.reset()
                 else:
                     if DEBUG:
                         print(f'Start height {dough_height / 10:.1f}cm is lower than floor height {floor_distance}mm')
                     message_lines['height_calibration'] = ('Start height lower than floor height', True)
         else:
-            # Middle button clicked --> toggle plot zoom
-            new_plot_zoomed = 3 - plot_zoomed
+            # Middle button clicked --> cycle the plot zoom: on, off, archive
+            new_plot_zoomed = plot_zoomed % Zoom.archive + 1
             if DEBUG:
                 print(f'Switching zoom: {plot_zoomed} -> {new_plot_zoomed}')
             zoom_mem.value = new_plot_zoomed
             plot_zoomed = new_plot_zoomed
 
-    # Add current growth percentage to buffer
+    # Add current growth percentage to buffer, outliers are replaced by the median of the latest measurements. The
+    # display, the record and the telemetry keep the measured value.
     if growth_percentage is not None:
-        growth_mem.add_value(growth_percentage)
-    # Perform peak search
-    growth_array = growth_mem.read_array()
-    peak_ind = peak_detect(growth_array, threshold=1.0, window_size=7)
+        history_percentage = growth_filter_mem.filter(growth_percentage)
+        if DEBUG and growth_filter_mem.last_was_outlier:
+            print(f'Outlier {growth_percentage:.1f}% replaced by {history_percentage:.1f}%')
+        growth_mem.add_value(history_percentage, minutes=sample_minutes)
+        growth_peak_mem.update(growth_mem)
+        growth_forecast_mem.add_value(history_percentage, minutes=sample_minutes)
+    else:
+        growth_mem.add_gap(sample_minutes)
+        growth_peak_mem.sync(growth_mem)
+        growth_forecast_mem.add_gap(sample_minutes)
+    # Store all measurements of this wake as one record
+    record = {'growth': growth_percentage, 'temp': ext_temp, 'height_std': growth_perc_std, 'roughness': roughness,
+              'battery': battery_percentage, 'minutes': sample_minutes}
+    records_mem.add_value(record)
+    # Journal the records to the flash in batches of a page, which spares the flash and most wakes the time. Up to
+    # records_per_page - 1 records (~2h) are only in the sleep memory, see the README.
+    journal_pending_mem.value = min(journal_pending_mem.value + 1, records_mem.value_capacity)
+    if journal_pending_mem.value >= journal.records_per_page or journal_now:
+        t_journal = time.monotonic()
+        try:
+            journal.append(records_mem.read_bytes(amount=journal_pending_mem.value), keep_open=True)
+            # The records of a page that isn't full yet are written again together with the next ones
+            journal_pending_mem.value %= journal.records_per_page
+            if DEBUG:
+                print(f'Journaled {journal.written_bytes}B to the flash in {time.monotonic() - t_journal:.2f}s')
+        except OSError as e:
+            # E.g. the file system is read-only for CircuitPython, see boot.py. Retried on the next wake.
+            if DEBUG:
+                print(f'Couldn\'t write the flash journal: {e}')
+        if journal.next_sequence is not None:
+            journal_seq_mem.value = journal.next_sequence
+    # Peak search: the detector state in the sleep memory was updated with the new sample above
+    peak_ind = growth_peak_mem.peak_ind
     peak_pos_in_history = None
     peak_percentage = None
     peak_hours = None
     if peak_ind is not None:
-        peak_pos_in_history = len(growth_array) - peak_ind - 1
-        peak_percentage = growth_array[peak_ind]
-        peak_hours = peak_pos_in_history * INTERVAL_MINUTES / 60
+        peak_pos_in_history = growth_mem.current_size - peak_ind - 1
+        peak_percentage = growth_peak_mem.peak_value
+        peak_hours = growth_mem.read_ages(amount=peak_pos_in_history + 1)[0] / 60
+    # While no peak was detected, forecast it from the rise so far
+    forecast_hours = None
+    forecast_percentage = None
+    if peak_ind is None:
+        forecast = growth_forecast_mem.forecast()
+        if forecast is not None:
+            forecast_hours, forecast_percentage = forecast
+    # Smoothed growth and growth rate from the Savitzky-Golay taps over the latest samples of the history, for the
+    # fixed cost of SAVGOL_WINDOW integer multiplications. Both refer to the sample SAVGOL_LAG samples ago, the rate
+    # assumes the mean sample interval of the window.
+    growth_smoothed = None
+    growth_rate = None
+    if growth_mem.current_size >= SAVGOL_WINDOW:
+        savgol_window = list(growth_mem.iter_raw(amount=SAVGOL_WINDOW))
+        growth_smoothed = apply_taps(savgol_window, SMOOTH_TAPS, SMOOTH_DENOMINATOR) / growth_mem.value_scale + \
+            growth_mem.value_offset
+        window_minutes = growth_mem.read_ages(amount=SAVGOL_WINDOW)[0]
+        if window_minutes > 0:
+            growth_rate = apply_taps(savgol_window, SLOPE_TAPS, SLOPE_DENOMINATOR) / growth_mem.value_scale * 60 * \
+                (SAVGOL_WINDOW - 1) / window_minutes
     if DEBUG:
-        print(f'peak percentage: {peak_percentage}, peak hours: {peak_hours}, peak ind {peak_ind}')
+        cycles = segment_cycles(growth_mem.iter_raw(), CYCLE_DROP * growth_mem.value_scale,
+                                CYCLE_RISE * growth_mem.value_scale)
+        print('Rise cycles in the history (start, peak, peak growth): ' +
+              ', '.join(f'({start}, {peak}, {raw / growth_mem.value_scale + growth_mem.value_offset:.0f}%)'
+                        for start, peak, raw in cycles))
+        print(f'peak percentage: {peak_percentage}, peak hours: {peak_hours}, peak ind {peak_ind}, '
+              f'forecast: {forecast_percentage} in {forecast_hours}h, smoothed growth: {growth_smoothed}, '
+              f'rate: {growth_rate}/h')
 
     # Try to connect to the internet and send telemetry metrics
     wifi_connectivity = None
@@ -569,6 +801,8 @@ try:
             influxdb_row = f"{INFLUXDB_MEASUREMENT},device={DEVICE_NAME} " + \
                            (f"height={growth_percentage:.2f}," if growth_percentage is not None else "") + \
                            (f"height_std={growth_perc_std:.2f}," if growth_perc_std is not None else "") + \
+                           (f"height_smoothed={growth_smoothed:.2f}," if growth_smoothed is not None else "") + \
+                           (f"height_rate={growth_rate:.2f}," if growth_rate is not None else "") + \
                            (f"roughness={roughness:.2f}," if roughness is not None else "") + \
                            (f"floor_calib={floor_distance:.2f}," if floor_distance is not None else "") + \
                            (f"start_calib={start_height:.2f}," if start_height is not None else "") + \
@@ -615,7 +849,8 @@ try:
     g = displayio.Group()
 
     # Load background bitmap
-    f_bg = open('imgs/background_zoom.bmp' if plot_zoomed == Zoom.on else 'imgs/background.bmp', 'rb')
+    f_bg = open({Zoom.on: 'imgs/background_zoom.bmp', Zoom.archive: 'imgs/background_archive.bmp'}.get(
+        plot_zoomed, 'imgs/background.bmp'), 'rb')
     pic = displayio.OnDiskBitmap(f_bg)
     t = displayio.TileGrid(pic, pixel_shader=pic.pixel_shader)
     g.append(t)
@@ -625,7 +860,7 @@ try:
         time.sleep(DEBUG_DELAY)
 
     draw_texts(g, tahoma_font, tahoma_bold_font, ext_temp, ext_humidity, board_temp, board_humidity,
-               growth_percentage, peak_percentage, peak_hours)
+               growth_percentage, peak_percentage, peak_hours, forecast_percentage, forecast_hours, growth_rate)
 
     if DEBUG:
         print("Labels drawn.")
@@ -666,19 +901,17 @@ try:
         background_color=PaletteColor.transparent, ygrid_color=PaletteColor.light_gray, font_size=(5, 7),
         alignment='right')
 
-    plot_mem: CyclicBuffer = temp_mem if plot_type == PlotType.temp else growth_mem
-    if plot_zoomed == Zoom.on:
-        plot_amount = min(plot_mem.current_size, ceil(GRAPH_WIDTH / 2.0))
+    plot_mem: TieredHistory = temp_mem if plot_type == PlotType.temp else growth_mem
+    if plot_zoomed == Zoom.archive:
+        # Time-aware columns of ARCHIVE_ZOOM sample intervals each, read from the consolidated tiers
+        plot.plot_archive(plot_mem, GRAPH_WIDTH * INTERVAL_MINUTES * ARCHIVE_ZOOM, minutes_per_sample=INTERVAL_MINUTES)
+        x_positions = None
     else:
-        plot_amount = plot_mem.current_size
-
-    value_array = plot_mem.read_array(amount=plot_amount)
-
-    if value_array:
-        # print(f'Value array: {",".join(map(str, value_array))}')
-        plot.plot_graph(value_array, zoomed=plot_zoomed == Zoom.on)
-    if peak_pos_in_history is not None and plot_type == PlotType.growth:
-        plot.plot_peak(value_array, peak_pos_in_history, zoomed=plot_zoomed == Zoom.on)
+        plot_window = ceil(GRAPH_WIDTH / 2.0) if plot_zoomed == Zoom.on else GRAPH_WIDTH
+        x_positions = plot.plot_history(plot_mem, plot_window, zoomed=plot_zoomed == Zoom.on,
+                                        minutes_per_column=INTERVAL_MINUTES)
+    if peak_pos_in_history is not None and plot_type == PlotType.growth and plot_zoomed != Zoom.archive:
+        plot.plot_peak(peak_percentage, peak_pos_in_history, zoomed=plot_zoomed == Zoom.on, x_positions=x_positions)
     g.append(plot)
 
     # Write message lines
@@ -726,31 +959,37 @@ try:
         print("Setting up deep sleep.")
         time.sleep(DEBUG_DELAY)
 
-    sleep_time = INTERVAL_MINUTES * 60
-    # If in refrigerator, update everything slower
-    if ext_temp is not None and ext_temp < FRIDGE_MAX_TEMP:
-        sleep_time *= FRIDGE_SLEEP_TIME_FACTOR
-        # To compensate for the x-axis tick distance of 4 min, duplicate the value in the memory
-        for _ in range(FRIDGE_SLEEP_TIME_FACTOR - 1):
-            if growth_percentage is not None:
-                growth_mem.add_value(growth_percentage)
-            if ext_temp is not None:
-                temp_mem.add_value(ext_temp)
-
-    # If a button was pressed, we assume that the interruption in average occurs after 1/2 of the sleep time
-    if wake_reason in ['left', 'middle']:
-        # --> wait for 1.5x time to compensate for the early interrupt
-        # (we aim at a constant sampling frequency of 4 min)
-        sleep_time *= 1.5
+    sleep_minutes_mem.value = sleep_time // 60
 
     timeout_alarm = alarm.time.TimeAlarm(monotonic_time=t_start - BOOT_TIME + sleep_time)
     left_alarm = alarm.pin.PinAlarm(pin=board.D11, value=False, pull=True)
     middle_alarm = alarm.pin.PinAlarm(pin=board.D12, value=False, pull=True)
 
+    written_bytes = memory_session.flush()
+    if DEBUG:
+        print(f'Sleep memory: {written_bytes} bytes flushed')
+
+    if tof_standby:
+        # Hold the I2C rail powered during the deep sleep and tell the next wake its level, see the top
+        alarm.sleep_memory[-1] = int(i2c_power_on) + 1
+        try:
+            alarm.exit_and_deep_sleep_until_alarms(timeout_alarm, left_alarm, middle_alarm, preserve_dios=[i2c_power])
+        except TypeError:
+            # preserve_dios needs CircuitPython 8, before that the rail is cut like with TOF_POWER = 'off'
+            if DEBUG:
+                print('No preserve_dios in this CircuitPython, the TMF8821 is powered off')
+    alarm.sleep_memory[-1] = 0
     alarm.exit_and_deep_sleep_until_alarms(timeout_alarm, left_alarm, middle_alarm)
     # We will never get *here* -> timeout will force a restart and execute code from the top
 except Exception as e:
+    # Keep what was stored during this wake
+    memory_session.flush()
     exc_string = log_exception_to_sd_card(e)
     if DEBUG:
         print(exc_string)
     raise e
+except BaseException:
+    # Ctrl-C or an auto-reload after a file was saved over USB stop the wake without a reset, so the sleep memory
+    # survives: its headers have to match the values already written during this wake
+    memory_session.flush()
+    raise
@@ -36,16 +36,16 @@ Implementation Notes
 
 __version__ = "1.0.0+auto.0"
 
-from collections import namedtuple
 from time import sleep
 from os import mkdir
+from struct import unpack_from
 
 from adafruit_bus_device import i2c_device
 from adafruit_ticks import ticks_ms, ticks_add, ticks_less, ticks_diff
 from micropython import const
 
 from .tmf8821_config import TMF882X_Configuration
-from .tmf8821_image import _tof_image3
+from .tmf8821_firmware import TMF882X_FirmwareImage, decompress
 
 try:
     from typing import Optional, List
@@ -108,6 +108,8 @@ _TMF882X_REG_RES_CONFIDENCE_i = list(range(0x38, 0xA1 + 1, 3))  # confidence[i]
 _TMF882X_REG_RES_DISTANCE_i_LSB = list(range(0x39, 0xA2 + 1, 3))  # distance[i][7:0]
 _TMF882X_REG_RES_DISTANCE_i_MSB = list(range(0x3A, 0xA3 + 1, 3))  # distance[i][15:8]
 _TMF882X_MEASUREMENT_SIZE = const(132)
+# result_number, temperature, valid_results, (reserved), ambient, photon_count, reference_count, sys_tick
+_TMF882X_MEASUREMENT_HEADER = '<BBBxIIII'
 
 # If appid=0x03, cid_rid=0x16, the following describe Configuration Page
 _TMF882X_REG_PERIOD_MS_LSB = const(0x24)  # period[7:0]
@@ -189,6 +191,10 @@ _TMF882X_BL_RAMREMAP_RESET = const(0x11)
 
 _TMF882X_BL_FW_ADDR = const(0x20000000)  # Note, only the last 16 bit are respected
 _TMF882X_BL_MAX_FW_DATA = const(100)  # Setting this to 128 leads to erroneous answers of the device
+_TMF882X_BL_FRAME_OVERHEAD = const(4)  # register address, command, size and checksum around the data
+# See experiments/tmf8821/pack_firmware.py, the raw asset is for CircuitPython builds without zlib (e.g. 7.3.3)
+_TMF882X_FIRMWARE_PATH = __file__.rsplit('/', 1)[0] + ('/tmf8821_image.bin' if decompress is not None else
+                                                       '/tmf8821_image_raw.bin')
 
 _TMF882X_APP_CMD_MEASURE = const(0x10)
 _TMF882X_APP_CMD_CLEAR_STATUS = const(0x11)
@@ -213,14 +219,63 @@ _TMF882X_ACTIVE_RANGE_LONG = const(0x6F)
 _TMF882X_CALIBRATION_COMMON_CID = const(0x19)
 _TMF882X_CALIBRATION_PAGE_SIZE = const(0x00BC)
 
-Measurement = namedtuple('Measurement', 'result_number temperature number_valid_results ambient_light photon_count '
-                                        'reference_count sys_tick confidences distances')
+
+class Measurement:
+    """
+    Results of one measurement. The driver fills the same object in place for every measurement, copy what has to
+    outlive the next one.
+    """
+    __slots__ = ('result_number', 'temperature', 'number_valid_results', 'ambient_light', 'photon_count',
+                 'reference_count', 'sys_tick', 'confidences', 'distances')
+
+
+    def __init__(self):
+        self.result_number = 0
+        self.temperature = 0
+        self.number_valid_results = 0
+        self.ambient_light = 0
+        self.photon_count = 0
+        self.reference_count = 0
+        self.sys_tick = 0
+        self.confidences = []  # per zone of the SPAD map
+        self.distances = []  # mm, per zone of the SPAD map
+
+
+def _zone_offsets(spad_map: str, start: int) -> tuple:
+    # Offsets of the confidence byte of each zone of the SPAD map in a measurement block read from the register start,
+    # the distance (LSB, MSB) follows it. The 4x4 maps leave the 9th result unused.
+    results = range(36)
+    if spad_map[:3] == '3x3':
+        results = range(3 * 3)
+    elif spad_map[:3] == '4x4':
+        results = list(range(8)) + list(range(9, 17))
+    elif spad_map[:3] == '3x6':
+        results = range(3 * 6)
+    return tuple(_TMF882X_REG_RES_CONFIDENCE_i[i] - start for i in results)
 
 
 class TMF8821:
-    def __init__(self, i2c: I2C, address: int = _TMF882X_DEFAULT_I2C_ADDR, verbose=False) -> None:
+    def __init__(self, i2c: I2C, address: int = _TMF882X_DEFAULT_I2C_ADDR, verbose=False,
+                 firmware_path: str = _TMF882X_FIRMWARE_PATH) -> None:
         self._device = i2c_device.I2CDevice(i2c, address)
         self.config = TMF882X_Configuration()
+        # Preallocated buffers of the register accesses and the measurements, which run without allocations
+        self._register = bytearray(1)
+        self._byte = bytearray(1)
+        self._register_write = bytearray(2)
+        self._measurement_buffer = bytearray(_TMF882X_MEASUREMENT_SIZE)
+        self._measurement = Measurement()
+        self._zone_spad_map = None  # SPAD map id of _zone_offsets
+        self._zone_header = None  # result_header of _zone_offsets
+        self._zone_offsets = ()
+        self._span_start = _TMF882X_REG_CONFIG_RESULT  # register span read per measurement
+        self._span_size = _TMF882X_MEASUREMENT_SIZE
+        # With False, only the confidences and distances of the zones of the SPAD map are read, and the other fields of
+        # the measurement aren't updated
+        self.result_header = True
+        self._active_range = None  # unknown while it wasn't set
+        # False if the application was still running (e.g. kept in standby), its configuration is still loaded then
+        self.firmware_downloaded = False
 
         # Check if chip is responding and ID matches datasheet
         if self._read_byte(_TMF882X_REG_ID) & _TMF882X_CHIP_ID_VALID_MASK != _TMF882X_CHIP_ID:
@@ -273,20 +328,8 @@ class TMF8821:
                                bytes([(_TMF882X_BL_FW_ADDR >> 8) & 0xFF, _TMF882X_BL_FW_ADDR & 0xFF]))
         self._check_bl_cmd_executed(verbose)
 
-        size_downloaded = 0
-        image = _tof_image3
-        if verbose:
-            print('Downloading firmware: ', end='')
-        while size_downloaded < len(image):
-            chunk_bytes = min(_TMF882X_BL_MAX_FW_DATA, len(image) - size_downloaded)
-            data = image[size_downloaded:size_downloaded + chunk_bytes]
-            self._write_bl_command(_TMF882X_BL_W_RAM, data)
-            self._check_bl_cmd_executed()
-            size_downloaded += chunk_bytes
-            if verbose:
-                print(f'{size_downloaded / len(image) * 100:3.0f}%\b\b\b\b', end='')
-        if verbose:
-            print('100% -- Done.')
+        with TMF882X_FirmwareImage(firmware_path) as firmware:
+            self._download_firmware(firmware, verbose)
 
         # Set powerup select to run from RAM
         self._write_byte(_TMF882X_REG_ENABLE, 0x21)  # set bit 0 (general enable) and bit 5 (run from RAM)
@@ -306,14 +349,74 @@ class TMF8821:
             raise Exception('Device is still in bootloader mode 3ms after running firmware!')
 
         self._active_range = 'long'
+        self.firmware_downloaded = True
+
+
+    def standby(self):
+        # Put the device into STANDBY (pon = 0). As long as it stays powered, it keeps the firmware and the
+        # configuration, and the next TMF8821() wakes it up without a firmware download.
+        self._write_byte(_TMF882X_REG_ENABLE, self._read_byte(_TMF882X_REG_ENABLE) & 0xFE)
+
+
+    def _download_firmware(self, firmware: TMF882X_FirmwareImage, verbose=False):
+        # Stream the image from the flash, one decompressed block at a time, through one preallocated W_RAM frame.
+        # The status register is polled with a single byte read and without allocations. Before the first poll, each
+        # chunk waits the whole milliseconds less one the previous chunk kept the device busy, usually none.
+        frame = bytearray(_TMF882X_BL_MAX_FW_DATA + _TMF882X_BL_FRAME_OVERHEAD)
+        frame[0] = _TMF882X_REG_BL_CMD_STAT
+        frame[1] = _TMF882X_BL_W_RAM
+        status_reg = bytes([_TMF882X_REG_BL_CMD_STAT])
+        status = bytearray(1)
+        wait_ms = 0
+        size_downloaded = 0
+        if verbose:
+            print('Downloading firmware: ', end='')
+        for block in firmware.blocks():
+            for start in range(0, len(block), _TMF882X_BL_MAX_FW_DATA):
+                end = min(start + _TMF882X_BL_MAX_FW_DATA, len(block))
+                size = end - start
+                frame[2] = size
+                chunk = block[start:end]
+                frame[3:3 + size] = chunk
+                # Checksum: one's complement of the byte sum of command, size and data
+                frame[3 + size] = ((_TMF882X_BL_W_RAM + size + sum(chunk)) & 0xFF) ^ 0xFF
+                with self._device as i2c:
+                    i2c.write(frame, end=size + _TMF882X_BL_FRAME_OVERHEAD)
+                written = ticks_ms()
+                if wait_ms:
+                    sleep(wait_ms / 1000)
+                timeout = ticks_add(written, 50)  # Wait for maximum 50ms
+                while True:
+                    with self._device as i2c:
+                        i2c.write_then_readinto(status_reg, status)
+                    if status[0] == _TMF882X_CMD_STAT_OK:
+                        break
+                    if status[0] != _TMF882X_CMD_STAT_ACCEPTED:
+                        raise Exception(f'TMF882X returned erroneous status {status[0]:#x}!')
+                    if not ticks_less(ticks_ms(), timeout):
+                        raise Exception('Device took too long to respond with status OK!')
+                wait_ms = max(0, ticks_diff(ticks_ms(), written) - 1)
+                size_downloaded += size
+                if verbose:
+                    print(f'{size_downloaded / firmware.size * 100:3.0f}%\b\b\b\b', end='')
+        if verbose:
+            print('100% -- Done.')
 
 
-    def _write_bl_command(self, cmd: int, data: bytes, dryrun=False):
+    def _write_bl_command(self, cmd: int, data, dryrun=False):
+        # data can be any buffer (bytes, or a memoryview into a firmware block)
         checksum = ((cmd + len(data) + sum(data)) & 0x000000FF) ^ 0xFF
+        frame = bytearray(len(data) + 4)
+        frame[0] = _TMF882X_REG_BL_CMD_STAT
+        frame[1] = cmd
+        frame[2] = len(data)
+        frame[3:-1] = data
+        frame[-1] = checksum
         if dryrun:
-            print(f'Writing command:', ' '.join(map(hex, bytes([cmd, len(data)]) + data + bytes([checksum]))))
+            print(f'Writing command:', ' '.join(map(hex, frame[1:])))
         else:
-            self._write_bytes(_TMF882X_REG_BL_CMD_STAT, bytes([cmd, len(data)]) + data + bytes([checksum]))
+            with self._device as i2c:
+                i2c.write(frame)
 
 
     def _check_bl_cmd_executed(self, verbose=False):
@@ -385,41 +488,46 @@ class TMF8821:
         self._check_app_cmd_executed(timeout_ms=2)
 
 
-    def parse_measurement_data(self, raw_data):
-        offset = _TMF882X_REG_CONFIG_RESULT
-        if raw_data[_TMF882X_REG_CONFIG_RESULT - offset] != _TMF882X_MEASUREMENT_RESULT:
-            raise Exception("Data doesn't contain a measurement!")
-        # Fill measurement data into accessible structure
-        confidences = [raw_data[i - offset] for i in _TMF882X_REG_RES_CONFIDENCE_i]
-        distances = [raw_data[i - offset] + (raw_data[i + 1 - offset] << 8) for i in _TMF882X_REG_RES_DISTANCE_i_LSB]
-        if self.config.spad_map[:3] == '3x3':
-            confidences = confidences[:3 * 3]
-            distances = distances[:3 * 3]
-        elif self.config.spad_map[:3] == '4x4':
-            confidences = confidences[:8] + confidences[9:17]
-            distances = distances[:8] + distances[9:17]
-        elif self.config.spad_map[:3] == '3x6':
-            confidences = confidences[:3 * 6]
-            distances = distances[:3 * 6]
-        measurement = Measurement(
-            result_number=raw_data[_TMF882X_REG_RESULT_NUMBER - offset],
-            temperature=raw_data[_TMF882X_REG_TEMPERATURE - offset],
-            number_valid_results=raw_data[_TMF882X_REG_NUMBER_VALID_RESULTS - offset],
-            ambient_light=int.from_bytes(raw_data[_TMF882X_REG_AMBIENT_LIGHT_0 - offset:
-                                                  _TMF882X_REG_AMBIENT_LIGHT_3 - offset + 1], 'little'),
-            photon_count=int.from_bytes(raw_data[_TMF882X_REG_PHOTON_COUNT_0 - offset:
-                                                 _TMF882X_REG_PHOTON_COUNT_3 - offset + 1], 'little'),
-            reference_count=int.from_bytes(raw_data[_TMF882X_REG_REFERENCE_COUNT_0 - offset:
-                                                    _TMF882X_REG_REFERENCE_COUNT_3 - offset + 1], 'little'),
-            sys_tick=int.from_bytes(raw_data[_TMF882X_REG_SYS_TICK_0 - offset:
-                                             _TMF882X_REG_SYS_TICK_3 - offset + 1], 'little'),
-            confidences=confidences,
-            distances=distances,
-        )
+    def _update_zones(self, measurement: Measurement):
+        # The zone table, the register span and the per zone lists only change with the SPAD map and result_header.
+        # The span starts at cid_rid with the header, else at the first confidence, and ends after the last zone.
+        spad_map = self.config.config[16]
+        if spad_map != self._zone_spad_map or self.result_header != self._zone_header:
+            self._span_start = _TMF882X_REG_CONFIG_RESULT if self.result_header else _TMF882X_REG_RES_CONFIDENCE_i[0]
+            self._zone_offsets = _zone_offsets(self.config.spad_map, self._span_start)
+            self._span_size = max(self._zone_offsets) + 3
+            self._zone_spad_map = spad_map
+            self._zone_header = self.result_header
+        if len(measurement.distances) != len(self._zone_offsets):
+            measurement.confidences = [0] * len(self._zone_offsets)
+            measurement.distances = [0] * len(self._zone_offsets)
+
+
+    def parse_measurement_data(self, raw_data, measurement: Measurement = None) -> Measurement:
+        # Decode a measurement block into measurement, by default the one the driver reuses. The block is read from
+        # cid_rid, or from the first confidence without result_header.
+        if measurement is None:
+            measurement = self._measurement
+        self._update_zones(measurement)
+        if self.result_header:
+            if raw_data[0] != _TMF882X_MEASUREMENT_RESULT:
+                raise Exception("Data doesn't contain a measurement!")
+            (measurement.result_number, measurement.temperature, measurement.number_valid_results,
+             measurement.ambient_light, measurement.photon_count, measurement.reference_count,
+             measurement.sys_tick) = unpack_from(_TMF882X_MEASUREMENT_HEADER, raw_data,
+                                                 _TMF882X_REG_RESULT_NUMBER - _TMF882X_REG_CONFIG_RESULT)
+        confidences = measurement.confidences
+        distances = measurement.distances
+        i = 0
+        for offset in self._zone_offsets:
+            confidences[i] = raw_data[offset]
+            distances[i] = raw_data[offset + 1] | raw_data[offset + 2] << 8
+            i += 1
         return measurement
 
 
-    def wait_for_measurement(self, timeout_ms, sleep_ratio=None) -> Measurement:
+    def wait_for_measurement(self, timeout_ms, sleep_ratio=None, measurement: Measurement = None) -> Measurement:
+        # Returns measurement filled in place, by default the one the driver reuses for every measurement
         timeout = ticks_add(ticks_ms(), timeout_ms)  # Wait for maximum <timeout_ms> ms
         while ticks_less(ticks_ms(), timeout):
             interrupts = self._read_byte(_TMF882X_REG_INT_STATUS)
@@ -433,16 +541,22 @@ class TMF8821:
             raise Exception(f'Measurement took longer than {timeout_ms}ms!')
         # Clear interrupt flag by writing a '1' on the corresponding position
         self._write_byte(_TMF882X_REG_INT_STATUS, 0x02)
-        # Read measurement block
-        raw_data = self._read_bytes(_TMF882X_REG_CONFIG_RESULT, _TMF882X_MEASUREMENT_SIZE)
+        # Read the span of the measurement block with the requested results
+        if measurement is None:
+            measurement = self._measurement
+        self._update_zones(measurement)
+        self._read_bytes_into(self._span_start, self._measurement_buffer, self._span_size)
         if not self._read_byte(_TMF882X_REG_MEASURE_STATUS) == 0x00:
             raise Exception('Measurement state machine failure!')
-        return self.parse_measurement_data(raw_data)
+        # Without result_header, cid_rid isn't in the span and parse_measurement_data can't check it
+        if not self.result_header and self._read_byte(_TMF882X_REG_CONFIG_RESULT) != _TMF882X_MEASUREMENT_RESULT:
+            raise Exception("Data doesn't contain a measurement!")
+        return self.parse_measurement_data(self._measurement_buffer, measurement)
 
 
-    def single_measurement(self, timeout_ms, sleep_ratio=None) -> Measurement:
+    def single_measurement(self, timeout_ms, sleep_ratio=None, measurement: Measurement = None) -> Measurement:
         self.start_measurements()
-        measurement = self.wait_for_measurement(timeout_ms, sleep_ratio)
+        measurement = self.wait_for_measurement(timeout_ms, sleep_ratio, measurement)
         # Disable any further measurements
         self.stop_measurements()
         return measurement
@@ -554,9 +668,9 @@ class TMF8821:
     def _read_byte(self, address: int) -> int:
         # Read and return a byte from the specified register address.
         with self._device as i2c:
-            result = bytearray(1)
-            i2c.write_then_readinto(bytes([address]), result)
-            return result[0]
+            self._register[0] = address
+            i2c.write_then_readinto(self._register, self._byte)
+            return self._byte[0]
 
 
     def _read_bytes(self, address: int, length: int) -> bytes:
@@ -567,10 +681,19 @@ class TMF8821:
             return result
 
 
+    def _read_bytes_into(self, address: int, buffer, length: int = None) -> None:
+        # Read length (by default len(buffer)) bytes from the specified register address into buffer.
+        with self._device as i2c:
+            self._register[0] = address
+            i2c.write_then_readinto(self._register, buffer, in_end=len(buffer) if length is None else length)
+
+
     def _write_byte(self, address: int, data: int) -> None:
         # Write 1 byte of data from the specified 8-bit register address.
         with self._device as i2c:
-            i2c.write(bytes([address, data]))
+            self._register_write[0] = address
+            self._register_write[1] = data
+            i2c.write(self._register_write)
 
 
     def _write_bytes(self, address: int, data) -> None:
@@ -102,6 +102,28 @@ class TMF882X_Configuration:
             raise ValueError()
 
 
+    @property
+    def goto_standby_timed(self):
+        # Standby between the measurements of a periodic measurement
+        return bool(self.config[15] & (1 << 7))
+
+
+    @goto_standby_timed.setter
+    def goto_standby_timed(self, value: bool):
+        self.config[15] = self.config[15] | (1 << 7) if value else self.config[15] & ~(1 << 7)
+
+
+    @property
+    def keep_pll_running(self):
+        # Keeps the PLL running in standby: faster wake-up, but a much higher standby current
+        return bool(self.config[15] & (1 << 5))
+
+
+    @keep_pll_running.setter
+    def keep_pll_running(self, value: bool):
+        self.config[15] = self.config[15] | (1 << 5) if value else self.config[15] & ~(1 << 5)
+
+
     @property
     def confidence_encoding(self):
         return int(bool(self.config[17] & (1 << 7)))
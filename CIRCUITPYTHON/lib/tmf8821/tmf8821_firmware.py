@@ -0,0 +1,53 @@
+import struct
+
+try:
+    from zlib import decompress
+except ImportError:
+    decompress = None
+
+# Firmware asset, written by experiments/tmf8821/pack_firmware.py: header '<4sIHHB' (magic, image size, block size,
+# largest stored block, compressed flag), then per block its stored size ('<H') and the block, zlib compressed or raw.
+# Only one block is in RAM at a time. Without zlib, only raw assets can be read.
+_MAGIC = b'TMFZ'
+_HEADER_FORMAT = '<4sIHHB'
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+
+
+class TMF882X_FirmwareImage:
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        header = self._file.read(_HEADER_SIZE)
+        magic, self.size, self.block_size, max_stored, self.compressed = struct.unpack(_HEADER_FORMAT, header)
+        if magic != _MAGIC:
+            self._file.close()
+            raise ValueError(f'{path} is no TMF882X firmware asset')
+        if self.compressed and decompress is None:
+            self._file.close()
+            raise RuntimeError(f'No zlib module to read {path}, use the raw asset (pack_firmware.py --raw)')
+        # Reused for every block, only the decompressed block is allocated anew
+        self._buffer = bytearray(max(max_stored, 2))
+        self._view = memoryview(self._buffer)
+
+
+    def blocks(self):
+        # Yield the image block by block as memoryviews, valid until the next block is read
+        remaining = self.size
+        while remaining > 0:
+            self._file.readinto(self._view[:2])
+            stored = self._buffer[0] | self._buffer[1] << 8
+            self._file.readinto(self._view[:stored])
+            block = memoryview(decompress(self._view[:stored])) if self.compressed else self._view[:stored]
+            remaining -= len(block)
+            yield block
+
+
+    def close(self):
+        self._file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,11 +1,23 @@
-def peak_detect(array: list, threshold: float, window_size: int) -> int:
-    moving_sum = sum(array[:window_size - 1])
+from math import log, sqrt
+
+# Fractional bits of the fixed-point linear maps. Results up to 1024 (pixels) keep the products below 2^30.
+FIXED_POINT_BITS = 20
+
+
+def peak_detect(values, threshold: float, window_size: int) -> int:
+    # values can be any iterable (e.g. a generator over the sleep memory), only the last window_size values are kept.
+    # On the raw integers of a history (threshold in raw units) no float is created apart from the moving mean.
+    window = [0.0] * window_size
+    moving_sum = 0
     global_max_val = 0
     global_max_ind = -1
     peak_candidate_ind = None
     peak_candidate_val = None
-    for i in range(window_size - 1, len(array)):
-        current_val = array[i]
+    for i, current_val in enumerate(values):
+        window[i % window_size] = current_val
+        if i < window_size - 1:
+            moving_sum += current_val
+            continue
         if current_val > global_max_val:
             global_max_val = current_val
             global_max_ind = i
@@ -13,10 +25,155 @@ def peak_detect(array: list, threshold: float, window_size: int) -> int:
                 peak_candidate_ind = None
                 peak_candidate_val = None
         moving_sum += current_val
-        if current_val < array[i - 1] < array[i - 2]:
+        if current_val < window[(i - 1) % window_size] < window[(i - 2) % window_size]:
             # Last two points have both decreased
             if moving_sum / window_size - current_val > threshold:
                 peak_candidate_ind = global_max_ind
                 peak_candidate_val = global_max_val
-        moving_sum -= array[i - (window_size - 1)]
+        moving_sum -= window[(i - (window_size - 1)) % window_size]
     return peak_candidate_ind
+
+
+def spad_statistics(spad_sums: list, spad_square_sums: list, n: int) -> tuple:
+    # Mean distance, mean per-spad standard deviation and roughness (spread of the per-spad means) from the integer
+    # sums of n measurements per spad and of their squares. Only the results are floats.
+    n_spads = len(spad_sums)
+    global_distance = sum(spad_sums) / (n * n_spads)
+    global_roughness = (max(spad_sums) - min(spad_sums)) / n
+    # Population standard deviation per spad: sqrt(n * sum(d^2) - sum(d)^2) / n
+    stddev_sum = 0.0
+    for spad_sum, spad_square_sum in zip(spad_sums, spad_square_sums):
+        stddev_sum += sqrt(n * spad_square_sum - spad_sum * spad_sum)
+    global_stddev = stddev_sum / (n * n_spads)
+    return global_distance, global_stddev, global_roughness
+
+
+def fixed_point_map(factor: float, offset: float) -> tuple:
+    # Integer coefficients (a, b) such that round(x * factor + offset) == (x * a + b) >> FIXED_POINT_BITS for integer x,
+    # up to the precision of the fractional bits. x * a should stay below 2^30, the small int range of CircuitPython.
+    one = 1 << FIXED_POINT_BITS
+    return round(factor * one), round(offset * one) + one // 2
+
+
+def logistic_forecast(s_yy: float, s_yyy: float, s_yyyy: float, s_ry: float, s_ryy: float, y_now: float,
+                      peak_fraction: float = 0.95, min_conditioning: float = 1e-3):
+    # Fit of the logistic rise dy/dt = k * y * (1 - y / A) to observed rises y and rates r = dy/dt, given by the
+    # (weighted) sums of y^2, y^3, y^4, r * y and r * y^2: least squares of r = k * y + c * y^2 with c = -k / A.
+    # Returns the time until y reaches peak_fraction of the plateau A (0 if it already has) in the time unit of r,
+    # and A, or None if the fit doesn't describe a decelerating rise (yet).
+    det = s_yy * s_yyyy - s_yyy * s_yyy
+    if s_yy <= 0 or det <= min_conditioning * s_yy * s_yyyy:
+        # Too few samples or too narrow a range of y for a stable solution
+        return None
+    k = (s_ry * s_yyyy - s_ryy * s_yyy) / det
+    c = (s_yy * s_ryy - s_yyy * s_ry) / det
+    if k <= 0 or c >= 0 or y_now <= 0:
+        return None
+    plateau = -k / c
+    target = peak_fraction * plateau
+    if y_now >= target:
+        return 0.0, plateau
+    # Solution of the logistic equation: t(y) = ln(y / (A - y)) / k + const
+    return (log(target / (plateau - target)) - log(y_now / (plateau - y_now))) / k, plateau
+
+
+def sorted_index(sorted_values, value) -> int:
+    # Binary search: index of the first element >= value (bisect_left, which CircuitPython doesn't provide)
+    low = 0
+    high = len(sorted_values)
+    while low < high:
+        middle = (low + high) // 2
+        if sorted_values[middle] < value:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def median_of_sorted(sorted_values):
+    n = len(sorted_values)
+    if n % 2:
+        return sorted_values[n // 2]
+    return (sorted_values[n // 2 - 1] + sorted_values[n // 2]) / 2
+
+
+def hampel_check(sorted_window, value, n_sigmas: float = 3.0, min_deviation: float = 0.0) -> tuple:
+    # Hampel identifier against a window of previous values (sorted): value is an outlier if it deviates from the
+    # window's median by more than n_sigmas robust standard deviations (1.4826 * median absolute deviation), and by at
+    # least min_deviation, which keeps a flat window (deviation 0) from rejecting every change. Returns (is_outlier,
+    # median).
+    median = median_of_sorted(sorted_window)
+    deviations = sorted([abs(val - median) for val in sorted_window])
+    limit = max(n_sigmas * 1.4826 * median_of_sorted(deviations), min_deviation)
+    return abs(value - median) > limit, median
+
+
+def apply_taps(raw_values, taps, denominator: int):
+    # FIR filter with integer taps (oldest sample first) over the latest len(taps) raw values, the integer sum is
+    # divided only once at the end. Returns None while there are fewer values than taps.
+    total = 0
+    n = 0
+    for raw, tap in zip(raw_values, taps):
+        total += raw * tap
+        n += 1
+    if n < len(taps):
+        return None
+    return total / denominator
+
+
+class CycleSegmenter:
+    """
+    Single pass segmentation of a growth series into rise cycles (feed, rise, peak, collapse) with constant state.
+
+    A cycle starts once the values rose by more than rise_threshold above their minimum since the last peak (a feeding,
+    or the first rise of the series), its peak is confirmed once they dropped by more than drop_threshold below the
+    maximum of the rise. The start of a cycle is the last value within drop_threshold of that minimum, where the rise
+    leaves the noise, not where the idle dough was lowest. Values are added one by one, None counts as a missing value
+    (it advances the index, like the empty rows of a recording). The thresholds are in the units of the values, e.g.
+    raw units on the integers of a history.
+    """
+    def __init__(self, drop_threshold: float, rise_threshold: float):
+        self.drop_threshold = drop_threshold
+        self.rise_threshold = rise_threshold
+        # Confirmed cycles as (start index, peak index, peak value)
+        self.cycles = []
+        self.index = -1
+        self.rising = False
+        self.start_ind = None
+        self.max_ind = None
+        self.max_val = None
+        self.min_val = None
+
+
+    def add(self, value):
+        self.index += 1
+        if value is None:
+            return
+        if self.rising:
+            if value > self.max_val:
+                self.max_ind = self.index
+                self.max_val = value
+            elif self.max_val - value > self.drop_threshold:
+                # Peak confirmed, the collapse begins
+                self.cycles.append((self.start_ind, self.max_ind, self.max_val))
+                self.rising = False
+                self.min_val = value
+                self.start_ind = self.index
+            return
+        if self.min_val is None or value < self.min_val:
+            self.min_val = value
+        if value - self.min_val <= self.drop_threshold:
+            # Still in the noise around the minimum, the latest such value is the foot of the next rise
+            self.start_ind = self.index
+        elif value - self.min_val > self.rise_threshold:
+            self.rising = True
+            self.max_ind = self.index
+            self.max_val = value
+
+
+def segment_cycles(values, drop_threshold: float, rise_threshold: float) -> list:
+    # Cycles of a whole series as (start index, peak index, peak value), see CycleSegmenter
+    segmenter = CycleSegmenter(drop_threshold, rise_threshold)
+    for value in values:
+        segmenter.add(value)
+    return segmenter.cycles
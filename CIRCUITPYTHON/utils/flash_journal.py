@@ -0,0 +1,149 @@
+import os
+import struct
+
+from utils.sleep_memory import fletcher16
+
+
+class FlashJournal:
+    """
+    Append-only journal of fixed-size records on the internal flash file system, which survives a loss of the sleep
+    memory (battery swap, brownout).
+
+    The journal consists of n_files files of pages_per_file pages each. The files are created once in their full size
+    and afterwards only overwritten in place, so the file allocation table never changes. Pages are written round-robin
+    over all files, thus every page is written equally often and the oldest page is overwritten first. A page holds
+    its header (magic number, sequence number, record count, record size), as many records as fit and a Fletcher-16
+    checksum. A torn page fails the checksum and is skipped on reading.
+
+    The journal doesn't know the records, it stores their encoded bytes (e.g. of a CyclicRecordBuffer). The file
+    system must be writable for CircuitPython, see boot.py.
+    """
+    magic = 0x4A52
+    page_size = 256
+    page_header_format = '>HIBB'  # magic, sequence number, record count, record size
+    page_header_size = 8
+    checksum_size = 2
+
+
+    def __init__(self, directory: str, record_size: int, n_files: int = 4, pages_per_file: int = 16,
+                 next_sequence: int = None):
+        """
+        :param directory: Directory of the journal files, created if necessary
+        :param record_size: Bytes per record
+        :param next_sequence: Sequence number of the next page if known (e.g. from the sleep memory), otherwise it is
+            determined by a scan of the journal before the first write
+        """
+        self.directory = directory
+        self.record_size = record_size
+        self.n_files = n_files
+        self.pages_per_file = pages_per_file
+        self.n_pages = n_files * pages_per_file
+        self.records_per_page = (self.page_size - self.page_header_size - self.checksum_size) // record_size
+        self.next_sequence = next_sequence
+        self.written_bytes = 0
+
+
+    def _file_path(self, index: int) -> str:
+        return f'{self.directory}/journal_{index}.bin'
+
+
+    def _ensure_files(self):
+        # Create missing or wrongly sized files at their full size, with all pages invalid (zero magic)
+        try:
+            os.mkdir(self.directory)
+        except OSError:
+            pass  # exists already
+        file_size = self.pages_per_file * self.page_size
+        for index in range(self.n_files):
+            try:
+                size = os.stat(self._file_path(index))[6]
+            except OSError:
+                size = -1
+            if size != file_size:
+                with open(self._file_path(index), 'wb') as f:
+                    f.write(bytes(file_size))
+                self.written_bytes += file_size
+
+
+    def _scan(self, max_records: int = None) -> list:
+        # Read all files sequentially. Determines the next sequence number and returns the (sequence, payload) tuples
+        # of the newest valid pages holding at least max_records records (all if None), in any order.
+        pages = []
+        n_records = 0
+        max_sequence = -1
+        page = bytearray(self.page_size)
+        for index in range(self.n_files):
+            try:
+                f = open(self._file_path(index), 'rb')
+            except OSError:
+                continue
+            with f:
+                while f.readinto(page) == self.page_size:
+                    magic, sequence, count, record_size = struct.unpack_from(self.page_header_format, page)
+                    end = self.page_header_size + count * record_size
+                    if magic != self.magic or record_size != self.record_size or count > self.records_per_page or \
+                            int.from_bytes(page[end:end + self.checksum_size], 'big') != fletcher16(page[:end]):
+                        continue
+                    max_sequence = max(max_sequence, sequence)
+                    pages.append((sequence, bytes(page[self.page_header_size:end])))
+                    n_records += count
+                    if max_records is not None:
+                        # Drop the oldest page as long as the others hold enough records
+                        oldest = min(pages)
+                        if n_records - len(oldest[1]) // self.record_size >= max_records:
+                            pages.remove(oldest)
+                            n_records -= len(oldest[1]) // self.record_size
+        self.next_sequence = max_sequence + 1
+        return pages
+
+
+    def read_records(self, max_records: int = None) -> list:
+        """
+        Return the latest max_records records (all if None) as list of bytes objects, oldest first.
+
+        Reads the whole journal once and sequentially, meant to restore the buffers after a cold start.
+        """
+        pages = self._scan(max_records)
+        pages.sort()
+        records = []
+        for _, payload in pages:
+            for start in range(0, len(payload), self.record_size):
+                records.append(payload[start:start + self.record_size])
+        if max_records is not None and len(records) > max_records:
+            records = records[len(records) - max_records:]
+        return records
+
+
+    def append(self, records: bytes, keep_open: bool = False) -> int:
+        """
+        Append encoded records (a multiple of record_size bytes), one page write per records_per_page records.
+
+        With keep_open, a last page that isn't full is written without advancing the sequence number. It stays open:
+        the next append overwrites it and must therefore start with the same records. This saves records early without
+        using up a page per write.
+
+        :return: Number of pages written
+        """
+        if self.next_sequence is None:
+            self._scan(max_records=0)
+        self._ensure_files()
+        page_bytes = self.records_per_page * self.record_size
+        n_pages = 0
+        for start in range(0, len(records), page_bytes):
+            payload = records[start:start + page_bytes]
+            page = bytearray(self.page_size)
+            struct.pack_into(self.page_header_format, page, 0, self.magic, self.next_sequence,
+                             len(payload) // self.record_size, self.record_size)
+            end = self.page_header_size + len(payload)
+            page[self.page_header_size:end] = payload
+            page[end:end + self.checksum_size] = fletcher16(page[:end]).to_bytes(self.checksum_size, 'big')
+            slot = self.next_sequence % self.n_pages
+            with open(self._file_path(slot // self.pages_per_file), 'r+b') as f:
+                f.seek((slot % self.pages_per_file) * self.page_size)
+                f.write(page)
+            self.written_bytes += self.page_size
+            n_pages += 1
+            if keep_open and len(payload) < page_bytes:
+                break
+            self.next_sequence += 1
+        return n_pages
@@ -5,6 +5,7 @@ import displayio
 from adafruit_display_text import bitmap_label
 from adafruit_displayio_layout.widgets.widget import Widget
 
+from utils.algorithm import FIXED_POINT_BITS, fixed_point_map
 from utils.eink_constants import PaletteColor, eink_palette
 
 
@@ -83,11 +84,13 @@ class GraphPlot(Widget):
         self.append(self._screen_tilegrid)
 
 
-    def _setup_yscale(self, data_array: list):
-        # First determine data range
-        max_data = max(data_array)
+    def _setup_yscale(self, data_array: list, data_range: tuple = None):
+        # First determine data range, unless it is already known (e.g. from the aggregates of the history)
+        if data_range is not None:
+            min_data, max_data = data_range
+        else:
+            min_data, max_data = min(data_array), max(data_array)
         self.max_data_with_margin = max_data * self.ytick_margin_percentage
-        min_data = min(data_array)
         self.min_data_with_margin = min_data * (2 - self.ytick_margin_percentage)
 
         if max_data == min_data:
@@ -123,10 +126,30 @@ class GraphPlot(Widget):
                      compensation) + self.origin[1]
 
 
+    def _setup_raw_to_pixel(self, value_scale: float, value_offset: float, compensation=0):
+        # Fixed-point version of y_data_to_pixel for the raw integers of a history (value = raw / value_scale +
+        # value_offset). The raws are taken relative to the bottom of the scale, so the products stay small ints.
+        self._raw_base = round((self.min_data_with_margin - value_offset) * value_scale)
+        pixels_per_raw = self.data_range_with_margin_to_pixel_factor / value_scale
+        base_pixel = (self._raw_base / value_scale + value_offset - self.min_data_with_margin) * \
+            self.data_range_with_margin_to_pixel_factor + compensation + self.origin[1]
+        self._raw_factor, self._raw_pixel_offset = fixed_point_map(pixels_per_raw, base_pixel)
+
+
+    def raw_to_pixel(self, raw: int) -> int:
+        return ((raw - self._raw_base) * self._raw_factor + self._raw_pixel_offset) >> FIXED_POINT_BITS
+
+
     def x_data_to_pixel(self, x_value):
         return x_value + self.origin[0]
 
 
+    def x_position_to_pixel(self, x_position, advance: int = 1):
+        # x positions count backwards from the newest sample at the right edge, in units of sample intervals
+        assert self.alignment == 'right'
+        return self.top_right[0] - round(x_position * advance)
+
+
     def _draw_yticks_and_labels(self):
         # max_characters = ceil((self.origin[0] - self.yticks_length - 4) / self._font_width)
         for factor in range(self.first_ytick_factor, self.last_ytick_factor + 1):
@@ -155,20 +178,34 @@ class GraphPlot(Widget):
             self.append(tick_label)
 
 
-    def _plot_line(self, data_array: list, advance: int = 1):
+    def _plot_line(self, data_array, advance: int = 1, x_positions: list = None, n_points: int = None,
+                   value_scale: float = None, value_offset: float = 0.0):
+        # data_array may also be an iterator over the values, then n_points must be given. With value_scale, it holds
+        # the raw integers of a history which are mapped to pixels in fixed-point.
+        n_points = len(data_array) if n_points is None else n_points
+        data_iter = iter(data_array)
         # If we plot an even number of pixels thick, the line's center is offset by -0.5 pixel downward -> precorrect
         self.compensate_even_thickness = (1 - (self.line_width % 2)) * 0.5 * self.data_range_with_margin_to_pixel_factor
-        current_pixel_value_y = self.y_data_to_pixel(data_array[0], self.compensate_even_thickness)
-        if self.alignment == 'right':
-            current_pixel_value_x = self.top_right[0] - (len(data_array) - 1) * advance
+        if value_scale is not None:
+            self._setup_raw_to_pixel(value_scale, value_offset, self.compensate_even_thickness)
+            to_pixel = self.raw_to_pixel
+        else:
+            def to_pixel(y_value):
+                return self.y_data_to_pixel(y_value, self.compensate_even_thickness)
+        current_pixel_value_y = to_pixel(next(data_iter))
+        if x_positions is not None:
+            current_pixel_value_x = self.x_position_to_pixel(x_positions[0], advance)
+        elif self.alignment == 'right':
+            current_pixel_value_x = self.top_right[0] - (n_points - 1) * advance
         else:
             current_pixel_value_x = self.origin[0]
 
-        for x_value in range(len(data_array) - 1):
-            next_pixel_value_y = self.y_data_to_pixel(data_array[x_value + 1], self.compensate_even_thickness)
-            if self.alignment == 'fit':
-                next_pixel_value_x = round(self.origin[0] + (x_value + 1) * (self.graph_width - 1) / (len(data_array) -
-                                                                                                      1))
+        for x_value in range(n_points - 1):
+            next_pixel_value_y = to_pixel(next(data_iter))
+            if x_positions is not None:
+                next_pixel_value_x = self.x_position_to_pixel(x_positions[x_value + 1], advance)
+            elif self.alignment == 'fit':
+                next_pixel_value_x = round(self.origin[0] + (x_value + 1) * (self.graph_width - 1) / (n_points - 1))
             else:
                 next_pixel_value_x = current_pixel_value_x + advance
             for y_offset in range(- (self.line_width // 2), (self.line_width - 1) // 2 + 1):
@@ -183,7 +220,7 @@ class GraphPlot(Widget):
             current_pixel_value_x = next_pixel_value_x
 
         # If only one data point is available yet, no line was drawn -> plot a single point
-        if len(data_array) == 1:
+        if n_points == 1:
             if not self.dry:
                 bitmaptools.draw_line(self._plot_bitmap, current_pixel_value_x,
                                       current_pixel_value_y - (self.line_width // 2),
@@ -194,23 +231,84 @@ class GraphPlot(Widget):
                       current_pixel_value_y + (self.line_width - 1) // 2)
 
 
-    def plot_graph(self, data_array: list, zoomed: bool = False, clear_first=False, peak_ind: int = None):
+    def plot_graph(self, data_array, zoomed: bool = False, clear_first=False, peak_ind: int = None,
+                   x_positions: list = None, data_range: tuple = None, n_points: int = None,
+                   value_scale: float = None, value_offset: float = 0.0):
+        # data_array may be an iterator if data_range and n_points are given, it's consumed in a single pass. With
+        # value_scale, data_array holds raw integers (value = raw / value_scale + value_offset), data_range is still
+        # in values.
         if clear_first:
             self._plot_bitmap.fill(self.background_color)
 
-        self._setup_yscale(data_array)
+        if value_scale is not None and data_range is None:
+            data_range = (min(data_array) / value_scale + value_offset, max(data_array) / value_scale + value_offset)
+        self._setup_yscale(data_array, data_range)
         self._draw_yticks_and_labels()
-        self._plot_line(data_array, advance=2 if zoomed else 1)
-
-
-    def plot_peak(self, data_array: list, peak_pos_in_history: int = None, zoomed: bool = False):
+        self._plot_line(data_array, advance=2 if zoomed else 1, x_positions=x_positions, n_points=n_points,
+                        value_scale=value_scale, value_offset=value_offset)
+
+
+    def plot_history(self, history, window: int, zoomed: bool = False, clear_first=False,
+                     minutes_per_column: float = None) -> list:
+        # Plot the latest `window` samples of a TieredHistory with one sample interval per column. Timed histories are
+        # placed by the real age of their samples, untimed ones are queried as exactly as many points as columns.
+        # Returns the x positions of the plotted samples (None if untimed).
+        n_points = self.graph_width // 2 if zoomed else self.graph_width
+        x_positions = None
+        data_range = None
+        value_scale = None
+        if minutes_per_column is not None and history.minutes is not None:
+            ages = history.read_timed_ages((window - 1) * minutes_per_column)
+            x_positions = [age / minutes_per_column for age in ages]
+            n_points = len(ages)
+            stats = history.window_stats() if n_points == history.current_size else None
+            # The raw integers of the history are plotted, they only become floats for the tick labels
+            value_scale = history.value_scale
+            if stats is not None:
+                # The whole history is plotted, so its aggregates give the data range and the values can be streamed
+                # directly from the sleep memory into the line
+                data_range = stats[:2]
+                data_array = history.iter_raw(amount=n_points)
+            else:
+                data_array = list(history.iter_raw(amount=n_points))
+        else:
+            data_array = history.query(window, n_points)
+            n_points = len(data_array)
+        if n_points > 0:
+            self.plot_graph(data_array, zoomed=zoomed, clear_first=clear_first, x_positions=x_positions,
+                            data_range=data_range, n_points=n_points, value_scale=value_scale,
+                            value_offset=history.value_offset)
+        return x_positions
+
+
+    def plot_archive(self, history, minutes: float, minutes_per_sample: float, clear_first=False):
+        # Plot the latest `minutes` of a TieredHistory over the whole graph width from its consolidated tiers. The
+        # window is converted to samples with the mean interval of the timed samples in tier 0 (minutes_per_sample if
+        # untimed), so the columns follow the time even when the samples were taken slower, e.g. in the fridge.
+        if history.minutes is not None and history.current_size > 1:
+            ages = history.read_ages()
+            if ages[0] > 0:
+                minutes_per_sample = ages[0] / (len(ages) - 1)
+        data_array = history.query(max(1, round(minutes / minutes_per_sample)), self.graph_width)
+        if data_array:
+            self.plot_graph(data_array, clear_first=clear_first)
+
+
+    def plot_peak(self, peak_value: float, peak_pos_in_history: int = None, zoomed: bool = False,
+                  x_positions: list = None):
         advance = 2 if zoomed else 1
-        if peak_pos_in_history * advance + 1 < self.graph_width:
+        if x_positions is not None:
+            peak_in_window = peak_pos_in_history < len(x_positions)
+        else:
+            peak_in_window = peak_pos_in_history * advance + 1 < self.graph_width
+        if peak_in_window:
             # Peak ind is not out of plot window
-            peak_y_val = data_array[-1 - peak_pos_in_history]
-            peak_y_pos = self.y_data_to_pixel(peak_y_val, self.compensate_even_thickness) - 1
+            peak_y_pos = self.y_data_to_pixel(peak_value, self.compensate_even_thickness) - 1
             assert self.alignment == 'right'
-            peak_x_pos = self.top_right[0] - peak_pos_in_history * advance
+            if x_positions is not None:
+                peak_x_pos = self.x_position_to_pixel(x_positions[-1 - peak_pos_in_history], advance)
+            else:
+                peak_x_pos = self.top_right[0] - peak_pos_in_history * advance
             # Draw triangle
             for start_x, start_y, length in zip([0, -1, -1, -2, -2], [-1, -2, -3, -4, -5], [1, 3, 3, 5, 5]):
                 bitmaptools.draw_line(self._plot_bitmap, peak_x_pos + start_x, peak_y_pos + start_y,
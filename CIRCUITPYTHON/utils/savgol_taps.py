@@ -0,0 +1,10 @@
+# Generated by experiments/peak_detection/savgol_taps.py --window 9 --order 2 --lag 2, don't edit.
+# Savitzky-Golay taps (oldest sample first) for the value and the slope per sample SAVGOL_LAG samples before the newest
+# of SAVGOL_WINDOW samples, see utils.algorithm.apply_taps.
+SAVGOL_WINDOW = 9
+SAVGOL_ORDER = 2
+SAVGOL_LAG = 2
+SMOOTH_TAPS = (-238, -21, 156, 293, 390, 447, 464, 441, 378)
+SMOOTH_DENOMINATOR = 2310
+SLOPE_TAPS = (252, -91, -314, -417, -400, -263, -6, 371, 868)
+SLOPE_DENOMINATOR = 4620
@@ -1,4 +1,23 @@
 import alarm
+import struct
+from array import array
+
+from utils.algorithm import hampel_check, logistic_forecast, sorted_index
+
+
+def write_changed(addr: int, data, stored: bytearray) -> int:
+    # Write only the span of data which differs from the stored copy (as one slice) and update the copy. Returns the
+    # number of written bytes.
+    first = 0
+    last = len(data)
+    while first < last and data[first] == stored[first]:
+        first += 1
+    while last > first and data[last - 1] == stored[last - 1]:
+        last -= 1
+    if first < last:
+        alarm.sleep_memory[addr + first:addr + last] = data[first:last]
+        stored[first:last] = data[first:last]
+    return last - first
 
 
 class CyclicBuffer:
@@ -11,6 +30,12 @@ class CyclicBuffer:
     the oldest written element. Head and tail pointers are both in byte space, not value space. The situation where the
     head and the tail pointer both point to the same memory can be interpreted as either a full or an empty buffer.
     Thus, a flag for "empty" is reserved.
+
+    The header is kept in RAM as well, only its changed bytes are written. If the buffer is attached to a
+    SleepMemorySession, header changes are deferred until the session is flushed.
+
+    If on_drop is set, it's called with the list of values (oldest first) which are about to be overwritten on a full
+    buffer, e.g. to consolidate them into a coarser tier of a TieredHistory.
     """
     addr_offset_capacity = 0  # in values
     addr_capacity_size = 2
@@ -22,22 +47,26 @@ class CyclicBuffer:
     addr_tail_size = 2
     addr_offset_empty = 7
     header_size = 8
+    header_format = '>HBHHB'  # capacity, bytes per value, head, tail, empty
+    session = None
+    on_drop = None
+
+    # Bulk codec: struct format character of one stored value (big-endian) and the linear mapping
+    # value = raw / value_scale + value_offset. Subclasses that leave bulk_format at None are decoded value by value.
+    bulk_format = None
+    value_scale = 1.0
+    value_offset = 0.0
 
 
-    def __init__(self, addr, capacity: int, bytes_per_value: int):
+    def __init__(self, addr, capacity: int, bytes_per_value: int, initialize: bool = False):
         assert capacity % bytes_per_value == 0
         self.addr = addr
 
-        # Read bytes per value
-        self.bytes_per_value = int.from_bytes(
-            alarm.sleep_memory[self.addr + self.addr_offset_bytes_per_value:
-                               self.addr + self.addr_offset_bytes_per_value + self.addr_bytes_per_value_size], 'big')
-
-        # Read buffer size
-        self.capacity = int.from_bytes(
-            alarm.sleep_memory[self.addr + self.addr_offset_capacity:
-                               self.addr + self.addr_offset_capacity + self.addr_capacity_size], 'big')
-        if self.capacity == 0 or self.capacity != capacity or self.bytes_per_value == 0:
+        # Read the whole header at once and keep it, such that later on only changed bytes are written
+        self._stored_header = bytearray(alarm.sleep_memory[self.addr:self.addr + self.header_size])
+        self.capacity, self.bytes_per_value, head, tail, empty = struct.unpack(self.header_format,
+                                                                              self._stored_header)
+        if initialize or self.capacity == 0 or self.capacity != capacity or self.bytes_per_value == 0:
             # Memory wasn't initialized
             assert 0 <= capacity <= 2 ** 16 - 1
             # Initialize empty buffer
@@ -51,35 +80,30 @@ class CyclicBuffer:
             self.update_header()
         else:
             self.value_capacity = self.capacity // self.bytes_per_value
-            # Read buffer head and tail
-            self.head = int.from_bytes(
-                alarm.sleep_memory[
-                self.addr + self.addr_offset_head:self.addr + self.addr_offset_head + self.addr_head_size], 'big')
-            self.tail = int.from_bytes(
-                alarm.sleep_memory[
-                self.addr + self.addr_offset_tail:self.addr + self.addr_offset_tail + self.addr_tail_size], 'big')
-            self.empty = alarm.sleep_memory[self.addr + self.addr_offset_empty]
+            self.head = head
+            self.tail = tail
+            self.empty = empty
             if self.head == self.tail:
                 self.current_size = 0 if self.empty else self.value_capacity
             else:
                 self.current_size = int((self.head - self.tail) % self.capacity) // self.bytes_per_value
 
 
-    def update_header(self, only_head_and_tail=False):
-        if not only_head_and_tail:
-            alarm.sleep_memory[self.addr + self.addr_offset_capacity:
-                               self.addr + self.addr_offset_capacity + self.addr_capacity_size] = \
-                self.capacity.to_bytes(self.addr_capacity_size, 'big')
-            alarm.sleep_memory[self.addr + self.addr_offset_bytes_per_value:
-                               self.addr + self.addr_offset_bytes_per_value + self.addr_bytes_per_value_size] = \
-                self.bytes_per_value.to_bytes(self.addr_bytes_per_value_size, 'big')
-        alarm.sleep_memory[self.addr + self.addr_offset_head:
-                           self.addr + self.addr_offset_head + self.addr_head_size] = \
-            self.head.to_bytes(self.addr_head_size, 'big')
-        alarm.sleep_memory[self.addr + self.addr_offset_tail:
-                           self.addr + self.addr_offset_tail + self.addr_tail_size] = \
-            self.tail.to_bytes(self.addr_tail_size, 'big')
-        alarm.sleep_memory[self.addr + self.addr_offset_empty] = self.empty
+    def update_header(self):
+        # Within a session the header is written by the session's flush, otherwise right away
+        if self.session is not None:
+            self.session.mark_dirty(self)
+        else:
+            self.flush()
+
+
+    def flush(self) -> int:
+        header = struct.pack(self.header_format, self.capacity, self.bytes_per_value, self.head, self.tail, self.empty)
+        return write_changed(self.addr, header, self._stored_header)
+
+
+    def attach_session(self, session):
+        self.session = session
 
 
     def increment_modulo_capacity(self, pointer):
@@ -88,6 +112,8 @@ class CyclicBuffer:
 
 
     def add_value(self, val):
+        if self.on_drop is not None and self.current_size >= self.value_capacity:
+            self.on_drop([self.decode(alarm.sleep_memory[self.tail:self.tail + self.bytes_per_value])])
         self.empty = 0
         # Encode value to byte array
         byte_array = self.encode(val)
@@ -100,18 +126,106 @@ class CyclicBuffer:
             self.tail = self.head
         else:
             self.current_size += 1
-        self.update_header(only_head_and_tail=True)
+        self.update_header()
+
+
+    def add_values(self, values):
+        values = list(values)
+        if not values:
+            return
+        # Values which would be overwritten within this batch anyway are skipped, but still advance the head
+        skipped = max(0, len(values) - self.value_capacity)
+        n_dropped = self.current_size + len(values) - self.value_capacity
+        if self.on_drop is not None and n_dropped > 0:
+            # The oldest stored values are dropped first, then the skipped ones of the batch
+            n_stored = min(n_dropped, self.current_size)
+            dropped = [self.decode(byte_block) for byte_block, _ in
+                       self._read_segments(self.tail, n_stored, chunk_amount=1)]
+            self.on_drop(dropped + values[:skipped])
+        self.empty = 0
+        data_start = self.addr + self.header_size
+        write_head = data_start + (self.head - data_start + skipped * self.bytes_per_value) % self.capacity
+        byte_array = self.encode_values(values[skipped:])
+        # Write bytes in at most two slices: up to the end of the ring and the remainder from its start
+        first_size = min(len(byte_array), data_start + self.capacity - write_head)
+        alarm.sleep_memory[write_head:write_head + first_size] = byte_array[:first_size]
+        if first_size < len(byte_array):
+            alarm.sleep_memory[data_start:data_start + len(byte_array) - first_size] = byte_array[first_size:]
+        # Increment head pointer by the whole batch
+        self.head = data_start + (write_head - data_start + len(byte_array)) % self.capacity
+        if self.current_size + len(values) >= self.value_capacity:
+            # Full capacity: Overwriting oldest data --> move tail along with head
+            self.current_size = self.value_capacity
+            self.tail = self.head
+        else:
+            self.current_size += len(values)
+        self.update_header()
+
+
+    def encode_values(self, values: list) -> bytearray:
+        if self.bulk_format is None:
+            byte_array = bytearray()
+            for val in values:
+                byte_array += self.encode(val)
+            return byte_array
+        max_raw = (1 << (8 * self.bytes_per_value)) - 1
+        raw_values = [max(0, min(round((val - self.value_offset) * self.value_scale), max_raw)) for val in values]
+        return bytearray(struct.pack('>' + str(len(raw_values)) + self.bulk_format, *raw_values))
 
 
     def read_array(self, amount=None):
-        val_list = []
+        amount, read_head = self._read_start(amount)
+        if self.bulk_format is None:
+            return self._read_array_per_value(read_head, amount)
+        return self._read_array_bulk(read_head, amount)
+
+
+    def iter_values(self, amount=None, chunk_amount: int = 32):
+        """
+        Yield the latest `amount` values, oldest first, like read_array but without building the whole array.
+
+        The memory is sliced in chunks of at most chunk_amount values, so the allocations don't grow with the length of
+        the history. Meant for consumers which only pass once over the values.
+        """
+        if self.bulk_format is None:
+            amount, read_head = self._read_start(amount)
+            for byte_block, _ in self._read_segments(read_head, amount, chunk_amount=1):
+                yield self.decode(byte_block)
+            return
+        for raw in self.iter_raw(amount, chunk_amount):
+            yield raw / self.value_scale + self.value_offset
+
+
+    def iter_raw(self, amount=None, chunk_amount: int = 32):
+        # Like iter_values, but yields the stored integers (value = raw / value_scale + value_offset) of a bulk codec
+        amount, read_head = self._read_start(amount)
+        for segment, segment_amount in self._read_segments(read_head, amount, chunk_amount):
+            for raw in struct.unpack('>' + str(segment_amount) + self.bulk_format, segment):
+                yield raw
+
+
+    def read_bytes(self, amount=None) -> bytearray:
+        # Encoded bytes of the latest `amount` values, oldest first
+        amount, read_head = self._read_start(amount)
+        data = bytearray()
+        for segment, _ in self._read_segments(read_head, amount):
+            data += segment
+        return data
+
+
+    def _read_start(self, amount=None):
+        # Clip the amount of values to read and find the address of the first one
         if amount is None:
-            amount = self.current_size
-            read_head = self.tail
-        else:
-            amount = min(self.current_size, amount)
-            read_head = self.addr + self.header_size + (
-                    self.head - self.addr - self.header_size - amount * self.bytes_per_value) % self.capacity
+            return self.current_size, self.tail
+        amount = min(self.current_size, amount)
+        read_head = self.addr + self.header_size + (
+                self.head - self.addr - self.header_size - amount * self.bytes_per_value) % self.capacity
+        return amount, read_head
+
+
+    def _read_array_per_value(self, read_head, amount):
+        # Fallback for buffers without a bulk codec: slice and decode every value separately
+        val_list = []
         for _ in range(amount):
             byte_block = alarm.sleep_memory[read_head:read_head + self.bytes_per_value]
             read_head = self.increment_modulo_capacity(read_head)
@@ -120,12 +234,36 @@ class CyclicBuffer:
         return val_list
 
 
+    def _read_segments(self, read_head, amount, chunk_amount=None):
+        # The requested values occupy at most two contiguous segments: read_head..end of ring and start of ring..
+        # Each segment is sliced as a whole, or in chunks of at most chunk_amount values.
+        data_start = self.addr + self.header_size
+        first_amount = min(amount, (data_start + self.capacity - read_head) // self.bytes_per_value)
+        for segment_start, segment_amount in ((read_head, first_amount), (data_start, amount - first_amount)):
+            while segment_amount > 0:
+                slice_amount = segment_amount if chunk_amount is None else min(segment_amount, chunk_amount)
+                slice_end = segment_start + slice_amount * self.bytes_per_value
+                yield alarm.sleep_memory[segment_start:slice_end], slice_amount
+                segment_start = slice_end
+                segment_amount -= slice_amount
+
+
+    def _read_array_bulk(self, read_head, amount):
+        values = array('f', bytes(4 * amount))
+        index = 0
+        for segment, segment_amount in self._read_segments(read_head, amount):
+            for raw in struct.unpack('>' + str(segment_amount) + self.bulk_format, segment):
+                values[index] = raw / self.value_scale + self.value_offset
+                index += 1
+        return values
+
+
     def make_empty(self):
         self.head = self.addr + self.header_size
         self.tail = self.head
         self.current_size = 0
         self.empty = 1
-        self.update_header(only_head_and_tail=True)
+        self.update_header()
 
 
     def encode(self, val) -> bytearray:
@@ -166,16 +304,24 @@ class CyclicBuffer:
         self.make_empty()
         amount = self.value_capacity if amount is None else min(self.value_capacity, amount)
         exp_filtered = (max_val + min_val) / 2
+        values = []
         for i in range(amount):
             val = min_val + random.random() * (max_val - min_val)
             exp_filtered = exp_alpha * val + (1 - exp_alpha) * exp_filtered
-            self.add_value(exp_filtered)
+            values.append(exp_filtered)
+        self.add_values(values)
 
 
     def get_last_address(self):
         return self.addr + self.header_size + self.capacity
 
 
+    @property
+    def max_value_count(self):
+        # Upper bound of current_size
+        return self.value_capacity
+
+
 class Cyclic16BitTempBuffer(CyclicBuffer):
     """
     Cyclic buffer holding temperature values in 16 bit format.
@@ -185,11 +331,15 @@ class Cyclic16BitTempBuffer(CyclicBuffer):
 
     In theory, the representable range is from -40.00°C to 655.35°C.
     """
+    bulk_format = 'H'
+    value_scale = 100.0
+    value_offset = -40.0
 
 
-    def __init__(self, addr, max_value_capacity):
+    def __init__(self, addr, max_value_capacity, initialize: bool = False):
         self.bytes_per_value = 2
-        super().__init__(addr, capacity=max_value_capacity * self.bytes_per_value, bytes_per_value=self.bytes_per_value)
+        super().__init__(addr, capacity=max_value_capacity * self.bytes_per_value, bytes_per_value=self.bytes_per_value,
+                         initialize=initialize)
 
 
     def encode(self, temp: float) -> bytearray:
@@ -212,11 +362,14 @@ class Cyclic16BitPercentageBuffer(CyclicBuffer):
 
     In theory, the representable range is from 0.00% to 655.35%.
     """
+    bulk_format = 'H'
+    value_scale = 100.0
 
 
-    def __init__(self, addr, max_value_capacity):
+    def __init__(self, addr, max_value_capacity, initialize: bool = False):
         self.bytes_per_value = 2
-        super().__init__(addr, capacity=max_value_capacity * self.bytes_per_value, bytes_per_value=self.bytes_per_value)
+        super().__init__(addr, capacity=max_value_capacity * self.bytes_per_value, bytes_per_value=self.bytes_per_value,
+                         initialize=initialize)
 
 
     def encode(self, percentage: float) -> bytearray:
@@ -230,42 +383,1451 @@ class Cyclic16BitPercentageBuffer(CyclicBuffer):
         return int_val / 100.0
 
 
+class FixedPointCodec:
+    """
+    Fixed-point codec of one channel: a value is stored as raw = round((value - offset) * scale), clipped to the
+    unsigned range of the given bit width.
+
+    With reserve_missing, the largest raw value marks a missing value (None) and valid values are clipped below it.
+    """
+
+    def __init__(self, bits: int, scale: float, offset: float = 0.0, reserve_missing: bool = False):
+        assert 1 <= bits <= 16
+        self.bits = bits
+        self.scale = scale
+        self.offset = offset
+        self.missing_raw = (1 << bits) - 1 if reserve_missing else None
+        self.max_raw = (1 << bits) - (2 if reserve_missing else 1)
+
+
+    def encode_raw(self, val) -> int:
+        if val is None:
+            return self.missing_raw
+        return max(0, min(round((val - self.offset) * self.scale), self.max_raw))
+
+
+    def decode_raw(self, raw: int):
+        if raw == self.missing_raw:
+            return None
+        return raw / self.scale + self.offset
+
+
+def pack_bits(buf: bytearray, bit_pos: int, raw_values, widths: tuple):
+    # Write raw values MSB first into buf starting at bit position bit_pos, the widths are used cyclically. Bits
+    # outside of the written values are kept.
+    n_widths = len(widths)
+    for i, raw in enumerate(raw_values):
+        bits = widths[i % n_widths]
+        end = bit_pos + bits
+        first = bit_pos // 8
+        last = (end - 1) // 8
+        word = 0
+        for k in range(first, last + 1):
+            word = (word << 8) | buf[k]
+        shift = (last + 1) * 8 - end
+        mask = ((1 << bits) - 1) << shift
+        word = (word & ~mask) | (raw << shift)
+        for k in range(last, first - 1, -1):
+            buf[k] = word & 0xFF
+            word >>= 8
+        bit_pos = end
+
+
+def unpack_bits(data, amount: int, widths: tuple, bit_skip: int = 0):
+    # Yield `amount` raw values packed MSB first into data, starting bit_skip bits into the first byte. The widths are
+    # used cyclically. Only small integers are involved, so nothing is allocated per value.
+    if amount <= 0:
+        return
+    n_widths = len(widths)
+    field = 0
+    bits = widths[0]
+    acc = 0
+    n_bits = -bit_skip
+    for byte in data:
+        acc = ((acc << 8) | byte) & ((1 << (n_bits + 8)) - 1)
+        n_bits += 8
+        while n_bits >= bits:
+            n_bits -= bits
+            yield acc >> n_bits
+            acc &= (1 << n_bits) - 1
+            field += 1
+            if field == amount:
+                return
+            bits = widths[field % n_widths]
+
+
+class CyclicDeltaBuffer(CyclicBuffer):
+    """
+    Cyclic buffer storing 16 bit fixed-point values as keyframes plus signed 8 bit or 4 bit deltas.
+
+    The ring is divided into blocks of block_size bytes. Each block starts with the number of values it holds (1 byte)
+    and an absolute 16 bit keyframe, followed by a stream of delta units of delta_bits each. A delta which doesn't fit
+    into one unit is stored as the escape unit (most negative unit value) followed by the absolute 16 bit value. Head
+    and tail point to the newest (open) and the oldest block. When the ring is full, the oldest block is dropped as a
+    whole, thus the history length varies by up to one block.
+
+    Slowly changing signals need about 1 byte (8 bit deltas) or half a byte (4 bit deltas) per value instead of 2.
+
+    With aggregates enabled, every block header additionally holds the minimum, maximum, position of the (first)
+    maximum and sum (24 bit, a block holds at most 255 values) of the block's raw values. Window statistics over the
+    whole live history are then combined from the n_blocks headers without decoding any value, and dropping the oldest
+    block drops its statistics along with it.
+
+    on_drop (see CyclicBuffer) is called with all values of the oldest block when it's dropped.
+    """
+    addr_block_count_size = 1
+    addr_block_keyframe_size = 2
+    addr_block_aggregates_size = 8
+    aggregates_format = '>HHBBH'  # min, max, position of max, sum (high byte, low 16 bits)
+    block_header_size = 3
+    value_scale = 100.0
+    value_offset = 0.0
+
+
+    def __init__(self, addr, max_bytes: int, block_size: int = 64, delta_bits: int = 8, aggregates: bool = False,
+                 initialize: bool = False):
+        assert delta_bits in (4, 8) and max_bytes >= 2 * block_size
+        self.aggregates = aggregates
+        if aggregates:
+            self.block_header_size = self.addr_block_count_size + self.addr_block_keyframe_size + \
+                                     self.addr_block_aggregates_size
+        self.delta_bits = delta_bits
+        self.units_per_block = (block_size - self.block_header_size) * 8 // delta_bits
+        # The value count of a block must fit into one byte
+        assert 1 + self.units_per_block <= 255
+        self.escape_unit = 1 << (delta_bits - 1)
+        self.units_per_absolute = 16 // delta_bits
+        self.block_size = block_size
+        super().__init__(addr, capacity=max_bytes - max_bytes % block_size, bytes_per_value=block_size,
+                         initialize=initialize or self._stored_block_size(addr) not in (0, block_size))
+        self.n_blocks = self.capacity // self.block_size
+        # Guaranteed history length, even if every value needs an escape
+        self.value_capacity = (self.n_blocks - 1) * (1 + self.units_per_block // (1 + self.units_per_absolute))
+        self._used_units = 0
+        self._last_raw = 0
+        self._head_count = 0
+        self._head_aggregates = None
+        if self.empty:
+            self.current_size = 0
+        else:
+            # Sum up the value counts of all blocks and restore the write position within the open block
+            self.current_size = 0
+            block = self.tail
+            while True:
+                self.current_size += alarm.sleep_memory[block]
+                if block == self.head:
+                    break
+                block = self.increment_modulo_capacity(block)
+            raw_values, self._used_units = self._decode_block(self.head)
+            self._last_raw = raw_values[-1]
+            self._head_count = len(raw_values)
+            if self.aggregates:
+                self._head_aggregates = self._unpack_aggregates(self._block_aggregates_bytes(self.head))
+
+
+    def _stored_block_size(self, addr):
+        return alarm.sleep_memory[addr + self.addr_offset_bytes_per_value]
+
+
+    def encode_raw(self, val: float) -> int:
+        return max(0, min(round((val - self.value_offset) * self.value_scale), 65535))
+
+
+    def _write_units(self, block, unit_index, units):
+        payload = block + self.block_header_size
+        for unit in units:
+            if self.delta_bits == 8:
+                alarm.sleep_memory[payload + unit_index] = unit
+            elif unit_index % 2 == 0:
+                # High nibble first, the low nibble is still unused
+                alarm.sleep_memory[payload + unit_index // 2] = unit << 4
+            else:
+                addr = payload + unit_index // 2
+                alarm.sleep_memory[addr] = (alarm.sleep_memory[addr] & 0xF0) | unit
+            unit_index += 1
+
+
+    def _open_block(self, raw):
+        if self.current_size > 0:
+            next_block = self.increment_modulo_capacity(self.head)
+            if next_block == self.tail:
+                # Full capacity: drop the oldest block
+                if self.on_drop is not None:
+                    self.on_drop([raw / self.value_scale + self.value_offset
+                                  for raw in self._decode_block(self.tail)[0]])
+                self.current_size -= alarm.sleep_memory[self.tail]
+                self.tail = self.increment_modulo_capacity(self.tail)
+            self.head = next_block
+        block_header = bytes([1]) + raw.to_bytes(self.addr_block_keyframe_size, 'big')
+        if self.aggregates:
+            self._head_aggregates = [raw, raw, 0, raw]
+            block_header += self._pack_aggregates(self._head_aggregates)
+        alarm.sleep_memory[self.head:self.head + self.block_header_size] = block_header
+        self._used_units = 0
+        self._head_count = 1
+
+
+    def _block_aggregates_bytes(self, block):
+        start = block + self.addr_block_count_size + self.addr_block_keyframe_size
+        return alarm.sleep_memory[start:start + self.addr_block_aggregates_size]
+
+
+    def _pack_aggregates(self, aggregates):
+        raw_min, raw_max, max_pos, raw_sum = aggregates
+        return struct.pack(self.aggregates_format, raw_min, raw_max, max_pos, raw_sum >> 16, raw_sum & 0xFFFF)
+
+
+    def _unpack_aggregates(self, aggregates_bytes) -> list:
+        raw_min, raw_max, max_pos, sum_high, sum_low = struct.unpack(self.aggregates_format, aggregates_bytes)
+        return [raw_min, raw_max, max_pos, (sum_high << 16) | sum_low]
+
+
+    def _update_head_aggregates(self, raw):
+        aggregates = self._head_aggregates
+        aggregates[0] = min(aggregates[0], raw)
+        if raw > aggregates[1]:
+            aggregates[1] = raw
+            aggregates[2] = self._head_count - 1
+        aggregates[3] += raw
+        start = self.head + self.addr_block_count_size + self.addr_block_keyframe_size
+        alarm.sleep_memory[start:start + self.addr_block_aggregates_size] = self._pack_aggregates(aggregates)
+
+
+    def _append_raw(self, raw):
+        delta = raw - self._last_raw
+        if self.current_size == 0:
+            self._open_block(raw)
+        else:
+            if -self.escape_unit < delta < self.escape_unit:
+                units = [delta % (1 << self.delta_bits)]
+            else:
+                units = [self.escape_unit]
+                for shift in range(16 - self.delta_bits, -1, -self.delta_bits):
+                    units.append((raw >> shift) & ((1 << self.delta_bits) - 1))
+            if self._used_units + len(units) > self.units_per_block:
+                self._open_block(raw)
+            else:
+                self._write_units(self.head, self._used_units, units)
+                self._used_units += len(units)
+                self._head_count += 1
+                alarm.sleep_memory[self.head] = self._head_count
+                if self.aggregates:
+                    self._update_head_aggregates(raw)
+        self.current_size += 1
+        self.empty = 0
+        self._last_raw = raw
+
+
+    def add_value(self, val):
+        self._append_raw(self.encode_raw(val))
+        self.update_header()
+
+
+    def add_values(self, values):
+        for val in values:
+            self._append_raw(self.encode_raw(val))
+        self.update_header()
+
+
+    def _decode_block(self, block):
+        # Sequentially decode one block from a single slice, returns the raw values and the number of used units
+        block_bytes = alarm.sleep_memory[block:block + self.block_size]
+        count = block_bytes[0]
+        raw = int.from_bytes(block_bytes[self.addr_block_count_size:
+                                         self.addr_block_count_size + self.addr_block_keyframe_size], 'big')
+        raw_values = [raw]
+        unit_index = 0
+        while len(raw_values) < count:
+            unit = self._unit(block_bytes, unit_index)
+            unit_index += 1
+            if unit == self.escape_unit:
+                raw = 0
+                for _ in range(self.units_per_absolute):
+                    raw = (raw << self.delta_bits) | self._unit(block_bytes, unit_index)
+                    unit_index += 1
+            else:
+                raw += unit - (1 << self.delta_bits) if unit > self.escape_unit else unit
+            raw_values.append(raw)
+        return raw_values, unit_index
+
+
+    def _unit(self, block_bytes, unit_index):
+        if self.delta_bits == 8:
+            return block_bytes[self.block_header_size + unit_index]
+        byte = block_bytes[self.block_header_size + unit_index // 2]
+        return byte & 0x0F if unit_index % 2 else byte >> 4
+
+
+    def read_array(self, amount=None):
+        amount = self.current_size if amount is None else min(self.current_size, amount)
+        values = array('f', bytes(4 * amount))
+        for index, val in enumerate(self.iter_values(amount)):
+            values[index] = val
+        return values
+
+
+    def iter_values(self, amount=None, chunk_amount: int = None):
+        # Yield the latest `amount` values oldest first, decoding one block at a time (chunk_amount is fixed by the
+        # block size and only accepted for compatibility with CyclicBuffer.iter_values)
+        for raw in self.iter_raw(amount):
+            yield raw / self.value_scale + self.value_offset
+
+
+    def iter_raw(self, amount=None, chunk_amount: int = None):
+        amount = self.current_size if amount is None else min(self.current_size, amount)
+        if amount == 0:
+            return
+        # Walk back from the open block until enough values are covered, only those blocks are decoded
+        block = self.head
+        covered = alarm.sleep_memory[block]
+        while covered < amount:
+            block = self.addr + self.header_size + (block - self.addr - self.header_size - self.block_size) % \
+                    self.capacity
+            covered += alarm.sleep_memory[block]
+        skip = covered - amount
+        while True:
+            raw_values, _ = self._decode_block(block)
+            for raw in raw_values[skip:]:
+                yield raw
+            skip = 0
+            if block == self.head:
+                break
+            block = self.increment_modulo_capacity(block)
+
+
+    def make_empty(self):
+        super().make_empty()
+        self._used_units = 0
+        self._last_raw = 0
+        self._head_count = 0
+
+
+    def window_stats(self):
+        """
+        Minimum, maximum, mean and age (in samples, 0 = newest) of the first maximum of all values in the buffer.
+
+        Combined from the block headers, so it costs one small slice per block and no decoding. Returns None if the
+        buffer is empty or has no aggregates.
+        """
+        if not self.aggregates or self.current_size == 0:
+            return None
+        raw_min = 65535
+        raw_max = -1
+        raw_sum = 0
+        max_index = 0
+        index = 0
+        block = self.tail
+        while True:
+            count = alarm.sleep_memory[block]
+            block_min, block_max, block_max_pos, block_sum = \
+                self._unpack_aggregates(self._block_aggregates_bytes(block))
+            raw_min = min(raw_min, block_min)
+            raw_sum += block_sum
+            if block_max > raw_max:
+                raw_max = block_max
+                max_index = index + block_max_pos
+            index += count
+            if block == self.head:
+                break
+            block = self.increment_modulo_capacity(block)
+        return raw_min / self.value_scale + self.value_offset, raw_max / self.value_scale + self.value_offset, \
+            raw_sum / index / self.value_scale + self.value_offset, index - 1 - max_index
+
+
+    @property
+    def max_value_count(self):
+        return self.n_blocks * (1 + self.units_per_block)
+
+
+class CyclicDeltaTempBuffer(CyclicDeltaBuffer):
+    """
+    Delta compressed cyclic buffer holding temperature values with two decimals, see Cyclic16BitTempBuffer.
+    """
+    value_offset = -40.0
+
+
+class CyclicDeltaPercentageBuffer(CyclicDeltaBuffer):
+    """
+    Delta compressed cyclic buffer holding percentage values with one decimal.
+
+    The measurement noise of the growth is in the order of 1%, so a resolution of 0.1% keeps almost all deltas within
+    8 bits, whereas with two decimals more than half of them would need an escape.
+    """
+    value_scale = 10.0
+
+
+class CyclicMinutesBuffer(CyclicBuffer):
+    """
+    Cyclic buffer holding the time deltas between samples in whole minutes (0 to 255) as runs of equal deltas.
+
+    A run is stored as (number of samples, minutes) in 2 bytes. A sample with the same delta as the previous one only
+    increments the count of the newest run in place, so a history sampled at a constant interval (or in the fridge)
+    needs a single run, and every button wake or sensor gap costs about two. When the ring is full, the oldest run is
+    dropped and read_deltas returns a default delta for the samples it covered.
+    """
+    bytes_per_value = 2
+
+
+    def __init__(self, addr, max_runs, initialize: bool = False):
+        super().__init__(addr, capacity=max_runs * self.bytes_per_value, bytes_per_value=self.bytes_per_value,
+                         initialize=initialize)
+
+
+    def encode(self, run: tuple) -> bytearray:
+        return bytearray(run)
+
+
+    def decode(self, byte_array: bytearray) -> tuple:
+        return byte_array[0], byte_array[1]
+
+
+    def add_value(self, minutes: int):
+        minutes = max(0, min(round(minutes), 255))
+        if self.current_size > 0:
+            data_start = self.addr + self.header_size
+            newest = data_start + (self.head - data_start - self.bytes_per_value) % self.capacity
+            count = alarm.sleep_memory[newest]
+            if alarm.sleep_memory[newest + 1] == minutes and count < 255:
+                alarm.sleep_memory[newest] = count + 1
+                return
+        super().add_value((1, minutes))
+
+
+    def add_values(self, values):
+        for minutes in values:
+            self.add_value(minutes)
+
+
+    def read_deltas(self, amount: int, default: int) -> list:
+        # Time deltas of the latest `amount` samples, oldest first, `default` for samples older than the oldest run
+        deltas = [default] * amount
+        index = amount
+        for count, minutes in reversed(self.read_array()):
+            count = min(count, index)
+            deltas[index - count:index] = [minutes] * count
+            index -= count
+            if index == 0:
+                break
+        return deltas
+
+
+class CyclicRecordBuffer(CyclicBuffer):
+    """
+    Cyclic buffer holding records of several bit-packed fixed-point channels per sample under one header.
+
+    All channels of a sample share the same slot, so they can't drift apart and one header write per record is needed.
+    The channels are given as list of (name, scale, offset) or (name, scale, offset, bits) tuples, a value is stored as
+    round((value - offset) * scale) with the given number of bits (16 if omitted), see FixedPointCodec. The channels
+    are packed MSB first and a record is padded to whole bytes. A channel without a value (e.g. a sensor which couldn't
+    be read) is stored as the largest raw value of its width and read back as None (per record) or NaN (per column).
+    """
+
+    def __init__(self, addr, channels: list, max_value_capacity, initialize: bool = False):
+        self.channels = channels
+        self.channel_names = [channel[0] for channel in channels]
+        self.codecs = [FixedPointCodec(channel[3] if len(channel) > 3 else 16, channel[1], channel[2],
+                                       reserve_missing=True) for channel in channels]
+        record_bits = sum(codec.bits for codec in self.codecs)
+        self.bytes_per_value = -(-record_bits // 8)
+        # The padding to whole bytes is unpacked as an extra field which is skipped
+        padding = self.bytes_per_value * 8 - record_bits
+        self.widths = tuple(codec.bits for codec in self.codecs) + ((padding,) if padding else ())
+        super().__init__(addr, capacity=max_value_capacity * self.bytes_per_value, bytes_per_value=self.bytes_per_value,
+                         initialize=initialize)
+
+
+    def encode(self, record: dict) -> bytearray:
+        buf = bytearray(self.bytes_per_value)
+        pack_bits(buf, 0, [codec.encode_raw(record.get(name)) for name, codec in zip(self.channel_names, self.codecs)],
+                  self.widths)
+        return buf
+
+
+    def decode(self, byte_array: bytearray) -> dict:
+        record = {}
+        for name, codec, raw in zip(self.channel_names, self.codecs,
+                                    unpack_bits(byte_array, len(self.codecs), self.widths)):
+            record[name] = codec.decode_raw(raw)
+        return record
+
+
+    def read_column(self, name: str, amount=None):
+        # Bulk read of a single channel: unpack the one or two ring segments and pick every n-th raw value
+        channel_index = self.channel_names.index(name)
+        codec = self.codecs[channel_index]
+        n_fields = len(self.widths)
+        nan = float('nan')
+        amount, read_head = self._read_start(amount)
+        values = array('f', bytes(4 * amount))
+        index = 0
+        for segment, segment_amount in self._read_segments(read_head, amount):
+            for i, raw in enumerate(unpack_bits(segment, segment_amount * n_fields, self.widths)):
+                if i % n_fields == channel_index:
+                    values[index] = nan if raw == codec.missing_raw else raw / codec.scale + codec.offset
+                    index += 1
+        return values
+
+
+    def iter_rows(self, amount=None, chunk_amount: int = 8):
+        # Yield the latest records oldest first as tuples in channel order, missing values are NaN
+        amount, read_head = self._read_start(amount)
+        n_channels = len(self.codecs)
+        n_fields = len(self.widths)
+        nan = float('nan')
+        for segment, segment_amount in self._read_segments(read_head, amount, chunk_amount):
+            raw_values = list(unpack_bits(segment, segment_amount * n_fields, self.widths))
+            for start in range(0, len(raw_values), n_fields):
+                yield tuple(nan if raw == codec.missing_raw else raw / codec.scale + codec.offset
+                            for raw, codec in zip(raw_values[start:start + n_channels], self.codecs))
+
+
+class CyclicMeasurementRecordBuffer(CyclicRecordBuffer):
+    """
+    Record buffer holding all measurements of one wake: growth [%], temperature [°C], height standard deviation [%],
+    surface roughness [mm], battery level [%] and the minutes since the previous record.
+
+    The bit widths are chosen for the sensor resolutions and ranges, a record takes 8 bytes (62 bits) instead of 12 with
+    16 bit channels.
+    """
+    measurement_channels = [
+        ('growth', 20.0, 0.0, 14),  # 0.05 %, up to 819.1 %
+        ('temp', 20.0, -10.0, 12),  # 0.05 °C, -10..194.7 °C
+        ('height_std', 10.0, 0.0, 10),  # 0.1 %, up to 102.2 %
+        ('roughness', 10.0, 0.0, 10),  # 0.1 mm, up to 102.2 mm
+        ('battery', 2.0, 0.0, 8),  # 0.5 %, up to 127 %
+        ('minutes', 1.0, 0.0, 8),  # up to 254 min
+    ]
+
+
+    def __init__(self, addr, max_value_capacity, initialize: bool = False):
+        super().__init__(addr, self.measurement_channels, max_value_capacity, initialize=initialize)
+
+
+class CyclicBucketBuffer(CyclicBuffer):
+    """
+    Cyclic buffer holding consolidated buckets as (min, mean, max) tuples of three 16 bit fixed-point values.
+
+    Buckets are encoded from raw fixed-point integers and decoded to floats with the given scale and offset.
+    """
+    bytes_per_value = 6
+
+
+    def __init__(self, addr, max_value_capacity, value_scale: float, value_offset: float, initialize: bool = False):
+        self.value_scale = value_scale
+        self.value_offset = value_offset
+        super().__init__(addr, capacity=max_value_capacity * self.bytes_per_value, bytes_per_value=self.bytes_per_value,
+                         initialize=initialize)
+
+
+    def encode(self, bucket: tuple) -> bytearray:
+        return bytearray(struct.pack('>3H', *bucket))
+
+
+    def decode(self, byte_array: bytearray) -> tuple:
+        return tuple(raw / self.value_scale + self.value_offset for raw in struct.unpack('>3H', byte_array))
+
+
+class TieredHistory:
+    """
+    Round-robin archive of a signal in multiple resolutions.
+
+    Tier 0 is an arbitrary cyclic buffer holding every sample (e.g. a CyclicDeltaPercentageBuffer). Samples which age
+    out of tier 0 are consolidated into the next tier, a CyclicBucketBuffer of (min, mean, max) buckets of `factor`
+    samples each, similar to rrdtool. Buckets aging out of a tier are consolidated into the next one likewise, so every
+    sample is stored in exactly one tier. The partially filled bucket of every tier is kept in an accumulator (min, max,
+    sum and count of raw values) in front of the buffers, so adding a sample costs O(1) (plus one consolidation of a
+    dropped block of tier 0) and only writes the changed bytes of the accumulators.
+
+    add_value, add_values, read_array, iter_values, window_stats, make_empty and current_size act on tier 0, so the
+    history can replace a plain buffer. query returns a window resampled to a given number of points from all tiers
+    it reaches into.
+
+    If minutes_per_sample is given, the history is timed: the minutes since the previous sample of tier 0 are stored
+    as runs of equal deltas in a CyclicMinutesBuffer of minute_runs runs (minutes_per_sample is used where they are
+    unknown). Minutes elapsed without a sample are collected with add_gap and added to the delta of the next sample.
+
+    If max_bytes is given, tier 0 gets the bytes the tiers and the time deltas leave of it, thus the whole history
+    takes at most max_bytes of the sleep memory.
+    """
+    addr_accumulator_min_size = 2
+    addr_accumulator_max_size = 2
+    addr_accumulator_sum_size = 4
+    addr_accumulator_count_size = 1
+    accumulator_size = 9
+    pending_minutes_size = 2
+
+
+    def __init__(self, addr, base_class, base_kwargs: dict, tiers: list, minutes_per_sample: int = None,
+                 minute_runs: int = 12, max_bytes: int = None, initialize: bool = False):
+        """
+        :param base_class: Cyclic buffer class of tier 0, must provide value_scale and value_offset
+        :param base_kwargs: Constructor arguments of tier 0 (without addr, and without max_bytes if max_bytes is given)
+        :param tiers: List of (bucket capacity, factor) tuples, one per consolidated tier
+        :param minutes_per_sample: Default time delta of a timed history, None for an untimed history
+        :param minute_runs: Capacity of the time deltas of a timed history in runs of equal deltas
+        :param max_bytes: Sleep memory of the whole history, None to size tier 0 by base_kwargs
+        """
+        self.addr = addr
+        self.factors = [factor for _, factor in tiers]
+        self.value_scale = base_class.value_scale
+        self.value_offset = base_class.value_offset
+        buffer_addr = self.addr + len(tiers) * self.accumulator_size
+        if max_bytes is not None:
+            base_kwargs = dict(base_kwargs)
+            base_kwargs['max_bytes'] = max_bytes - self.overhead(tiers, minutes_per_sample is not None, minute_runs) - \
+                CyclicBuffer.header_size
+        self.buffers = [base_class(addr=buffer_addr, initialize=initialize, **base_kwargs)]
+        for capacity, _ in tiers:
+            self.buffers.append(CyclicBucketBuffer(self.buffers[-1].get_last_address(), capacity, self.value_scale,
+                                                   self.value_offset, initialize=initialize))
+        for tier, buffer in enumerate(self.buffers[:-1]):
+            buffer.on_drop = lambda values, tier=tier: self._consolidate_dropped(tier, values)
+        self.minutes_per_sample = minutes_per_sample
+        self.minutes = None
+        self.pending_minutes = None
+        if minutes_per_sample is not None:
+            self.minutes = CyclicMinutesBuffer(self.buffers[-1].get_last_address(), minute_runs, initialize=initialize)
+            self.pending_minutes = SingleIntMemory(self.minutes.get_last_address(), default_value=0, invalid_value=-1,
+                                                   size=self.pending_minutes_size, initialize=initialize)
+        assert max_bytes is None or self.get_last_address() - self.addr <= max_bytes, 'History exceeds max_bytes'
+        self.session = None
+        # All accumulators are read at once and kept, such that only changed bytes are written
+        self._stored_accumulators = bytearray(alarm.sleep_memory[self.addr:self.addr + len(tiers) *
+                                                                 self.accumulator_size])
+        self._accumulators = [list(struct.unpack_from('>HHIB', self._stored_accumulators, tier * self.accumulator_size))
+                              for tier in range(len(tiers))]
+        if initialize or any(count >= factor for (_, _, _, count), factor in zip(self._accumulators, self.factors)):
+            self._clear_accumulators()
+
+
+    @classmethod
+    def overhead(cls, tiers: list, timed: bool, minute_runs: int = 12) -> int:
+        # Bytes of a history besides tier 0: accumulators, bucket tiers and time deltas
+        size = len(tiers) * cls.accumulator_size
+        for capacity, _ in tiers:
+            size += CyclicBuffer.header_size + capacity * CyclicBucketBuffer.bytes_per_value
+        if timed:
+            size += CyclicBuffer.header_size + minute_runs * CyclicMinutesBuffer.bytes_per_value + \
+                cls.pending_minutes_size
+        return size
+
+
+    def _write_accumulators(self):
+        # Within a session the accumulators are written by the session's flush, otherwise right away
+        if self.session is not None:
+            self.session.mark_dirty(self)
+        else:
+            self.flush()
+
+
+    def flush(self) -> int:
+        accumulators = b''.join(struct.pack('>HHIB', *accumulator) for accumulator in self._accumulators)
+        return write_changed(self.addr, accumulators, self._stored_accumulators)
+
+
+    def attach_session(self, session):
+        self.session = session
+        for buffer in self.buffers:
+            buffer.attach_session(session)
+        if self.minutes is not None:
+            self.minutes.attach_session(session)
+            self.pending_minutes.attach_session(session)
+
+
+    def _clear_accumulators(self):
+        for tier in range(len(self._accumulators)):
+            self._accumulators[tier] = [65535, 0, 0, 0]
+        self._write_accumulators()
+
+
+    def _encode_raw(self, val) -> int:
+        return max(0, min(round((val - self.value_offset) * self.value_scale), 65535))
+
+
+    def _consolidate_dropped(self, tier: int, values: list):
+        # Values aging out of the buffer of a tier go into the accumulator of the next coarser one
+        for val in values:
+            if tier == 0:
+                raw = self._encode_raw(val)
+                self._consolidate(tier, raw, raw, raw)
+            else:
+                self._consolidate(tier, *(self._encode_raw(bucket_val) for bucket_val in val))
+
+
+    def _consolidate(self, tier: int, raw_min, raw_mean, raw_max):
+        accumulator = self._accumulators[tier]
+        accumulator[0] = min(accumulator[0], raw_min)
+        accumulator[1] = max(accumulator[1], raw_max)
+        accumulator[2] += raw_mean
+        accumulator[3] += 1
+        if accumulator[3] >= self.factors[tier]:
+            # Bucket complete: move it to the next tier, which may drop its oldest bucket into the tier after
+            self._accumulators[tier] = [65535, 0, 0, 0]
+            self.buffers[tier + 1].add_value((accumulator[0], accumulator[2] // accumulator[3], accumulator[1]))
+
+
+    def add_value(self, val, minutes: int = None):
+        self.buffers[0].add_value(val)
+        if self.minutes is not None:
+            self.minutes.add_value(self._take_pending_minutes(minutes))
+        self._write_accumulators()
+
+
+    def add_values(self, values, minutes: list = None):
+        values = list(values)
+        self.buffers[0].add_values(values)
+        if self.minutes is not None and values:
+            minutes = [self.minutes_per_sample] * len(values) if minutes is None else list(minutes)
+            minutes[0] = self._take_pending_minutes(minutes[0])
+            self.minutes.add_values(minutes)
+        self._write_accumulators()
+
+
+    def add_gap(self, minutes: int):
+        # Time passed without a sample, it's added to the time delta of the next sample
+        if self.pending_minutes is not None:
+            self.pending_minutes.value = min(self.pending_minutes.value + minutes, 65535)
+
+
+    def _take_pending_minutes(self, minutes: int = None) -> int:
+        minutes = self.minutes_per_sample if minutes is None else minutes
+        pending = self.pending_minutes.value
+        if pending:
+            self.pending_minutes.value = 0
+        return minutes + pending
+
+
+    def read_ages(self, amount=None) -> list:
+        """
+        Return the age in minutes of the latest `amount` samples of tier 0, oldest first, the newest sample has age 0.
+        """
+        assert self.minutes is not None, 'History is not timed'
+        amount = self.current_size if amount is None else min(self.current_size, amount)
+        deltas = self.minutes.read_deltas(amount, self.minutes_per_sample)
+        ages = [0] * amount
+        for i in range(amount - 2, -1, -1):
+            ages[i] = ages[i + 1] + deltas[i + 1]
+        return ages
+
+
+    def read_timed_ages(self, max_age: float) -> list:
+        # Ages of all tier 0 samples not older than max_age minutes, oldest first
+        ages = self.read_ages()
+        first = 0
+        while first < len(ages) and ages[first] > max_age:
+            first += 1
+        return ages[first:]
+
+
+    def read_timed(self, max_age: float) -> tuple:
+        # Values and ages of all tier 0 samples not older than max_age minutes
+        ages = self.read_timed_ages(max_age)
+        return self.read_array(amount=len(ages)), ages
+
+
+    def read_array(self, amount=None):
+        return self.buffers[0].read_array(amount)
+
+
+    def iter_values(self, amount=None):
+        return self.buffers[0].iter_values(amount)
+
+
+    def iter_raw(self, amount=None):
+        return self.buffers[0].iter_raw(amount)
+
+
+    def window_stats(self):
+        # Min, max, mean and age of the maximum of tier 0 if it keeps aggregates, otherwise None
+        if not getattr(self.buffers[0], 'aggregates', False):
+            return None
+        return self.buffers[0].window_stats()
+
+
+    def make_empty(self):
+        for buffer in self.buffers:
+            buffer.make_empty()
+        if self.minutes is not None:
+            self.minutes.make_empty()
+            self.pending_minutes.value = 0
+        self._clear_accumulators()
+
+
+    def fill_randomly(self, min_val: float, max_val: float, amount=None, exp_alpha=0.1):
+        CyclicBuffer.fill_randomly(self, min_val, max_val, amount, exp_alpha)
+
+
+    @property
+    def current_size(self):
+        return self.buffers[0].current_size
+
+
+    @property
+    def value_capacity(self):
+        return self.buffers[0].value_capacity
+
+
+    @property
+    def total_size(self):
+        # Number of samples in all tiers
+        size = self.buffers[0].current_size
+        samples_per_bucket = 1
+        for tier, factor in enumerate(self.factors):
+            size += self._accumulators[tier][3] * samples_per_bucket
+            samples_per_bucket *= factor
+            size += self.buffers[tier + 1].current_size * samples_per_bucket
+        return size
+
+
+    def get_last_address(self):
+        if self.pending_minutes is not None:
+            return self.pending_minutes.get_last_address()
+        return self.buffers[-1].get_last_address()
+
+
+    def query(self, window: int, n_points: int) -> list:
+        """
+        Return the mean values of the latest `window` samples resampled to n_points values.
+
+        A window within tier 0 is read from tier 0 alone, a longer one additionally from the buckets and accumulators
+        of the coarser tiers, from the newest tier to the oldest until the window is covered. If the history is shorter
+        than the window, the number of points is reduced proportionally, such that one point always spans
+        window / n_points samples.
+        """
+        if window <= self.buffers[0].current_size or not self.factors:
+            points = list(self.buffers[0].read_array(amount=window))
+            weights = None
+        else:
+            # Mean values and their number of samples, newest first
+            points = list(reversed(self.buffers[0].read_array()))
+            weights = [1] * len(points)
+            covered = len(points)
+            samples_per_bucket = 1
+            for tier, factor in enumerate(self.factors):
+                if covered >= window:
+                    break
+                _, _, raw_sum, count = self._accumulators[tier]
+                if count > 0:
+                    points.append(raw_sum / count / self.value_scale + self.value_offset)
+                    weights.append(count * samples_per_bucket)
+                    covered += count * samples_per_bucket
+                samples_per_bucket *= factor
+                amount = min(self.buffers[tier + 1].current_size, -(-max(0, window - covered) // samples_per_bucket))
+                for _, mean, _ in reversed(self.buffers[tier + 1].read_array(amount=amount)):
+                    points.append(mean)
+                    weights.append(samples_per_bucket)
+                covered += amount * samples_per_bucket
+            points.reverse()
+            weights.reverse()
+        if not points:
+            return points
+        if weights is not None:
+            points = expand(points, weights, window)
+        covered = min(window, len(points))
+        n_points = max(1, round(n_points * covered / window))
+        return resample(points, n_points)
+
+
+def expand(points: list, weights: list, max_samples: int = None) -> list:
+    """
+    Spread points of different weights (samples per point, oldest first) to one value per sample, interpolated
+    linearly between the centers of the points. Only the latest max_samples samples are returned.
+    """
+    centers = []
+    n_samples = 0
+    for weight in weights:
+        centers.append(n_samples + weight / 2)
+        n_samples += weight
+    first = 0 if max_samples is None else max(0, n_samples - max_samples)
+    samples = []
+    index = 0
+    for sample in range(first, n_samples):
+        position = sample + 0.5
+        while index < len(centers) - 1 and centers[index + 1] <= position:
+            index += 1
+        if position <= centers[index] or index == len(centers) - 1:
+            # Before the first or after the last center
+            samples.append(points[index])
+        else:
+            fraction = (position - centers[index]) / (centers[index + 1] - centers[index])
+            samples.append(points[index] * (1 - fraction) + points[index + 1] * fraction)
+    return samples
+
+
+def resample(points: list, n_points: int) -> list:
+    n_source = len(points)
+    if n_source == n_points:
+        return list(points)
+    if n_source > n_points:
+        # Average the source points falling into each target bin
+        resampled = []
+        for i in range(n_points):
+            start = i * n_source // n_points
+            end = (i + 1) * n_source // n_points
+            resampled.append(sum(points[start:end]) / (end - start))
+        return resampled
+    if n_source == 1:
+        return [points[0]] * n_points
+    # Interpolate linearly between the source points
+    resampled = []
+    for i in range(n_points):
+        position = i * (n_source - 1) / (n_points - 1)
+        lower = min(int(position), n_source - 2)
+        fraction = position - lower
+        resampled.append(points[lower] * (1 - fraction) + points[lower + 1] * fraction)
+    return resampled
+
+
 class SingleIntMemory:
+    """
+    Integer of `size` bytes in the sleep memory.
+
+    The value is read once and then served from RAM. A new value is written right away, or by the flush of the
+    SleepMemorySession the memory is attached to. Unchanged values aren't written at all. A value equal to
+    invalid_value reads as None, and setting None stores invalid_value.
+    """
 
-    def __init__(self, addr: int, default_value: int, invalid_value: int = 0, size=2):
+    def __init__(self, addr: int, default_value: int, invalid_value: int = 0, size=2, initialize: bool = False):
         self.addr = addr
         self.invalid_value = invalid_value
         self.size = size
         self.default_value = default_value
+        self.session = None
 
         # First read existing value
-        self._value = int.from_bytes(alarm.sleep_memory[self.addr:self.addr + self.size], 'big')
-        if self._value == self.invalid_value:
+        self._stored = bytearray(alarm.sleep_memory[self.addr:self.addr + self.size])
+        self._value = int.from_bytes(self._stored, 'big')
+        if initialize or self._value == self.invalid_value:
             # Assume value has not been written yet
             self._value = self.default_value
-            self._write(self._value)
+            self.flush()
 
 
-    def _write(self, val: int):
-        alarm.sleep_memory[self.addr:self.addr + self.size] = val.to_bytes(self.size, 'big')
+    def flush(self) -> int:
+        return write_changed(self.addr, self._value.to_bytes(self.size, 'big'), self._stored)
 
 
-    def _read(self):
-        value = int.from_bytes(alarm.sleep_memory[self.addr:self.addr + self.size], 'big')
-        return value if value != self.invalid_value else None
+    def attach_session(self, session):
+        self.session = session
 
 
     @property
     def value(self) -> int:
-        self._value = self._read()
-        return self._value
+        return self._value if self._value != self.invalid_value else None
 
 
     @value.setter
     def value(self, value: int):
+        if value is None:
+            value = self.invalid_value
+        if value == self._value:
+            return
         self._value = value
-        self._write(self._value)
+        if self.session is not None:
+            self.session.mark_dirty(self)
+        else:
+            self.flush()
 
 
     def get_last_address(self):
         return self.addr + self.size
+
+
+class PeakDetectorMemory:
+    """
+    State of an incremental peak detection over a history, identical to utils.algorithm.peak_detect over the raw values
+    of the history (with the threshold in raw units), which stays the reference implementation.
+
+    The state holds the number of processed samples, the moving window sum, the global maximum and the peak candidate.
+    update() processes a newly added sample in O(1): it reads only the last window_size values of the history, which
+    also provide the previous two samples and the one leaving the window. If the history doesn't hold exactly one
+    sample more than processed (values were dropped at the wrap around or it was refilled), the state is rebuilt from
+    the whole history, just like the batch search. reset() must be called when the history is cleared.
+
+    Everything is computed on the integers stored in the history, the comparison of the moving mean is multiplied out
+    by window_size. Only peak_value converts to a float with value_scale and value_offset of the history.
+    """
+    # Count, moving sum, max value, candidate value, max index, candidate index, has candidate (raw values)
+    state_format = '>HiiihhB'
+    state_size = 2 + 3 * 4 + 2 * 2 + 1
+
+
+    def __init__(self, addr: int, threshold: float = 1.0, window_size: int = 7, value_scale: float = 1.0,
+                 value_offset: float = 0.0, initialize: bool = False):
+        """
+        :param threshold: Minimum drop of the newest value below the moving mean, in value units
+        :param value_scale: Scale of the history's fixed-point values, value = raw / value_scale + value_offset
+        """
+        assert window_size >= 3
+        self.addr = addr
+        self.threshold = threshold
+        self.window_size = window_size
+        self.value_scale = value_scale
+        self.value_offset = value_offset
+        # moving mean - current > threshold  <=>  moving sum - window_size * current > threshold_sum
+        self.threshold_sum = threshold * value_scale * window_size
+        if self.threshold_sum == int(self.threshold_sum):
+            self.threshold_sum = int(self.threshold_sum)
+        self.session = None
+
+        self._stored = bytearray(alarm.sleep_memory[self.addr:self.addr + self.state_size])
+        if initialize:
+            self.reset()
+        else:
+            self.count, self.moving_sum, self.max_raw, self.candidate_raw, self.max_ind, self.candidate_ind, \
+                has_candidate = struct.unpack(self.state_format, self._stored)
+            if not has_candidate:
+                self.candidate_ind = None
+                self.candidate_raw = None
+
+
+    def reset(self):
+        # Forget all processed samples, e.g. after the history was cleared
+        self._clear()
+        self._state_changed()
+
+
+    def _clear(self):
+        self.count = 0
+        self.moving_sum = 0
+        self.max_raw = 0
+        self.max_ind = -1
+        self.candidate_ind = None
+        self.candidate_raw = None
+
+
+    def _state_changed(self):
+        if self.session is not None:
+            self.session.mark_dirty(self)
+        else:
+            self.flush()
+
+
+    def flush(self) -> int:
+        has_candidate = self.candidate_ind is not None
+        state = struct.pack(self.state_format, self.count, self.moving_sum, self.max_raw,
+                            self.candidate_raw if has_candidate else 0, self.max_ind,
+                            self.candidate_ind if has_candidate else -1, has_candidate)
+        return write_changed(self.addr, state, self._stored)
+
+
+    def attach_session(self, session):
+        self.session = session
+
+
+    def _step(self, window: list):
+        # One iteration of peak_detect for sample index `count`, window holds the latest up to window_size raw values
+        current_raw = window[-1]
+        if self.count < self.window_size - 1:
+            self.moving_sum += current_raw
+        else:
+            if current_raw > self.max_raw:
+                self.max_raw = current_raw
+                self.max_ind = self.count
+                if self.candidate_ind is not None and self.max_raw > self.candidate_raw:
+                    self.candidate_ind = None
+                    self.candidate_raw = None
+            self.moving_sum += current_raw
+            if current_raw < window[-2] < window[-3]:
+                if self.moving_sum - self.window_size * current_raw > self.threshold_sum:
+                    self.candidate_ind = self.max_ind
+                    self.candidate_raw = self.max_raw
+            self.moving_sum -= window[-self.window_size]
+        self.count += 1
+
+
+    def rebuild(self, history):
+        # Process the whole history from scratch
+        self._clear()
+        window = []
+        for raw in history.iter_raw():
+            window.append(raw)
+            if len(window) > self.window_size:
+                window.pop(0)
+            self._step(window)
+        self._state_changed()
+
+
+    def update(self, history):
+        """
+        Process the sample just added to the history.
+        """
+        if history.current_size != self.count + 1:
+            self.rebuild(history)
+            return
+        self._step(list(history.iter_raw(amount=min(history.current_size, self.window_size))))
+        self._state_changed()
+
+
+    def sync(self, history):
+        """
+        Bring the state up to date without a new sample, e.g. after a wake without measurement.
+        """
+        if history.current_size != self.count:
+            self.rebuild(history)
+
+
+    @property
+    def peak_ind(self):
+        # Index of the peak in the history (0 is the oldest value) like peak_detect returns it, None if there is none
+        return self.candidate_ind
+
+
+    @property
+    def peak_value(self):
+        if self.candidate_raw is None:
+            return None
+        return self.candidate_raw / self.value_scale + self.value_offset
+
+
+    def get_last_address(self):
+        return self.addr + self.state_size
+
+
+class GrowthForecastMemory:
+    """
+    Online forecast of the rise to the peak, with the sufficient statistics of the fit in the sleep memory.
+
+    The rise y (growth above `base`, in units of 100 %) is modelled as logistic curve, dy/dt = k * y * (1 - y / A),
+    which is linear in the unknowns: r = k * y + c * y^2 with the rate r = dy/dt. Every sample updates an exponential
+    moving average of the growth, its rate against the previous sample and the sums of y^2, y^3, y^4, r * y and r * y^2
+    (decayed by `forgetting`, such that the fit follows the current phase of the rise). This is O(1) per sample, the
+    history is never refitted. forecast() solves the fit for the plateau A and the time until peak_fraction of it is
+    reached, see utils.algorithm.logistic_forecast. Samples below min_rise (percentage points) aren't fitted, the
+    relative noise of the rate is too high there.
+
+    reset() must be called when the growth is recalibrated.
+    """
+    # Fitted samples, minutes since the last sample, has average, average growth, 5 sums (y^2, y^3, y^4, r*y, r*y^2)
+    state_format = '>HHBffffff'
+    state_size = 2 + 2 + 1 + 6 * 4
+
+
+    def __init__(self, addr: int, base: float = 100.0, smoothing: float = 0.2, forgetting: float = 0.95,
+                 min_rise: float = 10.0, peak_fraction: float = 0.95, initialize: bool = False):
+        self.addr = addr
+        self.base = base
+        self.smoothing = smoothing
+        self.forgetting = forgetting
+        self.min_rise = min_rise
+        self.peak_fraction = peak_fraction
+        self.session = None
+
+        self._stored = bytearray(alarm.sleep_memory[self.addr:self.addr + self.state_size])
+        if initialize:
+            self.reset()
+        else:
+            state = struct.unpack(self.state_format, self._stored)
+            self.n_fitted, self.pending_minutes, has_average, self.average = state[:4]
+            self.sums = list(state[4:])
+            if not has_average:
+                self.average = None
+
+
+    def reset(self):
+        self.n_fitted = 0
+        self.pending_minutes = 0
+        self.average = None
+        self.sums = [0.0] * 5
+        self._state_changed()
+
+
+    def _state_changed(self):
+        if self.session is not None:
+            self.session.mark_dirty(self)
+        else:
+            self.flush()
+
+
+    def flush(self) -> int:
+        state = struct.pack(self.state_format, self.n_fitted, self.pending_minutes, self.average is not None,
+                            self.average if self.average is not None else 0.0, *self.sums)
+        return write_changed(self.addr, state, self._stored)
+
+
+    def attach_session(self, session):
+        self.session = session
+
+
+    def add_value(self, growth: float, minutes: int):
+        """
+        Add a growth sample (percent) taken `minutes` after the previous one.
+        """
+        minutes += self.pending_minutes
+        self.pending_minutes = 0
+        if self.average is None or minutes <= 0:
+            self.average = growth
+            self._state_changed()
+            return
+        previous = self.average
+        self.average += self.smoothing * (growth - previous)
+        # Rise in the middle of the interval and its rate per hour, both in units of 100 %
+        y = ((previous + self.average) / 2 - self.base) / 100
+        rate = (self.average - previous) / 100 * 60 / minutes
+        if y * 100 > self.min_rise:
+            decay = self.forgetting
+            y_y = y * y
+            for i, term in enumerate((y_y, y_y * y, y_y * y_y, rate * y, rate * y_y)):
+                self.sums[i] = self.sums[i] * decay + term
+            self.n_fitted = min(self.n_fitted + 1, 65535)
+        self._state_changed()
+
+
+    def add_gap(self, minutes: int):
+        # No sample: the next rate spans this time as well
+        self.pending_minutes = min(self.pending_minutes + minutes, 65535)
+        self._state_changed()
+
+
+    def forecast(self, min_fitted: int = 5, max_hours: float = 24.0):
+        """
+        Hours until the peak and the predicted peak growth in percent, or None if there is no forecast (yet) or the
+        peak is further away than max_hours.
+        """
+        if self.n_fitted < min_fitted or self.average is None:
+            return None
+        result = logistic_forecast(*self.sums, y_now=(self.average - self.base) / 100,
+                                   peak_fraction=self.peak_fraction)
+        if result is None:
+            return None
+        hours, plateau = result
+        if hours > max_hours:
+            return None
+        return hours, self.base + 100 * plateau
+
+
+    def get_last_address(self):
+        return self.addr + self.state_size
+
+
+class HampelFilterMemory:
+    """
+    Streaming Hampel filter whose window of the latest measurements is kept in the sleep memory.
+
+    filter() checks a new measurement against the median and the median absolute deviation of the window before it
+    (see utils.algorithm.hampel_check) and replaces an outlier by the median. The measurement itself enters the window
+    either way, so a real change of the level passes the filter as soon as it dominates the window. The window is
+    stored twice as 16 bit fixed-point values: in arrival order (a ring, to know which value leaves the window) and
+    sorted (for the median). Both positions are found by binary search, only the RAM list shifts on an update.
+
+    reset() must be called when the measurement is recalibrated.
+    """
+    state_header_format = '>BB'  # number of values, ring position
+
+
+    def __init__(self, addr: int, window_size: int = 9, n_sigmas: float = 3.0, min_deviation: float = 2.0,
+                 min_values: int = 3, value_scale: float = 10.0, value_offset: float = 0.0, initialize: bool = False):
+        """
+        :param min_deviation: Deviations up to this (in value units) are never rejected
+        :param min_values: Measurements pass unchecked until the window holds this many values
+        """
+        assert 3 <= window_size <= 255
+        self.addr = addr
+        self.window_size = window_size
+        self.n_sigmas = n_sigmas
+        self.min_deviation = min_deviation
+        self.min_values = min_values
+        self.value_scale = value_scale
+        self.value_offset = value_offset
+        self.state_size = 2 + 2 * 2 * window_size
+        self.session = None
+        self.last_was_outlier = False
+
+        self._stored = bytearray(alarm.sleep_memory[self.addr:self.addr + self.state_size])
+        if initialize:
+            self.reset()
+        else:
+            self.count, self.position = struct.unpack_from(self.state_header_format, self._stored)
+            values = struct.unpack_from('>' + str(2 * window_size) + 'H', self._stored, 2)
+            self.ring = list(values[:window_size])
+            self.sorted_window = list(values[window_size:window_size + self.count])
+            if self.count > window_size or self.position >= window_size:
+                self.reset()
+
+
+    def reset(self):
+        self.count = 0
+        self.position = 0
+        self.ring = [0] * self.window_size
+        self.sorted_window = []
+        self._state_changed()
+
+
+    def _state_changed(self):
+        if self.session is not None:
+            self.session.mark_dirty(self)
+        else:
+            self.flush()
+
+
+    def flush(self) -> int:
+        padding = [0] * (self.window_size - self.count)
+        state = struct.pack(self.state_header_format + str(2 * self.window_size) + 'H', self.count, self.position,
+                            *(self.ring + self.sorted_window + padding))
+        return write_changed(self.addr, state, self._stored)
+
+
+    def attach_session(self, session):
+        self.session = session
+
+
+    def filter(self, value: float) -> float:
+        """
+        Return the value to store instead of the measurement: the measurement, or the window's median if it is an
+        outlier.
+        """
+        raw = max(0, min(round((value - self.value_offset) * self.value_scale), 65535))
+        result = value
+        self.last_was_outlier = False
+        if self.count >= self.min_values:
+            is_outlier, median = hampel_check(self.sorted_window, raw, self.n_sigmas,
+                                              self.min_deviation * self.value_scale)
+            if is_outlier:
+                self.last_was_outlier = True
+                result = median / self.value_scale + self.value_offset
+        # Slide the window: the oldest measurement leaves it, the new one enters
+        if self.count == self.window_size:
+            self.sorted_window.pop(sorted_index(self.sorted_window, self.ring[self.position]))
+        else:
+            self.count += 1
+        self.ring[self.position] = raw
+        self.position = (self.position + 1) % self.window_size
+        self.sorted_window.insert(sorted_index(self.sorted_window, raw), raw)
+        self._state_changed()
+        return result
+
+
+    def get_last_address(self):
+        return self.addr + self.state_size
+
+
+class SleepMemorySession:
+    """
+    Write-combining session for the small, frequently changed parts of the sleep memory: SingleIntMemory values, the
+    headers of the cyclic buffers and the accumulators of TieredHistory.
+
+    Attached objects keep these in RAM and only mark themselves dirty on a change. flush() writes the changed bytes of
+    all dirty objects once. The values in the buffers are still written immediately, so until the flush, the stored
+    headers don't match the stored values: a full buffer has its oldest values overwritten while the stored tail still
+    points at them. flush() must therefore be called on every way out of the code which keeps the sleep memory, i.e.
+    before the deep sleep and on the exception paths (also of KeyboardInterrupt and reloads). A reset or a power loss
+    clears the sleep memory along with the mismatch.
+    """
+
+    def __init__(self):
+        self._dirty = []
+
+
+    def mark_dirty(self, obj):
+        for dirty in self._dirty:
+            if dirty is obj:
+                return
+        self._dirty.append(obj)
+
+
+    def flush(self) -> int:
+        # Write all pending changes, returns the number of written bytes
+        written = 0
+        for obj in self._dirty:
+            written += obj.flush()
+        self._dirty = []
+        return written
+
+
+def fletcher16(data) -> int:
+    sum1 = 0
+    sum2 = 0
+    for byte in data:
+        sum1 = (sum1 + byte) % 255
+        sum2 = (sum2 + sum1) % 255
+    return (sum2 << 8) | sum1
+
+
+class SleepMemoryLayout:
+    """
+    Declarative layout of all persistent objects in the sleep memory.
+
+    The regions are placed one after another behind a layout table at address 0. The table holds a magic number, the
+    schema version, the number of regions, a 16 bit signature per region and a Fletcher-16 checksum over all of it.
+    The signature of a region covers its name, class, constructor arguments and address. On every wake, the table is
+    validated once: regions whose signature is unchanged keep their content, all others are initialized freshly. A
+    wrong magic number, version or checksum initializes all regions.
+    """
+    magic = 0x5D0F
+    addr_offset_magic = 0
+    addr_magic_size = 2
+    addr_offset_version = 2
+    addr_offset_count = 3
+    addr_offset_signatures = 4
+    addr_signature_size = 2
+    addr_checksum_size = 2
+
+
+    def __init__(self, version: int, regions: list, session: SleepMemorySession = None):
+        """
+        :param version: Schema version, increase it to force an initialization of all regions
+        :param regions: List of (name, class, constructor keyword arguments) tuples in memory order
+        :param session: Session all regions are attached to after their construction
+        """
+        assert 0 <= version <= 255 and len(regions) <= 255
+        self.version = version
+        self.regions = regions
+        self.session = session
+        self.table_size = self.addr_offset_signatures + len(regions) * self.addr_signature_size + \
+            self.addr_checksum_size
+        self.initialized_regions = []
+        self.end_address = self.table_size
+
+
+    def _table_is_valid(self, table) -> bool:
+        checksum_offset = self.table_size - self.addr_checksum_size
+        return int.from_bytes(table[self.addr_offset_magic:self.addr_offset_magic + self.addr_magic_size],
+                              'big') == self.magic and \
+            table[self.addr_offset_version] == self.version and \
+            table[self.addr_offset_count] == len(self.regions) and \
+            int.from_bytes(table[checksum_offset:], 'big') == fletcher16(table[:checksum_offset])
+
+
+    def load(self) -> dict:
+        """
+        Validate the layout table, construct all regions and store the table again if any region was initialized.
+
+        :return: Dictionary of region name to the constructed memory object
+        """
+        stored_table = alarm.sleep_memory[0:self.table_size]
+        table_valid = self._table_is_valid(stored_table)
+        table = bytearray(self.table_size)
+        table[self.addr_offset_magic:self.addr_offset_magic + self.addr_magic_size] = \
+            self.magic.to_bytes(self.addr_magic_size, 'big')
+        table[self.addr_offset_version] = self.version
+        table[self.addr_offset_count] = len(self.regions)
+
+        objects = {}
+        self.initialized_regions = []
+        addr = self.table_size
+        for i, (name, cls, kwargs) in enumerate(self.regions):
+            description = name + ':' + cls.__name__ + ':' + str(addr) + ':' + \
+                ','.join(key + '=' + str(kwargs[key]) for key in sorted(kwargs))
+            signature = fletcher16(description.encode()).to_bytes(self.addr_signature_size, 'big')
+            signature_offset = self.addr_offset_signatures + i * self.addr_signature_size
+            table[signature_offset:signature_offset + self.addr_signature_size] = signature
+            initialize = not table_valid or \
+                stored_table[signature_offset:signature_offset + self.addr_signature_size] != signature
+            if initialize:
+                self.initialized_regions.append(name)
+            objects[name] = cls(addr=addr, initialize=initialize, **kwargs)
+            if self.session is not None:
+                objects[name].attach_session(self.session)
+            addr = objects[name].get_last_address()
+        self.end_address = addr
+        assert self.end_address <= len(alarm.sleep_memory), 'Layout exceeds the sleep memory'
+
+        if self.initialized_regions:
+            checksum_offset = self.table_size - self.addr_checksum_size
+            table[checksum_offset:] = fletcher16(table[:checksum_offset]).to_bytes(self.addr_checksum_size, 'big')
+            alarm.sleep_memory[0:self.table_size] = table
+        return objects
+
+
+    def free_bytes(self) -> int:
+        return len(alarm.sleep_memory) - self.end_address
@@ -0,0 +1,93 @@
+"""
+Generates CIRCUITPYTHON/imgs/background_archive.bmp, the background of the archive view of code.py (Zoom.archive), from
+background.bmp: the grid stays, the hour labels below the x-axis are redrawn twice as large (32h ... 4h, now) with
+the tick font, as the archive view shows ARCHIVE_ZOOM = 2 times the time of the normal view.
+
+Run from this folder: python make_archive_background.py
+"""
+import os
+import struct
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMGS_DIR = os.path.join(HERE, '..', 'CIRCUITPYTHON', 'imgs')
+FONT_PATH = os.path.join(HERE, '..', 'CIRCUITPYTHON', 'fonts', '00Starmap-11-11.bdf')
+ARCHIVE_ZOOM = 2
+LABEL_ROWS = range(119, 128)  # below the ticks of the x-axis
+LABEL_BASELINE = 126
+LABEL_X_MIN = 33  # y-axis
+MAJOR_TICK_X = [48 + 30 * i for i in range(8)]  # centers of the labels 16h ... 2h
+MAJOR_TICK_HOURS = [16 - 2 * i for i in range(8)]
+
+
+def load_bdf(path: str) -> dict:
+    # Glyphs by character: (device width, bounding box (w, h, x offset, y offset), bitmap rows)
+    glyphs = {}
+    with open(path, encoding='latin-1') as f:
+        lines = f.read().split('\n')
+    i = 0
+    glyph = {}
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith('ENCODING'):
+            glyph = {'char': chr(int(line.split()[1]))}
+        elif line.startswith('DWIDTH'):
+            glyph['dwidth'] = int(line.split()[1])
+        elif line.startswith('BBX'):
+            glyph['bbx'] = [int(v) for v in line.split()[1:]]
+        elif line == 'BITMAP':
+            rows = []
+            i += 1
+            while lines[i] != 'ENDCHAR':
+                rows.append(int(lines[i], 16))
+                i += 1
+            glyphs[glyph['char']] = (glyph['dwidth'], glyph['bbx'], rows)
+        i += 1
+    return glyphs
+
+
+def text_width(glyphs: dict, text: str) -> int:
+    # Width up to the last inked column
+    return sum(glyphs[c][0] for c in text[:-1]) + glyphs[text[-1]][1][0]
+
+
+def draw_text(pixels: list, glyphs: dict, text: str, x: int, baseline: int, color: int):
+    for c in text:
+        dwidth, (w, h, x_off, y_off), rows = glyphs[c]
+        bits = (w + 7) // 8 * 8
+        for row, value in enumerate(rows):
+            y = baseline - y_off - h + 1 + row
+            for col in range(w):
+                if value >> (bits - 1 - col) & 1:
+                    pixels[y][x + x_off + col] = color
+        x += dwidth
+
+
+def main():
+    with open(os.path.join(IMGS_DIR, 'background.bmp'), 'rb') as f:
+        data = bytearray(f.read())
+    offset = struct.unpack_from('<I', data, 10)[0]
+    width, height = struct.unpack_from('<ii', data, 18)
+    assert struct.unpack_from('<H', data, 28)[0] == 8, '8 bit palette image expected'
+    row_size = (width + 3) // 4 * 4
+    # Rows bottom-up in the file
+    pixels = [data[offset + row_size * (height - 1 - y):offset + row_size * (height - 1 - y) + width]
+              for y in range(height)]
+    background = pixels[LABEL_ROWS[-1]][width - 1]
+    label_color = next(value for value in pixels[LABEL_BASELINE][LABEL_X_MIN:] if value != background)
+    # Remove the hour labels, 'now' at the right edge stays
+    for y in LABEL_ROWS:
+        for x in range(LABEL_X_MIN, MAJOR_TICK_X[-1] + 15):
+            pixels[y][x] = background
+    glyphs = load_bdf(FONT_PATH)
+    for x_center, hours in zip(MAJOR_TICK_X, MAJOR_TICK_HOURS):
+        text = f'{hours * ARCHIVE_ZOOM}h'
+        draw_text(pixels, glyphs, text, x_center - text_width(glyphs, text) // 2, LABEL_BASELINE, label_color)
+    for y in range(height):
+        data[offset + row_size * (height - 1 - y):offset + row_size * (height - 1 - y) + width] = pixels[y]
+    with open(os.path.join(IMGS_DIR, 'background_archive.bmp'), 'wb') as f:
+        f.write(data)
+    print(f'Wrote background_archive.bmp, labels {", ".join(f"{h * ARCHIVE_ZOOM}h" for h in MAJOR_TICK_HOURS)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Compares the float and the fixed-point integer path of the numeric hot loops of one wake: decoding the growth history,
+the peak search, the distance statistics of read_distance and the mapping of the history to pixels.
+
+On CircuitPython, the heap allocations of a stage are the drop of gc.mem_free() with the garbage collection disabled
+(there is no reference counting, every temporary object stays on the heap until the next collection), the GC pause is
+the duration of the collection afterwards. Copy this file and the utils folder to the board and run it there, e.g.
+as code.py. Note that it overwrites the sleep memory, the monitor initializes it again on its next start.
+
+On CPython (run from this folder: python allocation_benchmark.py) the sleep memory is faked and only the times are
+meaningful, temporary floats are freed right away there.
+"""
+import sys
+import time
+
+try:
+    import alarm  # CircuitPython
+except ImportError:
+    sys.path.insert(0, '../sleep_memory')
+    import fake_alarm
+import gc
+
+from utils.algorithm import peak_detect, spad_statistics, fixed_point_map, FIXED_POINT_BITS
+from utils.sleep_memory import CyclicDeltaPercentageBuffer, PeakDetectorMemory, SleepMemorySession, TieredHistory
+
+HISTORY_BYTES = 512
+HISTORY_VALUES = 400
+GRAPH_HEIGHT = -100
+THRESHOLD = 1.0
+WINDOW_SIZE = 7
+OVERSAMPLING = 5
+N_SPADS = 9
+REPEATS = 5
+
+
+def measure(stage, *args):
+    # Heap bytes allocated by one run (None on CPython), time of one run and of the following collection in ms
+    gc.collect()
+    has_mem_free = hasattr(gc, 'mem_free')
+    gc.disable()
+    free_before = gc.mem_free() if has_mem_free else 0
+    t_start = time.monotonic_ns()
+    result = stage(*args)
+    t_stage = time.monotonic_ns() - t_start
+    allocated = free_before - gc.mem_free() if has_mem_free else None
+    gc.enable()
+    t_start = time.monotonic_ns()
+    gc.collect()
+    t_gc = time.monotonic_ns() - t_start
+    return result, allocated, t_stage / 1e6, t_gc / 1e6
+
+
+def growth_curve(amount: int) -> list:
+    # Rise and fall of a dough with a little noise, deterministic without the random module
+    values = []
+    noise = 12345
+    for i in range(amount):
+        noise = (noise * 1103515245 + 12345) & 0x7FFFFFFF
+        values.append(100 + 150 * min(i, 300) / 300 - 0.3 * max(0, i - 300) + (noise % 100) / 100)
+    return values
+
+
+def synthetic_distances() -> list:
+    # OVERSAMPLING measurements of N_SPADS distances in mm
+    return [[150 + (3 * spad + 7 * repetition) % 5 for spad in range(N_SPADS)] for repetition in range(OVERSAMPLING)]
+
+
+# --- Float path, as before the fixed-point pipeline ---
+
+def decode_float(history):
+    total = 0.0
+    for val in history.iter_values():
+        total += val
+    return total
+
+
+def peak_float(history):
+    return peak_detect(history.iter_values(), THRESHOLD, WINDOW_SIZE)
+
+
+def statistics_float(measurements):
+    all_distances = [[] for _ in range(N_SPADS)]
+    spad_means = [0] * N_SPADS
+    for distances in measurements:
+        for i_spad, distance in enumerate(distances):
+            all_distances[i_spad].append(distance)
+            spad_means[i_spad] += distance
+    spad_means = [spad_sum / OVERSAMPLING for spad_sum in spad_means]
+    global_distance = sum(spad_means) / len(spad_means)
+    global_roughness = max(spad_means) - min(spad_means)
+    spad_stddevs = []
+    for spad_distances, spad_mean in zip(all_distances, spad_means):
+        spad_stddevs.append((sum([(d - spad_mean) ** 2 for d in spad_distances]) / len(spad_distances)) ** 0.5)
+    return global_distance, sum(spad_stddevs) / len(spad_stddevs), global_roughness
+
+
+def pixels_float(history, data_range):
+    min_val, max_val = data_range
+    factor = GRAPH_HEIGHT / (max_val - min_val)
+    return [round((val - min_val) * factor) for val in history.iter_values()]
+
+
+# --- Fixed-point path ---
+
+def decode_int(history):
+    total = 0
+    for raw in history.iter_raw():
+        total += raw
+    return total
+
+
+def peak_int(history, detector):
+    detector.update(history)
+    return detector.peak_ind
+
+
+def statistics_int(measurements):
+    spad_sums = [0] * N_SPADS
+    spad_square_sums = [0] * N_SPADS
+    for distances in measurements:
+        for i_spad, distance in enumerate(distances):
+            spad_sums[i_spad] += distance
+            spad_square_sums[i_spad] += distance * distance
+    return spad_statistics(spad_sums, spad_square_sums, OVERSAMPLING)
+
+
+def pixels_int(history, data_range):
+    min_val, max_val = data_range
+    factor = GRAPH_HEIGHT / (max_val - min_val)
+    raw_base = round((min_val - history.value_offset) * history.value_scale)
+    raw_factor, raw_offset = fixed_point_map(factor / history.value_scale, 0)
+    return [((raw - raw_base) * raw_factor + raw_offset) >> FIXED_POINT_BITS for raw in history.iter_raw()]
+
+
+def main():
+    if 'fake_alarm' in sys.modules:
+        fake_alarm.reset_sleep_memory()
+    history = TieredHistory(addr=0, base_class=CyclicDeltaPercentageBuffer,
+                            base_kwargs={'max_bytes': HISTORY_BYTES, 'aggregates': True}, tiers=[(64, 8)],
+                            initialize=True)
+    curve = growth_curve(HISTORY_VALUES)
+    history.add_values(curve[:-1])
+    detector_addr = history.get_last_address()
+    PeakDetectorMemory(detector_addr, THRESHOLD, WINDOW_SIZE, value_scale=history.value_scale,
+                       initialize=True).rebuild(history)
+    history.add_value(curve[-1])
+
+    def wake_detector():
+        # Detector state as stored before the newest sample. Its session is never flushed, so every repeat starts
+        # from the same state.
+        detector = PeakDetectorMemory(detector_addr, THRESHOLD, WINDOW_SIZE, value_scale=history.value_scale)
+        detector.attach_session(SleepMemorySession())
+        return detector
+
+    stats = history.window_stats()
+    data_range = stats[:2]
+    measurements = synthetic_distances()
+    print(f'History of {history.current_size} values, {N_SPADS}x{OVERSAMPLING} distances')
+
+    stages = [
+        ('decode history', (decode_float, history), (decode_int, history)),
+        ('peak search', (peak_float, history), (peak_int, history, None)),
+        ('distance statistics', (statistics_float, measurements), (statistics_int, measurements)),
+        ('pixel mapping', (pixels_float, history, data_range), (pixels_int, history, data_range)),
+    ]
+    totals = {'float': [None, 0.0, 0.0], 'int': [None, 0.0, 0.0]}
+    print(f'{"stage":<22}{"path":<7}{"alloc B":>9}{"ms":>9}{"gc ms":>8}')
+    for name, float_stage, int_stage in stages:
+        results = {}
+        for path, stage in (('float', float_stage), ('int', int_stage)):
+            best = None
+            for _ in range(REPEATS):
+                if stage[0] is peak_int:
+                    stage = (peak_int, history, wake_detector())
+                run = measure(*stage)
+                best = run if best is None or run[2] < best[2] else best
+            results[path], allocated, t_stage, t_gc = best
+            if allocated is not None:
+                totals[path][0] = (totals[path][0] or 0) + allocated
+            totals[path][1] += t_stage
+            totals[path][2] += t_gc
+            print(f'{name:<22}{path:<7}{str(allocated if allocated is not None else "n/a"):>9}{t_stage:>9.2f}'
+                  f'{t_gc:>8.2f}')
+        check_equal(name, results['float'], results['int'], history)
+    for path, (allocated, t_stage, t_gc) in totals.items():
+        print(f'{"total":<22}{path:<7}{str(allocated if allocated is not None else "n/a"):>9}'
+              f'{t_stage:>9.2f}{t_gc:>8.2f}')
+
+
+def check_equal(name, float_result, int_result, history):
+    # Both paths must give the same result, up to float rounding (the pixels up to exact halves)
+    if name == 'decode history':
+        ok = abs(float_result - (int_result / history.value_scale + history.value_offset * history.current_size)) < \
+             1e-3 * abs(float_result)
+    elif name == 'pixel mapping':
+        ok = len(float_result) == len(int_result) and max(abs(a - b) for a, b in zip(float_result, int_result)) <= 1
+    elif name == 'distance statistics':
+        ok = all(abs(a - b) < 1e-3 for a, b in zip(float_result, int_result))
+    else:
+        ok = float_result == int_result
+    assert ok, f'{name}: {float_result} != {int_result}'
+
+
+main()
@@ -0,0 +1,124 @@
+"""
+Host-side check and measurement of utils/flash_journal.py on a temporary directory.
+
+Compares the journal (one page write per batch of records) with appending every record to a file on each wake. The
+flash cost is estimated with a simple model of the FAT file system on the internal flash: every write call rewrites
+the 4 kB erase sector of the data and the one of the directory entry (size, time), an append additionally rewrites a
+FAT sector whenever it allocates a new cluster. Wake times on the device are printed by code.py with DEBUG enabled.
+
+Run from this folder: python journal_benchmark.py
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sleep_memory'))
+import fake_alarm  # noqa: E402, registers the fake alarm module and the CIRCUITPYTHON path
+from utils.flash_journal import FlashJournal  # noqa: E402
+
+RECORD_SIZE = 8
+WAKES = 5000
+ERASE_SECTOR = 4096
+CLUSTER = 512
+
+
+def random_record(rnd) -> bytes:
+    return bytes(rnd.randrange(256) for _ in range(RECORD_SIZE))
+
+
+def check_correctness(directory):
+    rnd = random.Random(1)
+    journal = FlashJournal(directory, RECORD_SIZE, n_files=3, pages_per_file=4)
+    written = []
+    for _ in range(100):
+        batch = [random_record(rnd) for _ in range(rnd.randint(1, 70))]
+        journal.append(b''.join(batch))
+        written += batch
+        if rnd.random() < 0.2:
+            # Cold start: the position is recovered by the scan
+            journal = FlashJournal(directory, RECORD_SIZE, n_files=3, pages_per_file=4)
+        max_records = rnd.choice([None, 1, 50, 200])
+        records = FlashJournal(directory, RECORD_SIZE, n_files=3, pages_per_file=4).read_records(max_records)
+        assert records == written[len(written) - len(records):], 'Journal content differs'
+        assert max_records is None or len(records) == min(max_records, len(written)) or len(records) < max_records
+    # A torn page is skipped, the others survive
+    path = os.path.join(directory, 'journal_0.bin')
+    with open(path, 'r+b') as f:
+        f.seek(20)
+        f.write(b'\xff\xff')
+    records = FlashJournal(directory, RECORD_SIZE, n_files=3, pages_per_file=4).read_records()
+    print(f'Correctness: ok, {len(records)} records left after tearing one page')
+
+
+def check_open_page(directory):
+    # The wakes of code.py: a page is appended when full, some wakes (low battery, calibration) write the open page
+    rnd = random.Random(3)
+    journal = FlashJournal(directory, RECORD_SIZE, n_files=3, pages_per_file=4)
+    written = []
+    pending = 0
+    n_journaled = 0
+    for _ in range(1000):
+        written.append(random_record(rnd))
+        pending += 1
+        journal_now = rnd.random() < 0.1
+        if pending >= journal.records_per_page or journal_now:
+            journal.append(b''.join(written[len(written) - pending:]), keep_open=True)
+            pending %= journal.records_per_page
+            n_journaled = len(written)
+        records = FlashJournal(directory, RECORD_SIZE, n_files=3, pages_per_file=4).read_records(100)
+        assert records == written[n_journaled - len(records):n_journaled], 'Journal content differs'
+        if rnd.random() < 0.02:
+            # Cold start: the records since the last write are lost, the open page is closed
+            journal = FlashJournal(directory, RECORD_SIZE, n_files=3, pages_per_file=4)
+            written = written[:n_journaled]
+            pending = 0
+    print('Open page: ok, every record of a journal_now wake is in the journal')
+
+
+def measure_journal(directory, batch: int):
+    journal = FlashJournal(directory, RECORD_SIZE)
+    rnd = random.Random(2)
+    pending = []
+    write_calls = 0
+    start = time.perf_counter()
+    for _ in range(WAKES):
+        pending.append(random_record(rnd))
+        if len(pending) >= batch:
+            write_calls += journal.append(b''.join(pending))
+            pending = []
+    elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    restored = journal.read_records(max_records=384)
+    restore_time = time.perf_counter() - start
+    sectors = write_calls * 2
+    payload = (WAKES - len(pending)) * RECORD_SIZE
+    print(f'journal, {batch:>2} records/page: {write_calls:>4} page writes, {journal.written_bytes / payload:5.2f} '
+          f'bytes/payload byte, ~{sectors * ERASE_SECTOR / payload:6.1f}x flash amplification, '
+          f'{elapsed / WAKES * 1e6:.0f}us/wake, restore of {len(restored)} records {restore_time * 1e3:.1f}ms')
+
+
+def measure_append(directory):
+    path = os.path.join(directory, 'append.bin')
+    rnd = random.Random(2)
+    sectors = 0
+    start = time.perf_counter()
+    for i in range(WAKES):
+        with open(path, 'ab') as f:
+            f.write(random_record(rnd))
+        sectors += 2 + (1 if (i * RECORD_SIZE) % CLUSTER == 0 else 0)
+    elapsed = time.perf_counter() - start
+    payload = WAKES * RECORD_SIZE
+    print(f'append per wake:        {WAKES:>4} writes,       {1.0:5.2f} bytes/payload byte, '
+          f'~{sectors * ERASE_SECTOR / payload:6.1f}x flash amplification, {elapsed / WAKES * 1e6:.0f}us/wake, '
+          f'unbounded file')
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        check_correctness(os.path.join(directory, 'check'))
+        check_open_page(os.path.join(directory, 'open'))
+        for batch in (1, 10, 30):
+            measure_journal(os.path.join(directory, f'journal_{batch}'), batch)
+        measure_append(directory)
@@ -0,0 +1,83 @@
+"""
+Splits recorded growth series into rise cycles (feed, rise, peak, collapse) with the on-device CycleSegmenter and prints
+per-cycle statistics: start and peak growth, rise and time to the peak.
+
+Reads the release test recordings (data_*.csv, one row every --minutes) and InfluxDB CSV exports (the pivoted export
+with a height and a time column, with or without the annotation rows starting with #), each file in one pass.
+
+Run from this folder: python cycle_segmentation.py [--drop 10] [--rise 30] [--minutes 3] [files ...]
+    Without files, all release tests and the exports in experiments/battery are read.
+"""
+import argparse
+import csv
+import glob
+import os
+import sys
+from datetime import datetime
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+sys.path.append(REPO_DIR)
+from CIRCUITPYTHON.utils.algorithm import CycleSegmenter
+
+DEFAULT_FILES = sorted(glob.glob(os.path.join(REPO_DIR, 'release_tests', '*', 'data_*.csv'))) + \
+    sorted(glob.glob(os.path.join(REPO_DIR, 'experiments', 'battery', 'influxdata_*.csv')))
+
+
+def parse_time(text: str) -> float:
+    # InfluxDB timestamps (RFC3339 or as written by pandas) in hours, the nanoseconds are cut to microseconds
+    text = text.replace('T', ' ').replace('Z', '+00:00')
+    if '.' in text:
+        head, tail = text.split('.', 1)
+        digits = len(tail) - len(tail.lstrip('0123456789'))
+        text = f'{head}.{tail[:min(digits, 6)]}{tail[digits:]}'
+    return datetime.fromisoformat(text).timestamp() / 3600
+
+
+def read_series(path: str, minutes: float):
+    # Growth values (None where missing) and their times in hours, None if the file has no growth column
+    with open(path) as f:
+        rows = list(csv.DictReader(line for line in f if not line.startswith('#')))
+    if rows and 'growth' in rows[0]:
+        return [float(row['growth']) if row['growth'] else None for row in rows], \
+            [i * minutes / 60 for i in range(len(rows))]
+    if rows and 'height' in rows[0] and 'time' in rows[0]:
+        # The exports aren't necessarily in time order (one table per series)
+        rows = sorted((parse_time(row['time']), row['height']) for row in rows if row['time'])
+        return [float(height) if height else None for _, height in rows], [time for time, _ in rows]
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Segment recorded growth series into rise cycles.')
+    parser.add_argument('files', nargs='*', default=DEFAULT_FILES, help='CSV files, default: all known recordings')
+    parser.add_argument('--drop', type=float, default=10.0, help='drop below the maximum that confirms a peak [%%]')
+    parser.add_argument('--rise', type=float, default=30.0, help='rise above the minimum that starts a cycle [%%]')
+    parser.add_argument('--minutes', type=float, default=3.0, help='minutes between the rows of the release tests')
+    args = parser.parse_args()
+
+    print(f'{"file":<40}{"cycle":>6}{"start":>8}{"peak":>8}{"rise":>8}{"to peak":>9}')
+    n_cycles = 0
+    rises = []
+    for path in args.files:
+        series = read_series(path, args.minutes)
+        if series is None:
+            continue
+        values, hours = series
+        segmenter = CycleSegmenter(args.drop, args.rise)
+        for val in values:
+            segmenter.add(val)
+        name = os.path.relpath(path, REPO_DIR)
+        if not segmenter.cycles:
+            print(f'{name:<40}{"-":>6}')
+        for i, (start_ind, peak_ind, peak_val) in enumerate(segmenter.cycles):
+            rise = peak_val - values[start_ind]
+            rises.append(rise)
+            print(f'{name:<40}{i + 1:>6}{values[start_ind]:>7.0f}%{peak_val:>7.0f}%{rise:>7.0f}%'
+                  f'{hours[peak_ind] - hours[start_ind]:>8.1f}h')
+        n_cycles += len(segmenter.cycles)
+    if rises:
+        print(f'{n_cycles} cycles, mean rise {sum(rises) / len(rises):.0f}%')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Accuracy of the online rise-to-peak forecast (GrowthForecastMemory) on the release test recordings.
+
+Every recording is replayed wake by wake through the sleep memory like in code.py, rows without growth are gaps. At
+25, 50 and 75 % of the time to the real peak (maximum of the recording) the forecast peak time and percentage are
+compared to the real ones.
+
+Run from this folder: python forecast_accuracy.py [--minutes 3]
+"""
+import argparse
+import csv
+import glob
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sleep_memory'))
+import fake_alarm
+from utils.sleep_memory import GrowthForecastMemory, SleepMemorySession
+
+RELEASE_TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'release_tests')
+CHECKPOINTS = [0.25, 0.5, 0.75]
+
+
+def load_recordings() -> dict:
+    # Growth column with None for missing rows, from the first measurement on (before it, the monitor wasn't
+    # calibrated yet, which resets the forecast). Recordings duplicated in several release folders only once.
+    recordings = {}
+    seen = set()
+    for path in sorted(glob.glob(os.path.join(RELEASE_TESTS_DIR, '*', 'data_*.csv'))):
+        with open(path) as f:
+            rows = csv.DictReader(line for line in f if not line.startswith('#'))
+            growth = [float(row['growth']) if row['growth'] else None for row in rows]
+        while growth and growth[0] is None:
+            growth.pop(0)
+        growth = tuple(growth)
+        if growth and growth not in seen:
+            seen.add(growth)
+            recordings[os.path.relpath(path, RELEASE_TESTS_DIR)] = growth
+    return recordings
+
+
+def replay(growth: tuple, minutes: int) -> list:
+    # Forecast after every row, None where there is none
+    fake_alarm.reset_sleep_memory()
+    GrowthForecastMemory(addr=0, initialize=True)
+    forecasts = []
+    for val in growth:
+        session = SleepMemorySession()
+        forecast_mem = GrowthForecastMemory(addr=0)
+        forecast_mem.attach_session(session)
+        if val is None:
+            forecast_mem.add_gap(minutes)
+        else:
+            forecast_mem.add_value(val, minutes)
+        forecasts.append(forecast_mem.forecast())
+        session.flush()
+    return forecasts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate the rise-to-peak forecast on the release test recordings.')
+    parser.add_argument('--minutes', type=int, default=3, help='minutes between the rows of the recordings')
+    args = parser.parse_args()
+
+    time_errors = {checkpoint: [] for checkpoint in CHECKPOINTS}
+    peak_errors = {checkpoint: [] for checkpoint in CHECKPOINTS}
+    for name, growth in load_recordings().items():
+        peak_val = max(val for val in growth if val is not None)
+        peak_row = growth.index(peak_val)
+        peak_hours = peak_row * args.minutes / 60
+        forecasts = replay(growth, args.minutes)
+        cells = []
+        for checkpoint in CHECKPOINTS:
+            row = int(peak_row * checkpoint)
+            forecast = forecasts[row]
+            if forecast is None:
+                cells.append(f'{"none":>14}')
+                continue
+            time_error = row * args.minutes / 60 + forecast[0] - peak_hours
+            peak_error = forecast[1] - peak_val
+            time_errors[checkpoint].append(abs(time_error))
+            peak_errors[checkpoint].append(abs(peak_error))
+            cells.append(f'{time_error:+6.1f}h {peak_error:+5.0f}%')
+        print(f'{name:<18} peak {peak_hours:4.1f}h {peak_val:4.0f}%  ' + '  '.join(cells))
+
+    cells = []
+    for checkpoint in CHECKPOINTS:
+        n = max(1, len(time_errors[checkpoint]))
+        cells.append(f'{sum(time_errors[checkpoint]) / n:6.1f}h {sum(peak_errors[checkpoint]) / n:5.0f}%')
+    print(f'{"mean abs error":<34}' + '  '.join(cells) + '   (at ' + ', '.join(f'{c:.0%}' for c in CHECKPOINTS) +
+          ' of the time to the peak)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+Parameter sweep of the peak detection over the recorded growth curves of the release tests.
+
+Every threshold x window size combination is evaluated like on the device, where the detection runs after each new
+sample: a curve is detected if a prefix of it reports an index within TOLERANCE samples of its true peak, the delay is
+the number of samples from the true peak until then. Every other reported index is a false positive. The true peak is
+the maximum of the moving average (width 5) of the whole curve, if the curve drops by at least PEAK_DROP percentage
+points afterwards, otherwise the curve has no peak (e.g. a recording stopped while still rising).
+
+peak_detect is reimplemented with NumPy over all prefixes and thresholds at once: the moving sum is a cumulative sum,
+the global maximum a running maximum, and the candidate after sample t is the global maximum at the last trigger
+before t unless the maximum has grown since. The reimplementation is checked against utils/algorithm.py on random
+samples before the sweep. The window sizes are distributed over a process pool.
+
+With --hampel, the curves first pass the device's streaming outlier filter (HampelFilterMemory on a fake sleep memory)
+like before they enter the growth history. With --savgol, the detection runs on the output of the device's
+Savitzky-Golay smoothing (utils/savgol_taps.py), its first samples stay unsmoothed. The smoothed value of a sample is
+only known SAVGOL_LAG samples later, which is added to the delays. The true peaks are always determined on the
+unfiltered curves.
+
+Run from this folder: python parameter_sweep.py [--thresholds 0.1 20 0.1] [--windows 3 40] [--output results.csv]
+    [--hampel] [--savgol]
+"""
+import argparse
+import csv
+import glob
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+sys.path.append(REPO_DIR)
+from CIRCUITPYTHON.utils.algorithm import peak_detect
+
+RELEASE_TESTS_DIR = os.path.join(REPO_DIR, 'release_tests')
+NO_RESULT = -2  # peak_detect returned None
+TOLERANCE = 3  # samples
+PEAK_DROP = 10.0  # percentage points
+SMOOTHING = 5
+VERIFY_SAMPLES = 2000
+TIE_EPSILON = 1e-9
+
+
+def load_curves() -> dict:
+    # Growth column of every recording without the missing values (they aren't added on the device), duplicates of the
+    # same recording in several release folders only once
+    curves = {}
+    seen = set()
+    for path in sorted(glob.glob(os.path.join(RELEASE_TESTS_DIR, '*', 'data_*.csv'))):
+        with open(path) as f:
+            rows = csv.DictReader(line for line in f if not line.startswith('#'))
+            growth = tuple(float(row['growth']) for row in rows if row['growth'])
+        if growth and growth not in seen:
+            seen.add(growth)
+            curves[os.path.relpath(path, RELEASE_TESTS_DIR)] = np.array(growth)
+    return curves
+
+
+def hampel_filtered(x: np.ndarray) -> np.ndarray:
+    sys.path.insert(0, os.path.join(REPO_DIR, 'experiments', 'sleep_memory'))
+    import fake_alarm
+    from utils.sleep_memory import HampelFilterMemory
+
+    fake_alarm.reset_sleep_memory()
+    hampel_filter = HampelFilterMemory(addr=0, initialize=True)
+    return np.array([hampel_filter.filter(float(val)) for val in x])
+
+
+def savgol_smoothed(x: np.ndarray) -> np.ndarray:
+    from CIRCUITPYTHON.utils.savgol_taps import SAVGOL_WINDOW, SAVGOL_LAG, SMOOTH_TAPS, SMOOTH_DENOMINATOR
+
+    # The smoothed value after sample t belongs to sample t - SAVGOL_LAG, shift it back so the indices match
+    smoothed = x.copy()
+    if len(x) >= SAVGOL_WINDOW:
+        filtered = np.convolve(x, np.array(SMOOTH_TAPS[::-1]) / SMOOTH_DENOMINATOR, mode='valid')
+        smoothed[SAVGOL_WINDOW - 1 - SAVGOL_LAG:len(x) - SAVGOL_LAG] = filtered
+    return smoothed
+
+
+def true_peak(x: np.ndarray):
+    if len(x) < SMOOTHING:
+        return None
+    smoothed = np.convolve(x, np.ones(SMOOTHING) / SMOOTHING, mode='same')
+    # Don't let the zero padding at the edges create or hide a peak
+    smoothed[:SMOOTHING // 2] = x[:SMOOTHING // 2]
+    smoothed[-(SMOOTHING // 2):] = x[-(SMOOTHING // 2):]
+    peak = int(np.argmax(smoothed))
+    if smoothed[peak] - smoothed[peak:].min() < PEAK_DROP:
+        return None
+    return peak
+
+
+def detect_all_prefixes(x: np.ndarray, thresholds: np.ndarray, window_size: int) -> tuple:
+    """
+    Result of peak_detect(x[:t + 1], threshold, window_size) for all t and thresholds.
+
+    :return: Index array of shape (len(thresholds), len(x)), NO_RESULT where peak_detect returns None, and the margin
+        moving mean - value of the triggers (shape (len(x),)) to recognize ties in the verification
+    """
+    n = len(x)
+    results = np.full((len(thresholds), n), NO_RESULT, dtype=np.int32)
+    if n < window_size:
+        return results, np.zeros(n)
+    first = window_size - 1
+    t = np.arange(first, n)
+    xv = x[first:]
+    csum = np.concatenate(([0.0], np.cumsum(x)))
+    margin = (csum[first + 1:] - csum[:n - first]) / window_size - xv
+    decreasing = (xv < x[first - 1:n - 1]) & (x[first - 1:n - 1] < x[first - 2:n - 2])
+    # Running global maximum (starting at 0) and the index where it was reached first, -1 if never above 0
+    global_max = np.maximum.accumulate(np.maximum(xv, 0.0))
+    previous_max = np.concatenate(([0.0], global_max[:-1]))
+    global_ind = np.maximum.accumulate(np.where(xv > previous_max, t, -1))
+    # Last trigger per threshold; its candidate survives as long as the global maximum hasn't grown
+    triggers = decreasing & (margin > thresholds[:, None])
+    last_trigger = np.maximum.accumulate(np.where(triggers, np.arange(len(t)), -1), axis=1)
+    has_trigger = last_trigger >= 0
+    trigger_pos = np.maximum(last_trigger, 0)
+    valid = has_trigger & (global_max[trigger_pos] == global_max[None, :])
+    results[:, first:] = np.where(valid, global_ind[trigger_pos], NO_RESULT)
+    full_margin = np.zeros(n)
+    full_margin[first:] = np.where(decreasing, margin, np.inf)
+    return results, full_margin
+
+
+def evaluate(x: np.ndarray, peak, thresholds: np.ndarray, window_size: int) -> tuple:
+    # Per threshold: detected (bool), delay in samples (-1 if not detected), number of false positive indices
+    results, _ = detect_all_prefixes(x, thresholds, window_size)
+    reported = results != NO_RESULT
+    if peak is None:
+        near = np.zeros_like(reported)
+    else:
+        near = reported & (np.abs(results - peak) <= TOLERANCE)
+    detected = near.any(axis=1)
+    delay = np.where(detected, np.argmax(near, axis=1) - (peak if peak is not None else 0), -1)
+    # Count distinct false indices, a candidate which stays reported over many samples counts once
+    false_positive = reported & ~near
+    changed = np.concatenate((np.ones((len(thresholds), 1), dtype=bool), results[:, 1:] != results[:, :-1]), axis=1)
+    false_positives = (false_positive & changed).sum(axis=1)
+    return detected, delay, false_positives
+
+
+def sweep_window(args: tuple) -> list:
+    curves, peaks, thresholds, window_size, extra_delay = args
+    n_peaks = sum(peak is not None for peak in peaks)
+    detected_sum = np.zeros(len(thresholds), dtype=np.int32)
+    delay_sum = np.zeros(len(thresholds))
+    false_sum = np.zeros(len(thresholds), dtype=np.int32)
+    false_curves = np.zeros(len(thresholds), dtype=np.int32)
+    for x, peak in zip(curves, peaks):
+        detected, delay, false_positives = evaluate(x, peak, thresholds, window_size)
+        detected_sum += detected
+        delay_sum += np.where(detected, delay, 0)
+        false_sum += false_positives
+        false_curves += false_positives > 0
+    rows = []
+    for i, threshold in enumerate(thresholds):
+        n_detected = int(detected_sum[i])
+        rows.append({
+            'threshold': round(float(threshold), 4),
+            'window_size': window_size,
+            'detection_rate': round(n_detected / n_peaks, 3) if n_peaks else float('nan'),
+            'false_positives': int(false_sum[i]),
+            'curves_with_false_positives': int(false_curves[i]),
+            'mean_delay_samples': round(float(delay_sum[i]) / n_detected + extra_delay, 2) if n_detected else
+            float('nan'),
+        })
+    return rows
+
+
+def verify(curves: list, thresholds: np.ndarray, windows: list, samples: int) -> int:
+    # Compare random (curve, threshold, window, prefix) results with the reference implementation. Prefixes where a
+    # decrease margin equals the threshold within float precision are skipped, the summation orders differ there.
+    random.seed(0)
+    n_ties = 0
+    for _ in range(samples):
+        x = random.choice(curves)
+        window_size = random.choice(windows)
+        threshold = random.choice(thresholds)
+        results, margin = detect_all_prefixes(x, np.array([threshold]), window_size)
+        t = random.randrange(len(x))
+        if np.any(np.abs(margin[:t + 1] - threshold) < TIE_EPSILON):
+            n_ties += 1
+            continue
+        expected = peak_detect(list(x[:t + 1]), float(threshold), window_size)
+        actual = int(results[0, t])
+        assert actual == (NO_RESULT if expected is None else expected), \
+            f'Mismatch at threshold {threshold}, window {window_size}, prefix {t + 1}: {actual} != {expected}'
+    return n_ties
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep the peak detection parameters over the release test curves.')
+    parser.add_argument('--thresholds', type=float, nargs=3, default=[0.1, 20.0, 0.1],
+                        metavar=('START', 'STOP', 'STEP'), help='threshold range, STOP included')
+    parser.add_argument('--windows', type=int, nargs=2, default=[3, 40], metavar=('MIN', 'MAX'),
+                        help='window size range, MAX included')
+    parser.add_argument('--workers', type=int, default=None, help='processes, default: number of CPUs')
+    parser.add_argument('--top', type=int, default=15, help='number of best combinations to print')
+    parser.add_argument('--output', help='write all results to this CSV file')
+    parser.add_argument('--hampel', action='store_true', help='filter the curves with the on-device Hampel filter')
+    parser.add_argument('--savgol', action='store_true', help='smooth the curves with the on-device SG taps')
+    args = parser.parse_args()
+
+    start, stop, step = args.thresholds
+    thresholds = np.round(np.arange(start, stop + step / 2, step), 6)
+    windows = list(range(max(3, args.windows[0]), args.windows[1] + 1))
+    named_curves = load_curves()
+    curves = list(named_curves.values())
+    peaks = [true_peak(x) for x in curves]
+    for (name, x), peak in zip(named_curves.items(), peaks):
+        print(f'{name}: {len(x)} samples, true peak ' + (f'at {peak}' if peak is not None else 'none'))
+    if args.hampel:
+        curves = [hampel_filtered(x) for x in curves]
+        n_replaced = sum(int(np.sum(filtered != x)) for filtered, x in zip(curves, named_curves.values()))
+        print(f'Hampel filter replaced {n_replaced} of {sum(len(x) for x in curves)} samples')
+    extra_delay = 0
+    if args.savgol:
+        from CIRCUITPYTHON.utils.savgol_taps import SAVGOL_LAG
+        curves = [savgol_smoothed(x) for x in curves]
+        extra_delay = SAVGOL_LAG
+
+    t_start = time.perf_counter()
+    n_ties = verify(curves, thresholds, windows, VERIFY_SAMPLES)
+    print(f'Verified {VERIFY_SAMPLES - n_ties} random prefixes against utils/algorithm.py ({n_ties} ties skipped) '
+          f'in {time.perf_counter() - t_start:.1f}s')
+
+    t_start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for rows in pool.map(sweep_window, [(curves, peaks, thresholds, window_size, extra_delay)
+                                             for window_size in windows]):
+            results += rows
+    print(f'Evaluated {len(results)} combinations on {len(curves)} curves in {time.perf_counter() - t_start:.1f}s')
+
+    # Best: most detections, fewest false positives, shortest delay
+    results.sort(key=lambda row: (-np.nan_to_num(row['detection_rate']), row['false_positives'],
+                                  np.nan_to_num(row['mean_delay_samples'], nan=np.inf)))
+    print(f'{"threshold":>10}{"window":>8}{"detected":>10}{"false pos":>11}{"curves w/ fp":>14}{"delay":>8}')
+    for row in results[:args.top]:
+        print(f'{row["threshold"]:>10}{row["window_size"]:>8}{row["detection_rate"]:>10.0%}'
+              f'{row["false_positives"]:>11}{row["curves_with_false_positives"]:>14}{row["mean_delay_samples"]:>8}')
+    current = next((row for row in results if row['threshold'] == 1.0 and row['window_size'] == 7), None)
+    if current is not None:
+        print(f'Current parameters (1.0, 7): rank {results.index(current) + 1}, {current}')
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+
+
+if __name__ == '__main__':
+    main()
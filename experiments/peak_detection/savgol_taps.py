@@ -0,0 +1,89 @@
+"""
+Generates the integer Savitzky-Golay taps of the smoothing and slope stage (CIRCUITPYTHON/utils/savgol_taps.py).
+
+The filter fits a polynomial of degree ORDER to the latest WINDOW samples by least squares and evaluates it (value and
+first derivative) LAG samples before the newest one. It runs causally on the growth history: LAG 0 has no delay but
+the most noise, LAG (WINDOW - 1) / 2 is the classic centered filter. The coefficients are
+rational numbers. They are computed exactly with fractions and brought to a common denominator, which gives integer
+taps: on the device, smoothed = sum(tap * raw) / denominator without any rounding of the taps.
+
+Run from this folder: python savgol_taps.py [--window 9] [--order 2] [--lag 2]
+    [--output ../../CIRCUITPYTHON/utils/savgol_taps.py]
+"""
+import argparse
+from fractions import Fraction
+from math import lcm
+
+DEFAULT_OUTPUT = '../../CIRCUITPYTHON/utils/savgol_taps.py'
+
+
+def solve_exact(matrix: list, rhs: list) -> list:
+    # Gauss-Jordan elimination on fractions, matrix is square and regular
+    n = len(matrix)
+    rows = [list(matrix[i]) + [rhs[i]] for i in range(n)]
+    for col in range(n):
+        pivot = next(i for i in range(col, n) if rows[i][col] != 0)
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        pivot_val = rows[col][col]
+        rows[col] = [val / pivot_val for val in rows[col]]
+        for i in range(n):
+            if i != col and rows[i][col] != 0:
+                factor = rows[i][col]
+                rows[i] = [a - factor * b for a, b in zip(rows[i], rows[col])]
+    return [rows[i][n] for i in range(n)]
+
+
+def savgol_coefficients(window: int, order: int, derivative: int, lag: int = 0) -> list:
+    # Coefficients (oldest sample first) of the derivative-th polynomial coefficient of the least squares fit over the
+    # positions x = -(window - 1 - lag) .. lag, i.e. of the value (0) and the slope per sample (1) at x = 0, lag samples
+    # before the newest one
+    positions = [Fraction(x) for x in range(-(window - 1 - lag), lag + 1)]
+    # Normal equations (A^T A) p = A^T y; the coefficients of y are the row `derivative` of (A^T A)^-1 A^T
+    normal = [[sum(x ** (i + j) for x in positions) for j in range(order + 1)] for i in range(order + 1)]
+    unit = [Fraction(int(i == derivative)) for i in range(order + 1)]
+    row = solve_exact(normal, unit)  # (A^T A) is symmetric, so this is the row of its inverse
+    return [sum(row[j] * x ** j for j in range(order + 1)) for x in positions]
+
+
+def integer_taps(coefficients: list) -> tuple:
+    denominator = lcm(*(c.denominator for c in coefficients))
+    return [int(c * denominator) for c in coefficients], denominator
+
+
+def module_source(window: int, order: int, lag: int) -> str:
+    smooth_taps, smooth_denominator = integer_taps(savgol_coefficients(window, order, 0, lag))
+    slope_taps, slope_denominator = integer_taps(savgol_coefficients(window, order, 1, lag))
+    options = f'--window {window} --order {order} --lag {lag}'
+    return f'''# Generated by experiments/peak_detection/savgol_taps.py {options}, don't edit.
+# Savitzky-Golay taps (oldest sample first) for the value and the slope per sample SAVGOL_LAG samples before the newest
+# of SAVGOL_WINDOW samples, see utils.algorithm.apply_taps.
+SAVGOL_WINDOW = {window}
+SAVGOL_ORDER = {order}
+SAVGOL_LAG = {lag}
+SMOOTH_TAPS = {tuple(smooth_taps)}
+SMOOTH_DENOMINATOR = {smooth_denominator}
+SLOPE_TAPS = {tuple(slope_taps)}
+SLOPE_DENOMINATOR = {slope_denominator}
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the integer Savitzky-Golay taps for the device.')
+    parser.add_argument('--window', type=int, default=9, help='number of samples')
+    parser.add_argument('--order', type=int, default=2, help='polynomial degree')
+    parser.add_argument('--lag', type=int, default=2, help='samples between the newest one and the evaluated position')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='module to write ("-" for stdout)')
+    args = parser.parse_args()
+    assert args.window > args.order >= 1 and 0 <= args.lag < args.window
+
+    source = module_source(args.window, args.order, args.lag)
+    if args.output == '-':
+        print(source, end='')
+    else:
+        with open(args.output, 'w') as f:
+            f.write(source)
+        print(f'Wrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+"""
+Host-side benchmark of the sleep memory buffers in CIRCUITPYTHON/utils/sleep_memory.py.
+
+Runs on CPython with the bytearray-backed alarm module of fake_alarm.py. Run from the sleep_memory folder:
+
+    python -m benchmark [--quick] [--output results.json] [--baseline previous.json]
+
+Absolute timings of the host say little about the ESP32-S2, but ratios between runs and the counted sleep memory
+accesses do: every slice read is an allocation on the device.
+"""
@@ -0,0 +1,104 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import fake_alarm
+from benchmark.cases import CAPACITIES, QUICK_CAPACITIES, SLEEP_MEMORY_SIZE, all_cases
+from benchmark.counting_memory import CountingSleepMemory
+
+# A result counts as regression if it takes this much longer than in the baseline
+REGRESSION_FACTOR = 1.2
+
+
+def time_case(case, repeats: int) -> float:
+    # Best of `repeats` runs on a plain bytearray, in microseconds per operation
+    fake_alarm.install_sleep_memory(bytearray(SLEEP_MEMORY_SIZE))
+    best = None
+    for _ in range(repeats):
+        obj = case.prepare()
+        start = time.perf_counter()
+        case.run(obj)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / case.ops * 1e6
+
+
+def count_case(case) -> dict:
+    # One run on a counting sleep memory, counters are per operation. The allocation peak covers the whole run.
+    memory = fake_alarm.install_sleep_memory(CountingSleepMemory(SLEEP_MEMORY_SIZE))
+    obj = case.prepare()
+    memory.reset_counters()
+    tracemalloc.start()
+    case.run(obj)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    counts = {key: round(val / case.ops, 2) for key, val in memory.counters().items()}
+    counts['peak_alloc_bytes'] = peak
+    counts['values'] = getattr(obj, 'current_size', None)
+    return counts
+
+
+def result_key(result: dict) -> tuple:
+    return result['buffer'], result['capacity'], result['op']
+
+
+def print_table(results: list, baseline: dict):
+    print(f'{"buffer":<18}{"capacity":>9} {"op":<20}{"values":>7}{"us/op":>11}{"slices/op":>11}{"alloc B":>9}'
+          + ('   vs baseline' if baseline else ''))
+    for result in results:
+        slices = result['slice_reads'] + result['slice_writes']
+        line = f'{result["buffer"]:<18}{str(result["capacity"] or ""):>9} {result["op"]:<20}' \
+               f'{str(result["values"] if result["values"] is not None else ""):>7}{result["us_per_op"]:>11.2f}' \
+               f'{slices:>11.2f}{result["peak_alloc_bytes"]:>9}'
+        previous = baseline.get(result_key(result))
+        if previous is not None:
+            ratio = result['us_per_op'] / previous['us_per_op']
+            line += f'   {ratio:.2f}x' + ('  SLOWER' if ratio > REGRESSION_FACTOR else '')
+            if slices > previous['slice_reads'] + previous['slice_writes']:
+                line += '  MORE SLICES'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the sleep memory buffers on CPython.')
+    parser.add_argument('--quick', action='store_true', help=f'only capacities {QUICK_CAPACITIES} and fewer repeats')
+    parser.add_argument('--repeats', type=int, default=None, help='timed runs per case, the best one counts')
+    parser.add_argument('--output', help='write the results as JSON to this file ("-" for stdout)')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare against')
+    args = parser.parse_args()
+
+    capacities = QUICK_CAPACITIES if args.quick else CAPACITIES
+    repeats = args.repeats or (2 if args.quick else 5)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {result_key(result): result for result in json.load(f)['results']}
+
+    results = []
+    for case in all_cases(capacities):
+        result = {'buffer': case.buffer, 'capacity': case.capacity, 'op': case.op, 'ops': case.ops,
+                  'us_per_op': round(time_case(case, repeats), 3)}
+        result.update(count_case(case))
+        results.append(result)
+
+    report = {
+        'meta': {'python': sys.version.split()[0], 'implementation': platform.python_implementation(),
+                 'machine': platform.machine(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeats': repeats,
+                 'sleep_memory_size': SLEEP_MEMORY_SIZE},
+        'results': results,
+    }
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    else:
+        print_table(results, baseline)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import random
+
+import fake_alarm
+from packed_buffer import CyclicPackedBuffer
+from utils.sleep_memory import Cyclic16BitPercentageBuffer, CyclicDeltaPercentageBuffer, SingleIntMemory
+
+CAPACITIES = [64, 256, 1024, 4096, 8192]
+QUICK_CAPACITIES = [64, 256, 1024]
+# Values added one by one per timed run, the rest of a fill is done in a batch during the preparation
+SINGLE_ADDS = 256
+PARTIAL_READ = 64
+SINGLE_INT_OPS = 1000
+
+# The largest 16 bit buffer doesn't fit into the real 8 kB, the benchmark uses a larger fake sleep memory
+SLEEP_MEMORY_SIZE = 2 * max(CAPACITIES) + 64
+
+# Buffer kinds by name, created from a capacity in values. The delta and the 12 bit buffer get the same byte budget as
+# the 16 bit buffer, thus they hold more values; the actual number is reported per result.
+BUFFER_KINDS = {
+    '16bit': lambda capacity: Cyclic16BitPercentageBuffer(addr=0, max_value_capacity=capacity, initialize=True),
+    'delta': lambda capacity: CyclicDeltaPercentageBuffer(addr=0, max_bytes=2 * capacity, aggregates=True,
+                                                          initialize=True),
+    'packed12': lambda capacity: CyclicPackedBuffer(addr=0, codec='percentage12', max_value_capacity=capacity * 4 // 3,
+                                                    initialize=True),
+}
+
+
+def growth_signal(amount: int, seed: int = 1) -> list:
+    # Slowly changing random walk like the growth of a dough, with a few jumps which need an escape in delta buffers
+    random.seed(seed)
+    values = []
+    val = 100.0
+    for _ in range(amount):
+        val += random.gauss(0.1, 0.3) if random.random() > 0.02 else random.gauss(0, 20)
+        val = max(0.0, min(val, 600.0))
+        values.append(val)
+    return values
+
+
+class Case:
+    """
+    One benchmarked operation: prepare() builds the state (not timed) and returns the object to work on, run(obj)
+    executes `ops` operations which are timed and counted.
+    """
+
+    def __init__(self, buffer: str, capacity: int, op: str, prepare, run, ops: int = 1):
+        self.buffer = buffer
+        self.capacity = capacity
+        self.op = op
+        self.prepare = prepare
+        self.run = run
+        self.ops = ops
+
+
+def buffer_cases(kind: str, capacity: int, signal: list) -> list:
+    create = BUFFER_KINDS[kind]
+
+    def empty():
+        fake_alarm.reset_sleep_memory()
+        return create(capacity)
+
+    def full():
+        buffer = empty()
+        buffer.add_values(signal[:buffer.max_value_count])
+        return buffer
+
+    def wrapped():
+        # Full ring whose oldest value is not at the start of the memory, reads need two segments
+        buffer = full()
+        buffer.add_values(signal[buffer.max_value_count:buffer.max_value_count + capacity // 3])
+        return buffer
+
+    single_adds = min(SINGLE_ADDS, capacity)
+
+    def add_single(buffer):
+        for val in signal[:single_adds]:
+            buffer.add_value(val)
+
+    return [
+        Case(kind, capacity, 'add_value', empty, add_single, ops=single_adds),
+        Case(kind, capacity, 'add_value_wrapped', full, add_single, ops=single_adds),
+        Case(kind, capacity, 'add_values', empty, lambda buffer: buffer.add_values(signal[:capacity]), ops=capacity),
+        Case(kind, capacity, 'read_array', full, lambda buffer: buffer.read_array()),
+        Case(kind, capacity, 'read_array_wrapped', wrapped, lambda buffer: buffer.read_array()),
+        Case(kind, capacity, f'read_array_{PARTIAL_READ}', wrapped, lambda buffer: buffer.read_array(PARTIAL_READ)),
+        Case(kind, capacity, 'iter_values', wrapped, lambda buffer: sum(buffer.iter_values())),
+        Case(kind, capacity, 'make_empty', full, lambda buffer: buffer.make_empty()),
+    ]
+
+
+def single_int_cases() -> list:
+    cases = []
+    for size in (1, 2):
+        def prepare(size=size):
+            fake_alarm.reset_sleep_memory()
+            return SingleIntMemory(addr=0, default_value=0, invalid_value=-1, size=size, initialize=True)
+
+        def read(memory):
+            for _ in range(SINGLE_INT_OPS):
+                memory.value
+
+        def write(memory):
+            for i in range(SINGLE_INT_OPS):
+                memory.value = i & 0x7F
+
+        cases.append(Case(f'SingleIntMemory{size}', None, 'read', prepare, read, ops=SINGLE_INT_OPS))
+        cases.append(Case(f'SingleIntMemory{size}', None, 'write', prepare, write, ops=SINGLE_INT_OPS))
+    return cases
+
+
+def all_cases(capacities: list) -> list:
+    signal = growth_signal(3 * max(capacities) + 256)
+    cases = []
+    for kind in BUFFER_KINDS:
+        for capacity in capacities:
+            cases += buffer_cases(kind, capacity, signal)
+    return cases + single_int_cases()
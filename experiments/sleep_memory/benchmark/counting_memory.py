@@ -0,0 +1,42 @@
+class CountingSleepMemory(bytearray):
+    """
+    Stand-in for alarm.sleep_memory which counts the accesses: single byte and slice reads and writes and the number of
+    bytes moved by slices. Only used for the counting pass, the timing pass runs on a plain bytearray.
+    """
+
+    def __init__(self, size: int):
+        super().__init__(size)
+        self.reset_counters()
+
+
+    def reset_counters(self):
+        self.item_reads = 0
+        self.item_writes = 0
+        self.slice_reads = 0
+        self.slice_writes = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+
+    def counters(self) -> dict:
+        return {'item_reads': self.item_reads, 'item_writes': self.item_writes, 'slice_reads': self.slice_reads,
+                'slice_writes': self.slice_writes, 'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written}
+
+
+    def __getitem__(self, key):
+        result = super().__getitem__(key)
+        if isinstance(key, slice):
+            self.slice_reads += 1
+            self.bytes_read += len(result)
+        else:
+            self.item_reads += 1
+        return result
+
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            self.slice_writes += 1
+            self.bytes_written += len(value)
+        else:
+            self.item_writes += 1
+        super().__setitem__(key, value)
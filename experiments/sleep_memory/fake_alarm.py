@@ -0,0 +1,31 @@
+"""
+Host-side stand-in for CircuitPython's `alarm` module.
+
+Importing this module registers a fake `alarm` in `sys.modules` whose `sleep_memory` is a plain bytearray of the
+ESP32-S2's size and puts the CIRCUITPYTHON folder on the path, such that `utils.sleep_memory` can be imported on
+CPython.
+"""
+import os
+import sys
+import types
+
+SLEEP_MEMORY_SIZE = 8192
+
+CIRCUITPYTHON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'CIRCUITPYTHON')
+
+alarm = types.ModuleType('alarm')
+alarm.sleep_memory = bytearray(SLEEP_MEMORY_SIZE)
+sys.modules['alarm'] = alarm
+
+if CIRCUITPYTHON_DIR not in sys.path:
+    sys.path.insert(0, CIRCUITPYTHON_DIR)
+
+
+def reset_sleep_memory():
+    alarm.sleep_memory[:] = bytes(len(alarm.sleep_memory))
+
+
+def install_sleep_memory(memory):
+    # Replace the sleep memory, e.g. by a larger one or one counting its accesses. Buffers created afterwards use it.
+    alarm.sleep_memory = memory
+    return memory
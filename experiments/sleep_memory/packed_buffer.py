@@ -0,0 +1,172 @@
+"""
+Cyclic buffer of bit-packed fixed-point values, e.g. 12 bit values in 1.5 bytes, and the named codecs it's made from.
+
+It was moved here from CIRCUITPYTHON/utils/sleep_memory.py, as the device doesn't use it: the histories of code.py are
+delta compressed (CyclicDeltaBuffer) at about one byte per value. It stays as the 'packed12' kind of the sleep memory
+benchmark. FixedPointCodec and the bit packing remain on the device for the measurement records.
+
+Import fake_alarm first, it puts the CIRCUITPYTHON folder on the path.
+"""
+import struct
+from array import array
+
+import alarm
+from utils.sleep_memory import CyclicBuffer, FixedPointCodec, pack_bits, unpack_bits
+
+# Named codecs, e.g. for the constructor arguments of a SleepMemoryLayout region
+CODECS = {
+    'temp16': FixedPointCodec(16, 100.0, -40.0),  # 0.01 °C, -40..615.35 °C, as Cyclic16BitTempBuffer
+    'percentage16': FixedPointCodec(16, 100.0),  # 0.01 %, 0..655.35 %, as Cyclic16BitPercentageBuffer
+    'temp12': FixedPointCodec(12, 20.0, -10.0),  # 0.05 °C, -10..194.75 °C
+    'percentage12': FixedPointCodec(12, 10.0),  # 0.1 %, 0..409.5 %
+    'minutes8': FixedPointCodec(8, 1.0),  # 0..255 min
+}
+
+
+class CyclicPackedBuffer(CyclicBuffer):
+    """
+    Cyclic buffer packing fixed-point values at an arbitrary bit width, e.g. 12 bit values take 1.5 bytes.
+
+    The codec is a FixedPointCodec or the name of one in CODECS. Head and tail are value indices instead of byte
+    addresses, since values don't start at byte boundaries. The header field of the bytes per value holds the bit
+    width. The capacity is rounded up to whole groups of values ending at a byte boundary (two values for 12 bit), so
+    a wrap around always starts at the first byte of the ring.
+    """
+
+    def __init__(self, addr, codec, max_value_capacity: int, initialize: bool = False):
+        self.codec = CODECS[codec] if isinstance(codec, str) else codec
+        self.value_scale = self.codec.scale
+        self.value_offset = self.codec.offset
+        self.widths = (self.codec.bits,)
+        self.addr = addr
+        bits = self.codec.bits
+        group_values = 8 // min(bits & -bits, 8)
+        self.value_capacity = -(-max_value_capacity // group_values) * group_values
+        capacity = self.value_capacity * bits // 8
+        assert capacity <= 2 ** 16 - 1
+
+        self._stored_header = bytearray(alarm.sleep_memory[self.addr:self.addr + self.header_size])
+        stored_capacity, stored_bits, head, tail, empty = struct.unpack(self.header_format, self._stored_header)
+        self.capacity = capacity
+        self.bytes_per_value = bits
+        if initialize or stored_capacity != capacity or stored_bits != bits:
+            # Memory wasn't initialized
+            self.head = 0
+            self.tail = 0
+            self.empty = 1
+            self.current_size = 0
+            self.update_header()
+        else:
+            self.head = head
+            self.tail = tail
+            self.empty = empty
+            if self.head == self.tail:
+                self.current_size = 0 if self.empty else self.value_capacity
+            else:
+                self.current_size = (self.head - self.tail) % self.value_capacity
+
+
+    def _index_segments(self, index, amount):
+        # Split `amount` values from value index `index` into at most two contiguous (index, amount) segments
+        first_amount = min(amount, self.value_capacity - index)
+        for segment_index, segment_amount in ((index, first_amount), (0, amount - first_amount)):
+            if segment_amount > 0:
+                yield segment_index, segment_amount
+
+
+    def _byte_span(self, index, amount):
+        # Sleep memory addresses of the bytes holding `amount` values from value index `index`
+        data_start = self.addr + self.header_size
+        bits = self.codec.bits
+        return data_start + index * bits // 8, data_start + -(-(index + amount) * bits // 8)
+
+
+    def _write_raws(self, index, raw_values):
+        # Read-modify-write of the touched bytes, one slice read and write per segment
+        for segment_index, segment_amount in self._index_segments(index, len(raw_values)):
+            start, end = self._byte_span(segment_index, segment_amount)
+            buf = bytearray(alarm.sleep_memory[start:end])
+            pack_bits(buf, segment_index * self.codec.bits % 8, raw_values[:segment_amount], self.widths)
+            alarm.sleep_memory[start:end] = buf
+            raw_values = raw_values[segment_amount:]
+
+
+    def add_value(self, val):
+        self.add_values((val,))
+
+
+    def add_values(self, values):
+        values = list(values)
+        if not values:
+            return
+        self.empty = 0
+        # Values which would be overwritten within this batch anyway are skipped, but still advance the head
+        skipped = max(0, len(values) - self.value_capacity)
+        write_index = (self.head + skipped) % self.value_capacity
+        self._write_raws(write_index, [self.codec.encode_raw(val) for val in values[skipped:]])
+        self.head = (self.head + len(values)) % self.value_capacity
+        if self.current_size + len(values) >= self.value_capacity:
+            # Full capacity: Overwriting oldest data --> move tail along with head
+            self.current_size = self.value_capacity
+            self.tail = self.head
+        else:
+            self.current_size += len(values)
+        self.update_header()
+
+
+    def _read_start(self, amount=None):
+        if amount is None:
+            return self.current_size, self.tail
+        amount = min(self.current_size, amount)
+        return amount, (self.head - amount) % self.value_capacity
+
+
+    def iter_values(self, amount=None, chunk_amount: int = 32):
+        for raw in self.iter_raw(amount, chunk_amount):
+            yield raw / self.value_scale + self.value_offset
+
+
+    def iter_raw(self, amount=None, chunk_amount: int = 32):
+        amount, index = self._read_start(amount)
+        bits = self.codec.bits
+        for segment_index, segment_amount in self._index_segments(index, amount):
+            while segment_amount > 0:
+                slice_amount = min(segment_amount, chunk_amount)
+                start, end = self._byte_span(segment_index, slice_amount)
+                for raw in unpack_bits(alarm.sleep_memory[start:end], slice_amount, self.widths,
+                                       segment_index * bits % 8):
+                    yield raw
+                segment_index += slice_amount
+                segment_amount -= slice_amount
+
+
+    def read_array(self, amount=None):
+        amount, index = self._read_start(amount)
+        values = array('f', bytes(4 * amount))
+        i = 0
+        for segment_index, segment_amount in self._index_segments(index, amount):
+            start, end = self._byte_span(segment_index, segment_amount)
+            for raw in unpack_bits(alarm.sleep_memory[start:end], segment_amount, self.widths,
+                                   segment_index * self.codec.bits % 8):
+                values[i] = raw / self.value_scale + self.value_offset
+                i += 1
+        return values
+
+
+    def make_empty(self):
+        self.head = 0
+        self.tail = 0
+        self.current_size = 0
+        self.empty = 1
+        self.update_header()
+
+
+    def encode(self, val) -> bytearray:
+        buf = bytearray(-(-self.codec.bits // 8))
+        pack_bits(buf, 0, (self.codec.encode_raw(val),), self.widths)
+        return buf
+
+
+    def decode(self, byte_array: bytearray) -> float:
+        raw = next(unpack_bits(byte_array, 1, self.widths))
+        return raw / self.value_scale + self.value_offset
@@ -0,0 +1,96 @@
+"""
+Checks that the incremental PeakDetectorMemory gives the same peak as the batch peak_detect over the raw values of the
+history after every wake.
+
+Replays the growth columns of the release test recordings and random growth curves wake by wake like code.py does:
+all objects are re-created from the sleep memory on each wake, the history is cleared now and then like by a
+recalibration and the ring of the delta compressed history wraps around. Also counts how many wakes needed a rebuild.
+
+Run from this folder: python peak_detector_equivalence.py
+"""
+import csv
+import glob
+import os
+import random
+
+import fake_alarm
+from utils.algorithm import peak_detect
+from utils.sleep_memory import CyclicDeltaPercentageBuffer, PeakDetectorMemory, SleepMemoryLayout, \
+    SleepMemorySession, TieredHistory
+
+RELEASE_TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'release_tests')
+HISTORY_BYTES = 512
+THRESHOLD = 1.0
+WINDOW_SIZE = 7
+
+
+def load(session):
+    layout = SleepMemoryLayout(version=1, session=session, regions=[
+        ('growth', TieredHistory, {'base_class': CyclicDeltaPercentageBuffer,
+                                   'base_kwargs': {'max_bytes': HISTORY_BYTES, 'aggregates': True},
+                                   'tiers': [(128, 8)], 'minutes_per_sample': 4}),
+        ('growth_peak', PeakDetectorMemory, {'threshold': THRESHOLD, 'window_size': WINDOW_SIZE,
+                                             'value_scale': CyclicDeltaPercentageBuffer.value_scale}),
+    ])
+    memory = layout.load()
+    return memory['growth'], memory['growth_peak']
+
+
+def replay(samples: list, clear_probability: float = 0.0) -> int:
+    # Returns the number of wakes with a rebuild of the detector state
+    fake_alarm.reset_sleep_memory()
+    rebuilds = 0
+    for sample in samples:
+        session = SleepMemorySession()
+        growth, detector = load(session)
+        if random.random() < clear_probability:
+            growth.make_empty()
+            detector.reset()
+        count_before = detector.count
+        if sample is None:
+            growth.add_gap(4)
+            detector.sync(growth)
+        else:
+            growth.add_value(sample, minutes=4)
+            detector.update(growth)
+            rebuilds += detector.count != count_before + 1
+        expected = peak_detect(growth.iter_raw(), THRESHOLD * growth.value_scale, WINDOW_SIZE)
+        assert detector.peak_ind == expected, (detector.peak_ind, expected)
+        if expected is not None:
+            assert detector.peak_value == list(growth.iter_values())[expected]
+        session.flush()
+    return rebuilds
+
+
+def release_test_curves() -> dict:
+    curves = {}
+    for path in sorted(glob.glob(os.path.join(RELEASE_TESTS_DIR, '*', 'data_*.csv'))):
+        with open(path) as f:
+            rows = csv.DictReader(line for line in f if not line.startswith('#'))
+            curves[os.path.relpath(path, RELEASE_TESTS_DIR)] = [float(row['growth']) if row['growth'] else None
+                                                                 for row in rows]
+    return curves
+
+
+def random_curve(amount: int) -> list:
+    # Rise, peak and fall of a dough with noise, some missing measurements
+    peak = random.randint(amount // 4, amount)
+    curve = []
+    for i in range(amount):
+        val = 100 + 150 * min(i, peak) / peak - 0.5 * max(0, i - peak) + random.gauss(0, 1.5)
+        curve.append(None if random.random() < 0.03 else val)
+    return curve
+
+
+if __name__ == '__main__':
+    random.seed(1)
+    for name, curve in release_test_curves().items():
+        rebuilds = replay(curve)
+        print(f'{name}: {len(curve)} wakes, {rebuilds} rebuilds, identical')
+    n_wakes = 0
+    n_rebuilds = 0
+    for _ in range(30):
+        curve = random_curve(random.randint(10, 1200))
+        n_rebuilds += replay(curve, clear_probability=0.005)
+        n_wakes += len(curve)
+    print(f'random curves: {n_wakes} wakes, {n_rebuilds} rebuilds, identical')
@@ -0,0 +1,33 @@
+"""
+Compares the per-value and the bulk decode path of CyclicBuffer.read_array on a bytearray-backed sleep memory.
+
+Run from this folder: python read_array_timing.py
+"""
+from timeit import timeit
+
+import fake_alarm
+from utils.sleep_memory import Cyclic16BitTempBuffer, Cyclic16BitPercentageBuffer
+
+GRAPH_WIDTH = 256
+REPETITIONS = 2000
+
+fake_alarm.reset_sleep_memory()
+temp_mem = Cyclic16BitTempBuffer(addr=8, max_value_capacity=GRAPH_WIDTH)
+growth_mem = Cyclic16BitPercentageBuffer(addr=temp_mem.get_last_address(), max_value_capacity=GRAPH_WIDTH)
+temp_mem.fill_randomly(19.0, 29.0)
+growth_mem.fill_randomly(100.0, 150.0)
+# Add some more values such that the ring has wrapped around and reads need two segments
+for i in range(GRAPH_WIDTH // 3):
+    temp_mem.add_value(20.0 + i / 10)
+    growth_mem.add_value(100.0 + i)
+
+for buffer in [temp_mem, growth_mem]:
+    name = type(buffer).__name__
+    per_value = buffer._read_array_per_value(buffer.tail, buffer.current_size)
+    bulk = buffer.read_array()
+    assert all(abs(a - b) < 1e-3 for a, b in zip(per_value, bulk)) and len(per_value) == len(bulk)
+
+    t_before = timeit(lambda: buffer._read_array_per_value(buffer.tail, buffer.current_size), number=REPETITIONS)
+    t_after = timeit(lambda: buffer.read_array(), number=REPETITIONS)
+    print(f'{name}: {buffer.current_size} values, per value {t_before / REPETITIONS * 1e6:.1f}us, '
+          f'bulk {t_after / REPETITIONS * 1e6:.1f}us, speedup {t_before / t_after:.1f}x')
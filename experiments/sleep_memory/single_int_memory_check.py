@@ -0,0 +1,58 @@
+"""
+Checks the invalid value handling of SingleIntMemory with the settings of code.py: on a fresh sleep memory, a setting
+whose default is its invalid value (floor_distance, start_height) reads as None, so code.py loads the floor calibration
+file and asks for the calibration instead of dividing by a start height of 0. Setting None stores the invalid value,
+other values survive a wake, with and without a SleepMemorySession.
+
+Run from this folder: python single_int_memory_check.py
+"""
+import fake_alarm
+from utils.sleep_memory import SingleIntMemory, SleepMemoryLayout, SleepMemorySession
+
+
+def load(session=None):
+    layout = SleepMemoryLayout(version=1, session=session, regions=[
+        ('zoom', SingleIntMemory, {'default_value': 1}),
+        ('floor_distance', SingleIntMemory, {'default_value': 0}),
+        ('start_height', SingleIntMemory, {'default_value': 0}),
+        ('wifi_idx', SingleIntMemory, {'default_value': 0, 'invalid_value': -1, 'size': 1}),
+        ('journal_seq', SingleIntMemory, {'default_value': 0, 'invalid_value': -1, 'size': 4}),
+    ])
+    return layout.load()
+
+
+def check(use_session: bool):
+    fake_alarm.reset_sleep_memory()
+    session = SleepMemorySession() if use_session else None
+    memory = load(session)
+    assert memory['floor_distance'].value is None, 'An uncalibrated floor distance has to read as None'
+    assert memory['start_height'].value is None, 'An uncalibrated start height has to read as None'
+    assert memory['zoom'].value == 1
+    assert memory['wifi_idx'].value == 0 and memory['journal_seq'].value == 0, 'Defaults outside the invalid value'
+
+    memory['floor_distance'].value = 1234
+    memory['start_height'].value = 56
+    memory['journal_seq'].value = 70000
+    if session is not None:
+        session.flush()
+    memory = load(session)
+    assert memory['floor_distance'].value == 1234 and memory['start_height'].value == 56
+    assert memory['journal_seq'].value == 70000
+
+    # A recalibration clears the start height again
+    memory['start_height'].value = None
+    assert memory['start_height'].value is None
+    if session is not None:
+        session.flush()
+    memory = load(session)
+    assert memory['start_height'].value is None and memory['floor_distance'].value == 1234
+
+
+def main():
+    for use_session in (False, True):
+        check(use_session)
+    print('SingleIntMemory: invalid values read as None, with and without a session')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark of the TMF8821 firmware download against a simulated bootloader (fake_tmf8821.py): bytes on the bus, I2C
+transactions and the time per download, on the virtual clock of the bus and the device.
+
+Compares the former download loop (a new frame by concatenation and a 3 byte status read after every chunk, repeated
+at once while the device is busy), replayed here, with TMF8821._download_firmware (one preallocated frame, single byte
+status reads, a wait before polling learned from the previous chunk), at the former bus clock of 125kHz and at faster
+clocks. Afterwards, the full driver start-up is run on the simulated device, which checks the downloaded image.
+
+Run from this folder: python download_benchmark.py [--command-us 100] [--byte-us 1] [--overhead-us 50]
+"""
+import argparse
+import time
+
+import fake_tmf8821
+from tmf8821 import adafruit_tmf8821
+from tmf8821.adafruit_tmf8821 import TMF8821, _TMF882X_FIRMWARE_PATH
+from tmf8821.tmf8821_firmware import TMF882X_FirmwareImage
+
+adafruit_tmf8821.sleep = fake_tmf8821.sleep
+W_RAM = 0x41
+BL_CMD_STAT = 0x08
+CHUNK = 100
+FREQUENCIES = [125000, 400000, 1000000]
+
+
+def download_before(device, firmware: TMF882X_FirmwareImage):
+    image = b''.join(bytes(block) for block in firmware.blocks())
+    status = bytearray(3)
+    for start in range(0, len(image), CHUNK):
+        data = image[start:start + CHUNK]
+        checksum = ((W_RAM + len(data) + sum(data)) & 0xFF) ^ 0xFF
+        device.write(bytes([BL_CMD_STAT]) + bytes([W_RAM, len(data)]) + data + bytes([checksum]))
+        while True:
+            device.write_then_readinto(bytes([BL_CMD_STAT]), status)
+            if status[0] == 0x00:
+                break
+
+
+def download_after(device, firmware: TMF882X_FirmwareImage):
+    tof = TMF8821.__new__(TMF8821)
+    tof._device = fake_tmf8821.I2CDevice(fake_tmf8821.I2C(device=device, frequency=device.frequency), 0x41)
+    tof._download_firmware(firmware)
+
+
+def run(download, frequency: int, args) -> tuple:
+    device = fake_tmf8821.SimulatedTMF8821(args.command_us, args.byte_us, args.overhead_us)
+    device.frequency = frequency
+    with TMF882X_FirmwareImage(_TMF882X_FIRMWARE_PATH) as firmware:
+        t_virtual = fake_tmf8821.clock.now
+        t_host = time.perf_counter()
+        download(device, firmware)
+        t_host = time.perf_counter() - t_host
+        t_virtual = fake_tmf8821.clock.now - t_virtual
+        assert len(device.ram) == firmware.size
+    return device.bus_bytes, device.transactions, t_virtual * 1e3, t_host * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the TMF8821 firmware download on a simulated bootloader.')
+    parser.add_argument('--command-us', type=float, default=100.0, help='busy time of the device per command')
+    parser.add_argument('--byte-us', type=float, default=1.0, help='additional busy time per data byte')
+    parser.add_argument('--overhead-us', type=float, default=50.0, help='host overhead per I2C transaction')
+    args = parser.parse_args()
+
+    print(f'{"variant":<9}{"bus kHz":>9}{"bus bytes":>11}{"transfers":>11}{"bus ms":>9}{"host ms":>9}')
+    for name, download in (('before', download_before), ('after', download_after)):
+        for frequency in FREQUENCIES:
+            bus_bytes, transactions, t_virtual, t_host = run(download, frequency, args)
+            print(f'{name:<9}{frequency // 1000:>9}{bus_bytes:>11}{transactions:>11}{t_virtual:>9.1f}{t_host:>9.1f}')
+
+    # Full start-up of the driver, the simulated device checks every frame and receives the whole image
+    i2c = fake_tmf8821.I2C(frequency=FREQUENCIES[1])
+    TMF8821(i2c)
+    with TMF882X_FirmwareImage(_TMF882X_FIRMWARE_PATH) as firmware:
+        assert i2c.device.ram == b''.join(bytes(block) for block in firmware.blocks())
+    print('Driver start-up on the simulated device: image downloaded correctly, application running')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Host-side stand-in for the CircuitPython modules the TMF8821 driver imports, and a simulated TMF8821 (bootloader and
+the measurements of the application).
+
+Importing this module registers fake `micropython`, `busio`, `adafruit_bus_device` and `adafruit_ticks` modules in
+`sys.modules` and puts CIRCUITPYTHON/lib on the path, such that `tmf8821.adafruit_tmf8821` can be imported on CPython.
+The I2C bus and the device run on a virtual clock: every transaction advances it by its duration on the bus at the
+bus frequency plus a fixed overhead per transaction, and ticks_ms reads it. Replace the driver's `sleep` by `sleep` of
+this module so its waits advance the clock as well.
+"""
+import os
+import sys
+import types
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'CIRCUITPYTHON', 'lib')
+
+_REG_APPID = 0x00
+_REG_BL_CMD_STAT = 0x08
+_REG_CMD_STAT = 0x08
+_REG_CONFIG_RESULT = 0x20
+_REG_RES_CONFIDENCE_0 = 0x38
+_REG_ENABLE = 0xE0
+_REG_INT_STATUS = 0xE1
+_REG_ID = 0xE3
+_BL_DOWNLOAD_INIT = 0x14
+_BL_SET_ADDR = 0x43
+_BL_W_RAM = 0x41
+_BL_RAMREMAP_RESET = 0x11
+_STAT_OK = 0x00
+_STAT_BUSY = 0x01
+_STAT_CSUM_ERROR = 0x02
+_APP_CMD_MEASURE = 0x10
+_APP_CMD_STOP = 0xFF
+_MEASUREMENT_RESULT = 0x10
+_INT_RESULT = 0x02
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0  # seconds
+
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+clock = VirtualClock()
+sleep = clock.sleep
+
+
+class SimulatedTMF8821:
+    """
+    Bootloader of a TMF8821 after power-up: executes DOWNLOAD_INIT, SET_ADDR, W_RAM and RAMREMAP_RESET frames, checks
+    their checksums and stays busy for command_us (plus byte_us per data byte) after each command. Once the application
+    runs, every other command succeeds at once, and MEASURE publishes a result block with synthetic distances every
+    measure_ms until STOP. Counts the bytes and transactions on the bus.
+    """
+    def __init__(self, command_us: float = 100.0, byte_us: float = 1.0, overhead_us: float = 50.0,
+                 measure_ms: float = 10.0):
+        self.command_us = command_us
+        self.byte_us = byte_us
+        self.overhead_us = overhead_us
+        self.measure_ms = measure_ms
+        self.result_ready = None  # time of the next result while measuring
+        self.result_published = None  # time the last result was published
+        self.result_published_bytes = 0  # bus_bytes when the last result was published
+        self.result_number = 0
+        self.frequency = 100000
+        self.registers = bytearray(256)
+        self.registers[_REG_ID] = 0x08
+        self.registers[_REG_ENABLE] = 0x41
+        self.registers[_REG_APPID] = 0x80
+        self.registers[0x01] = 0x29  # ROM v2
+        self.ram = bytearray()
+        self.ram_addr = 0
+        self.busy_until = 0.0
+        self.bus_bytes = 0
+        self.transactions = 0
+
+
+    def reset_counters(self):
+        self.bus_bytes = 0
+        self.transactions = 0
+
+
+    def _transfer(self, n_bytes: int, n_starts: int):
+        # Every byte is 9 clocks (8 bits and the acknowledge), every (repeated) start and the stop about one
+        self.bus_bytes += n_bytes
+        self.transactions += 1
+        clock.now += (9 * n_bytes + n_starts + 1) / self.frequency + self.overhead_us * 1e-6
+
+
+    def write(self, buffer, *, start: int = 0, end: int = None):
+        data = bytes(buffer[start:end])
+        self._transfer(1 + len(data), 1)
+        self._write_registers(data[0], data[1:])
+
+
+    def write_then_readinto(self, out_buffer, in_buffer, *, out_start=0, out_end=None, in_start=0, in_end=None):
+        out_data = bytes(out_buffer[out_start:out_end])
+        in_end = len(in_buffer) if in_end is None else in_end
+        self._transfer(2 + len(out_data) + in_end - in_start, 2)
+        address = out_data[0]
+        for i in range(in_start, in_end):
+            in_buffer[i] = self._read_register(address + i - in_start)
+
+
+    def _read_register(self, address: int) -> int:
+        if address == _REG_BL_CMD_STAT and self.registers[_REG_APPID] == 0x80:
+            return _STAT_BUSY if clock.now < self.busy_until else self.registers[_REG_BL_CMD_STAT]
+        if address == _REG_INT_STATUS and self.result_ready is not None and clock.now >= self.result_ready:
+            self._publish_result()
+        return self.registers[address]
+
+
+    def _publish_result(self):
+        self.result_number = (self.result_number + 1) & 0xFF
+        self.registers[_REG_CONFIG_RESULT] = _MEASUREMENT_RESULT
+        self.registers[0x24:0x27] = bytes([self.result_number, 25, 36])
+        self.registers[0x28:0x38] = (1000 + self.result_number).to_bytes(16, 'little')
+        for i in range(36):
+            distance = 150 + 10 * i + self.result_number % 3
+            self.registers[_REG_RES_CONFIDENCE_0 + 3 * i:_REG_RES_CONFIDENCE_0 + 3 * i + 3] = \
+                bytes([200, distance & 0xFF, distance >> 8])
+        self.registers[_REG_INT_STATUS] |= _INT_RESULT
+        self.result_published = clock.now
+        self.result_published_bytes = self.bus_bytes
+        self.result_ready += self.measure_ms * 1e-3
+
+
+    def _write_registers(self, address: int, data: bytes):
+        if address == _REG_INT_STATUS:
+            # Writing 1 clears the flag
+            self.registers[_REG_INT_STATUS] &= ~data[0] & 0xFF
+            return
+        if address == _REG_CMD_STAT and self.registers[_REG_APPID] == 0x03:
+            if data[0] == _APP_CMD_MEASURE:
+                self.result_ready = clock.now + self.measure_ms * 1e-3
+            elif data[0] == _APP_CMD_STOP:
+                self.result_ready = None
+            self.registers[_REG_CMD_STAT] = _STAT_OK
+            return
+        if address != _REG_BL_CMD_STAT or self.registers[_REG_APPID] != 0x80:
+            self.registers[address:address + len(data)] = data
+            return
+        cmd, size, payload, checksum = data[0], data[1], data[2:-1], data[-1]
+        assert size == len(payload), 'Frame size mismatch'
+        if ((cmd + size + sum(payload)) & 0xFF) ^ 0xFF != checksum:
+            self.registers[_REG_BL_CMD_STAT] = _STAT_CSUM_ERROR
+            return
+        if cmd == _BL_SET_ADDR:
+            self.ram_addr = payload[0] << 8 | payload[1]
+        elif cmd == _BL_W_RAM:
+            self.ram += payload
+        elif cmd == _BL_RAMREMAP_RESET:
+            # Starts the application
+            self.registers[_REG_APPID] = 0x03
+            self.registers[0x01:0x04] = bytes([50, 27, 0x1B])
+        self.registers[_REG_BL_CMD_STAT] = _STAT_OK
+        self.busy_until = clock.now + (self.command_us + self.byte_us * size) * 1e-6
+
+
+# --- Fake CircuitPython modules ---
+
+micropython = types.ModuleType('micropython')
+micropython.const = lambda value: value
+sys.modules['micropython'] = micropython
+
+
+class I2C:
+    def __init__(self, scl=None, sda=None, *, frequency: int = 100000, device: SimulatedTMF8821 = None):
+        self.device = device if device is not None else SimulatedTMF8821()
+        self.device.frequency = frequency
+
+
+busio = types.ModuleType('busio')
+busio.I2C = I2C
+sys.modules['busio'] = busio
+
+
+class I2CDevice:
+    def __init__(self, i2c: I2C, address: int):
+        self.device = i2c.device
+
+
+    def __enter__(self):
+        return self.device
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+adafruit_bus_device = types.ModuleType('adafruit_bus_device')
+i2c_device = types.ModuleType('adafruit_bus_device.i2c_device')
+i2c_device.I2CDevice = I2CDevice
+adafruit_bus_device.i2c_device = i2c_device
+sys.modules['adafruit_bus_device'] = adafruit_bus_device
+sys.modules['adafruit_bus_device.i2c_device'] = i2c_device
+
+adafruit_ticks = types.ModuleType('adafruit_ticks')
+adafruit_ticks.ticks_ms = lambda: int(clock.now * 1000)
+adafruit_ticks.ticks_add = lambda ticks, delta: ticks + delta
+adafruit_ticks.ticks_diff = lambda ticks1, ticks2: ticks1 - ticks2
+adafruit_ticks.ticks_less = lambda ticks1, ticks2: ticks1 < ticks2
+sys.modules['adafruit_ticks'] = adafruit_ticks
+
+if LIB_DIR not in sys.path:
+    sys.path.insert(0, LIB_DIR)
@@ -0,0 +1,103 @@
+"""
+Compares the two ways of getting the TMF8821 firmware into the download loop of the driver: importing the Python
+module with the image as a bytes literal (before), and streaming the compressed binary asset block by block (after).
+Reports the time, the heap and the flash footprint of both.
+
+Both variants run through the same 100 byte chunks and checksums as the download, without the I2C transfers. On
+CircuitPython, the heap is the drop of gc.mem_free() with the garbage collection disabled, i.e. everything allocated
+until the next collection (an upper bound of the peak). Copy this file, tmf8821_image.py and the lib/tmf8821 folder
+to the board and run it there. On CPython (run from this folder: python firmware_asset_benchmark.py) the peak is
+measured with tracemalloc and the module is compiled from source every time, as CircuitPython has no bytecode cache.
+"""
+import os
+import sys
+import time
+import gc
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # CircuitPython
+
+if tracemalloc is not None:
+    HERE = os.path.dirname(os.path.abspath(__file__))
+    DRIVER_DIR = os.path.join(HERE, '..', '..', 'CIRCUITPYTHON', 'lib', 'tmf8821')
+    sys.path.insert(0, DRIVER_DIR)
+    MODULE_PATH = os.path.join(HERE, 'tmf8821_image.py')
+    ASSET_PATH = os.path.join(DRIVER_DIR, 'tmf8821_image.bin')
+    READER_PATH = os.path.join(DRIVER_DIR, 'tmf8821_firmware.py')
+else:
+    sys.path.insert(0, '/lib/tmf8821')
+    MODULE_PATH = 'tmf8821_image.py'
+    ASSET_PATH = '/lib/tmf8821/tmf8821_image.bin'
+    READER_PATH = '/lib/tmf8821/tmf8821_firmware.py'
+from tmf8821_firmware import TMF882X_FirmwareImage
+
+CHUNK = 100  # _TMF882X_BL_MAX_FW_DATA
+REPEATS = 3
+
+
+def download_checksums(blocks) -> int:
+    # What the download loop does with the image apart from the I2C transfers
+    total = 0
+    for block in blocks:
+        for start in range(0, len(block), CHUNK):
+            data = block[start:start + CHUNK]
+            total += ((0x41 + len(data) + sum(data)) & 0xFF) ^ 0xFF
+    return total
+
+
+def from_module() -> int:
+    if tracemalloc is not None:
+        with open(MODULE_PATH) as f:
+            namespace = {}
+            exec(compile(f.read(), MODULE_PATH, 'exec'), namespace)
+        image = namespace['_tof_image3']
+    else:
+        image = __import__('tmf8821_image')._tof_image3
+        del sys.modules['tmf8821_image']
+    return download_checksums([image])
+
+
+def from_asset() -> int:
+    with TMF882X_FirmwareImage(ASSET_PATH) as firmware:
+        return download_checksums(firmware.blocks())
+
+
+def measure(stage):
+    # Result, heap bytes and time in ms of one run
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        t_start = time.perf_counter()
+        result = stage()
+        t_stage = time.perf_counter() - t_start
+        heap = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result, heap, t_stage * 1e3
+    gc.disable()
+    free_before = gc.mem_free()
+    t_start = time.monotonic_ns()
+    result = stage()
+    t_stage = time.monotonic_ns() - t_start
+    heap = free_before - gc.mem_free()
+    gc.enable()
+    return result, heap, t_stage / 1e6
+
+
+def main():
+    results = {}
+    print(f'{"variant":<10}{"heap B":>10}{"ms":>10}{"flash B":>10}')
+    variants = (('module', from_module, [MODULE_PATH]), ('asset', from_asset, [ASSET_PATH, READER_PATH]))
+    for name, stage, files in variants:
+        best = None
+        for _ in range(REPEATS):
+            run = measure(stage)
+            best = run if best is None or run[2] < best[2] else best
+        results[name], heap, t_stage = best
+        flash = sum(os.stat(path)[6] for path in files)
+        print(f'{name:<10}{heap:>10}{t_stage:>10.1f}{flash:>10}')
+    assert results['module'] == results['asset'], 'The asset holds another image than the module'
+
+
+main()
@@ -0,0 +1,108 @@
+"""
+Benchmark of reading and parsing TMF8821 measurements against the simulated device (fake_tmf8821.py): heap allocated
+per measurement, host time of the wait, read and parse, and the bytes on the bus and the time (on the virtual clock
+of the bus) of the read-out, from the poll that finds the result ready until it's parsed, for the 3x3 SPAD map of
+code.py.
+
+Compares the former read (a new 132 byte bytearray per result, two list comprehensions over all 36 results sliced to
+the SPAD map and a namedtuple), replayed here, with TMF8821.wait_for_measurement (one preallocated buffer, the header
+decoded with struct.unpack_from, a zone table per SPAD map and one Measurement filled in place). The heap is the peak
+of tracemalloc above the start of each measurement. CPython allocates every int above 256, e.g. the distances, which
+CircuitPython stores without the heap up to 2**30, so the board allocates even less than shown.
+The zones variant sets result_header = False like code.py and reads only the registers of the 9 zones and cid_rid.
+
+Run from this folder: python measurement_benchmark.py [--measurements 200] [--frequency 400000]
+"""
+import argparse
+import time
+import tracemalloc
+from collections import namedtuple
+
+import fake_tmf8821
+from tmf8821 import adafruit_tmf8821
+from tmf8821.adafruit_tmf8821 import TMF8821
+
+adafruit_tmf8821.sleep = fake_tmf8821.sleep
+REG_INT_STATUS = 0xE1
+REG_CONFIG_RESULT = 0x20
+REG_MEASURE_STATUS = 0x05
+MEASUREMENT_SIZE = 132
+Measurement = namedtuple('Measurement', 'result_number temperature number_valid_results ambient_light photon_count '
+                                        'reference_count sys_tick confidences distances')
+
+
+def wait_before(tof: TMF8821, timeout_ms: int):
+    # The former TMF8821.wait_for_measurement and parse_measurement_data for the 3x3 maps
+    with tof._device as i2c:
+        while True:
+            interrupts = bytearray(1)
+            i2c.write_then_readinto(bytes([REG_INT_STATUS]), interrupts)
+            if interrupts[0] & 0x02:
+                break
+        i2c.write(bytes([REG_INT_STATUS, 0x02]))
+        raw_data = bytearray(MEASUREMENT_SIZE)
+        i2c.write_then_readinto(bytes([REG_CONFIG_RESULT]), raw_data)
+        status = bytearray(1)
+        i2c.write_then_readinto(bytes([REG_MEASURE_STATUS]), status)
+    confidences = [raw_data[i - 0x20] for i in range(0x38, 0xA1 + 1, 3)]
+    distances = [raw_data[i - 0x20] + (raw_data[i + 1 - 0x20] << 8) for i in range(0x39, 0xA2 + 1, 3)]
+    if tof.config.spad_map[:3] == '3x3':
+        confidences = confidences[:3 * 3]
+        distances = distances[:3 * 3]
+    return Measurement(raw_data[4], raw_data[5], raw_data[6], int.from_bytes(raw_data[8:12], 'little'),
+                       int.from_bytes(raw_data[12:16], 'little'), int.from_bytes(raw_data[16:20], 'little'),
+                       int.from_bytes(raw_data[20:24], 'little'), confidences, distances)
+
+
+def wait_after(tof: TMF8821, timeout_ms: int):
+    return tof.wait_for_measurement(timeout_ms)
+
+
+def run(wait, result_header: bool, n_measurements: int, frequency: int) -> tuple:
+    i2c = fake_tmf8821.I2C(frequency=frequency)
+    tof = TMF8821(i2c)
+    tof.config.spad_map = '3x3_normal_mode'
+    tof.result_header = result_header
+    tof.start_measurements()
+    wait(tof, 500)  # The zone table of the driver is built with the first measurement
+    device = i2c.device
+    device.reset_counters()
+    peak = 0
+    t_host = 0.0
+    t_read_out = 0.0
+    read_out_bytes = 0
+    distances = None
+    for _ in range(n_measurements):
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        t_start = time.perf_counter()
+        measurement = wait(tof, 500)
+        t_host += time.perf_counter() - t_start
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - start)
+        tracemalloc.stop()
+        t_read_out += fake_tmf8821.clock.now - device.result_published
+        read_out_bytes += device.bus_bytes - device.result_published_bytes
+        distances = list(measurement.distances)
+    tof.stop_measurements()
+    return peak, t_host / n_measurements * 1e6, read_out_bytes / n_measurements, t_read_out / n_measurements * 1e3, \
+        distances
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark reading TMF8821 measurements on a simulated device.')
+    parser.add_argument('--measurements', type=int, default=200, help='measurements per variant')
+    parser.add_argument('--frequency', type=int, default=400000, help='I2C bus clock in Hz')
+    args = parser.parse_args()
+
+    results = {}
+    print(f'{"variant":<9}{"heap B":>8}{"host us":>9}{"read-out B":>12}{"read-out ms":>13}')
+    for name, wait, result_header in (('before', wait_before, True), ('after', wait_after, True),
+                                      ('zones', wait_after, False)):
+        peak, t_host, read_out_bytes, t_read_out, results[name] = run(wait, result_header, args.measurements,
+                                                                      args.frequency)
+        print(f'{name:<9}{peak:>8}{t_host:>9.1f}{read_out_bytes:>12.0f}{t_read_out:>13.3f}')
+    assert results['before'] == results['after'] == results['zones'], 'All variants have to decode the same distances'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Packs the TMF8821 firmware image (_tof_image3 of tmf8821_image.py) into the binary asset the driver streams during the
+download, CIRCUITPYTHON/lib/tmf8821/tmf8821_image.bin, or tmf8821_image_raw.bin with --raw.
+
+The image is cut into blocks of --block-size bytes, a multiple of the driver's download chunk of 100 bytes, which are
+zlib compressed one by one: the device decompresses one block at a time and never holds the whole image. The driver
+streams the raw asset instead on a CircuitPython build without the zlib module (e.g. 7.3.3), so both are shipped.
+
+Run from this folder: python pack_firmware.py [--block-size 1000] [--raw] [--output ../../CIRCUITPYTHON/lib/...]
+"""
+import argparse
+import os
+import struct
+import sys
+import zlib
+
+DRIVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'CIRCUITPYTHON', 'lib', 'tmf8821')
+sys.path.insert(0, DRIVER_DIR)
+from tmf8821_firmware import _MAGIC, _HEADER_FORMAT, TMF882X_FirmwareImage
+from tmf8821_image import _tof_image3
+
+DEFAULT_OUTPUT = '../../CIRCUITPYTHON/lib/tmf8821/tmf8821_image.bin'
+DEFAULT_RAW_OUTPUT = '../../CIRCUITPYTHON/lib/tmf8821/tmf8821_image_raw.bin'
+DOWNLOAD_CHUNK = 100  # _TMF882X_BL_MAX_FW_DATA of the driver
+
+
+def pack(image: bytes, block_size: int, compress: bool) -> bytes:
+    blocks = [image[i:i + block_size] for i in range(0, len(image), block_size)]
+    if compress:
+        blocks = [zlib.compress(block, 9) for block in blocks]
+    header = struct.pack(_HEADER_FORMAT, _MAGIC, len(image), block_size, max(len(block) for block in blocks),
+                         int(compress))
+    return header + b''.join(struct.pack('<H', len(block)) + block for block in blocks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack the TMF8821 firmware into a compressed binary asset.')
+    parser.add_argument('--block-size', type=int, default=1000, help='image bytes per block')
+    parser.add_argument('--raw', action='store_true', help='store the blocks uncompressed')
+    parser.add_argument('--output', help='asset to write')
+    args = parser.parse_args()
+    if args.output is None:
+        args.output = DEFAULT_RAW_OUTPUT if args.raw else DEFAULT_OUTPUT
+    assert args.block_size % DOWNLOAD_CHUNK == 0 and args.block_size < 65536
+
+    with open(args.output, 'wb') as f:
+        f.write(pack(_tof_image3, args.block_size, not args.raw))
+    # Read it back like the driver does
+    with TMF882X_FirmwareImage(args.output) as firmware:
+        assert b''.join(bytes(block) for block in firmware.blocks()) == _tof_image3
+    print(f'Wrote {args.output}: {os.path.getsize(args.output)} bytes for the {len(_tof_image3)} byte image')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Energy model of the two TMF8821 power strategies of code.py (TOF_POWER):
+
+- off: the I2C rail is cut during the deep sleep, every wake cold-boots the sensor and downloads the firmware, writes
+  the configuration and loads the factory calibration while the ESP32-S2 is awake.
+- standby: the rail stays powered and the sensor sleeps in STANDBY, every wake only wakes its CPU. The rail also
+  keeps the other I2C sensors powered, their idle current counts as well.
+
+Per wake, standby pays the standby current over the whole sleep, off pays the awake time of the cold start. The break
+even sleep time is cold start charge / standby current; 'auto' in code.py keeps the sensor powered for shorter sleeps.
+The defaults are estimates: measure the standby current of the actual boards (a power LED on the rail alone draws
+about a milliampere) and take the download time from download_benchmark.py.
+
+Run from this folder: python standby_energy_model.py [--awake-ma 40] [--cold-start-s 0.3] [--standby-ua 60]
+"""
+import argparse
+
+INTERVALS = [1, 2, 4, 8, 12, 30, 60]  # minutes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the TMF8821 power strategies per sleep interval.')
+    parser.add_argument('--awake-ma', type=float, default=40.0, help='current of the awake board')
+    parser.add_argument('--cold-start-s', type=float, default=0.3,
+                        help='firmware download, configuration and calibration time of a cold start')
+    parser.add_argument('--standby-ua', type=float, default=60.0,
+                        help='current drawn from the I2C rail with the TMF8821 in standby and the other sensors idle')
+    args = parser.parse_args()
+
+    cold_start_mas = args.awake_ma * args.cold_start_s
+    break_even_s = cold_start_mas / (args.standby_ua / 1000)
+    print(f'Cold start: {cold_start_mas:.1f}mAs per wake, standby: {args.standby_ua:.0f}uA, '
+          f'break even at a sleep of {break_even_s / 60:.1f} minutes')
+    print(f'{"interval":>9}{"off mAs":>10}{"standby mAs":>13}{"off mAh/d":>11}{"standby mAh/d":>15}  best')
+    for minutes in INTERVALS:
+        standby_mas = args.standby_ua / 1000 * minutes * 60
+        wakes_per_day = 24 * 60 / minutes
+        best = 'standby' if standby_mas < cold_start_mas else 'off'
+        print(f'{minutes:>8}m{cold_start_mas:>10.1f}{standby_mas:>13.1f}{cold_start_mas * wakes_per_day / 3600:>11.2f}'
+              f'{standby_mas * wakes_per_day / 3600:>15.2f}  {best}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,3 @@
-from micropython import const
-
 # Adapted from https://github.com/adafruit/Adafruit_CircuitPython_SSD1325/blob/main/adafruit_ssd1325.py
 
 '''